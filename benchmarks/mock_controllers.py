@@ -0,0 +1,419 @@
+"""
+Local stand-in servers for APIC, vManage, NFVIS and NetBox, seeded from tests/mock_data_*.json and scaled up to
+realistic sizes. Every response can be delayed to simulate the latency of a real controller
+"""
+import copy
+import json
+import os
+import re
+import ssl
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, unquote, parse_qs, urlencode
+
+MOCK_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests')
+
+
+def load_mock_data(name):
+    """
+    Loads one of the mock data files of the tests
+    :param name: The name of the controller, e.g. apic for tests/mock_data_apic.json
+    :return: The parsed JSON data
+    """
+    with open(os.path.join(MOCK_DATA_DIR, f'mock_data_{name}.json')) as f:
+        return json.load(f)
+
+
+def _clone(template, replacements):
+    """Deep copies a JSON template and applies string replacements to all its values"""
+    text = json.dumps(template)
+    for old, new in replacements:
+        text = text.replace(old, new)
+
+    return json.loads(text)
+
+
+def _self_signed_context():
+    """Creates a TLS server context with a temporary self-signed certificate for 127.0.0.1"""
+    import datetime
+    import ipaddress
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]),
+                           critical=False)
+            .sign(key, hashes.SHA256()))
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert_file = os.path.join(directory, 'cert.pem')
+        key_file = os.path.join(directory, 'key.pem')
+        with open(cert_file, 'wb') as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        with open(key_file, 'wb') as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                      serialization.NoEncryption()))
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+
+    return context
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and the body without waiting for delayed ACKs of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        with self.server.lock:
+            self.server.request_count += 1
+
+        status, data, headers = self.server.route(method, unquote(url.path), query, body, self.headers)
+
+        if isinstance(data, (bytes, str)):
+            payload = data.encode() if isinstance(data, str) else data
+            content_type = 'text/plain'
+        else:
+            payload = json.dumps(data).encode()
+            content_type = 'application/json'
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+
+class MockController(ThreadingHTTPServer):
+    """
+    Base class of the mock controllers. The server runs in a background thread on 127.0.0.1, with an optional
+    self-signed TLS certificate for the clients which always use HTTPS
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+    tls = False
+
+    def __init__(self, latency=0.0):
+        """
+        :param latency: The number of seconds every response is delayed by
+        """
+        super(MockController, self).__init__(('127.0.0.1', 0), MockHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self._thread = None
+
+        if self.tls:
+            # The handshake runs in the handler thread on first read, not in the accepting thread
+            self.socket = _self_signed_context().wrap_socket(self.socket, server_side=True,
+                                                             do_handshake_on_connect=False)
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def route(self, method, path, query, body, headers):
+        """
+        Returns the response of a request
+        :return: A tuple (status code, JSON data or text, headers)
+        """
+        raise NotImplementedError
+
+
+class MockAPIC(MockController):
+    """
+    APIC with one pod of `nodes` leaf/spine nodes with `interfaces` physical interfaces each, and `tenants` tenants
+    with two bridge domains each. Supports login, aaaRefresh, wcard filters and page/page-size pagination
+    """
+    def __init__(self, nodes=100, interfaces=48, tenants=100, latency=0.0):
+        super(MockAPIC, self).__init__(latency)
+        self.data = self._build(load_mock_data('apic'), nodes, interfaces, tenants)
+        self.node_dns = [x['fabricNode']['attributes']['dn'] for x in self.data['node/mo/topology/pod-1.json']]
+        self.tenant_dns = [x['fvTenant']['attributes']['dn'] for x in self.data['node/class/fvTenant.json']]
+
+    @property
+    def url(self):
+        return f"http://{self.address}/api/"
+
+    @staticmethod
+    def _build(seed, nodes, interfaces, tenants):
+        data = {'node/class/fabricPod.json': seed['node/class/fabricPod.json']}
+        node_template = seed['node/mo/topology/pod-1.json'][0]
+        mgmt_path = 'node/mo/topology/pod-1/node-101/sys/ipv4/inst/dom-management/if-[mgmt0].json'
+        intfs_path = 'node/class/topology/pod-1/node-101/l1PhysIf.json'
+        loopbacks_path = 'node/class/topology/pod-1/node-101/l3LbRtdIf.json'
+        loopback_ip_path = 'node/mo/topology/pod-1/node-101/sys/ipv4/inst/dom-overlay-1/if-[lo0].json'
+
+        fabric_nodes, addresses, all_intfs, all_loopbacks = [], [], [], []
+        for index in range(nodes):
+            node_id = str(101 + index)
+            replacements = [('node-101', f'node-{node_id}'), ('leaf101', f'leaf{node_id}'),
+                            ('"101"', f'"{node_id}"'), ('10.48.1.101', f'10.48.{index // 250}.{index % 250 + 1}'),
+                            ('10.0.80.64', f'10.0.{80 + index // 250}.{index % 250}')]
+            fabric_nodes.append(_clone(node_template, replacements))
+
+            for path in (mgmt_path, loopbacks_path, loopback_ip_path):
+                data[path.replace('node-101', f'node-{node_id}')] = _clone(seed[path], replacements)
+            addresses += data[mgmt_path.replace('node-101', f'node-{node_id}')]
+            addresses += data[loopback_ip_path.replace('node-101', f'node-{node_id}')]
+            all_loopbacks += data[loopbacks_path.replace('node-101', f'node-{node_id}')]
+
+            intf_templates = seed[intfs_path]
+            intfs = [_clone(intf_templates[x % len(intf_templates)],
+                            replacements + [(f'eth1/{x % len(intf_templates) + 1}', f'eth1/{x + 1}')])
+                     for x in range(interfaces)]
+            data[intfs_path.replace('node-101', f'node-{node_id}')] = intfs
+            all_intfs += intfs
+
+        data['node/mo/topology/pod-1.json'] = fabric_nodes
+        data['node/class/ipv4Addr.json'] = addresses
+        data['node/class/l1PhysIf.json'] = all_intfs
+        data['node/class/ethpmLbRtdIf.json'] = all_loopbacks
+
+        tenant_template = seed['node/class/fvTenant.json'][-1]
+        data['node/class/fvTenant.json'] = [_clone(tenant_template, [('prod', f'tenant{x}')]) for x in range(tenants)]
+        for index in range(tenants):
+            data[f'node/mo/uni/tn-tenant{index}.json'] = _clone(seed['node/mo/uni/tn-prod.json'],
+                                                                [('tn-prod', f'tn-tenant{index}')])
+
+        return data
+
+    def _login(self):
+        attributes = {'token': 'benchmark-token', 'refreshTimeoutSeconds': '600'}
+        return 200, {'totalCount': '1', 'imdata': [{'aaaLogin': {'attributes': attributes}}]}, \
+            {'Set-Cookie': 'APIC-cookie=benchmark-token; path=/'}
+
+    def route(self, method, path, query, body, headers):
+        path = path[len('/api/'):]
+        if path in ('aaaLogin.json', 'aaaRefresh.json'):
+            return self._login()
+
+        imdata = self.data.get(path, [])
+        if 'query-target-filter' in query:
+            match = re.match(r'wcard\((\w+)\.(\w+),"(.*)"\)', query['query-target-filter'])
+            if match:
+                class_name, prop, pattern = match.groups()
+                regex = re.compile(pattern)
+                imdata = [x for x in imdata if regex.search(x[class_name]['attributes'][prop])]
+
+        total_count = len(imdata)
+        if 'page-size' in query:
+            page_size = int(query['page-size'])
+            page = int(query.get('page', 0))
+            imdata = imdata[page * page_size:(page + 1) * page_size]
+
+        return 200, {'totalCount': str(total_count), 'imdata': imdata}, None
+
+
+class MockVManage(MockController):
+    """
+    vManage with `devices` devices, `policies` policies of each type, `tunnels` tunnels per device in the approute
+    statistics and `statistics_rows` rows behind the scroll API
+    """
+    tls = True
+
+    def __init__(self, devices=1000, policies=200, tunnels=4, statistics_rows=100000, latency=0.0):
+        super(MockVManage, self).__init__(latency)
+        seed = load_mock_data('vmanage')
+        self.devices = [_clone(seed['devices'][x % len(seed['devices'])], [])
+                        for x in range(devices)]
+        for index, device in enumerate(self.devices):
+            device['system-ip'] = device['deviceId'] = f"10.{index // 62500}.{index // 250 % 250}.{index % 250 + 1}"
+            device['host-name'] = f"vedge{index + 1}"
+        self.device_ips = [x['system-ip'] for x in self.devices]
+
+        self.policies = [{'definitionId': f"{x:08d}", 'listId': f"{x:08d}", 'policyId': f"{x:08d}",
+                          'name': f"policy{x}", 'type': 'zoneBasedFW', 'description': 'benchmark',
+                          'sequences': [{'sequenceId': y, 'sequenceName': f"rule{y}"} for y in range(10)]}
+                         for x in range(policies)]
+        self.tunnels = tunnels
+        self.statistics_rows = statistics_rows
+
+    @property
+    def host(self):
+        return '127.0.0.1'
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def _aggregation(self, query):
+        devices = next(x['value'] for x in query['query']['rules'] if x['field'] == 'vdevice_name')
+        time_rule = next(x for x in query['query']['rules'] if x['field'] == 'entry_time')
+        interval = query['aggregation']['histogram']['interval'] * 3600 * 1000
+        if time_rule['operator'] == 'between':
+            start, end = (int(x) for x in time_rule['value'])
+        else:
+            end = int(time.time() * 1000) // interval * interval
+            start = end - int(time_rule['value'][0]) * 3600 * 1000
+
+        rows = []
+        for device in devices:
+            for tunnel in range(self.tunnels):
+                name = f"{device}:biz-internet-10.255.0.{tunnel}:biz-internet"
+                for entry_time in range(start // interval * interval, end, interval):
+                    rows.append({'vdevice_name': device, 'name': name, 'entry_time': entry_time, 'count': 12,
+                                 'loss_percentage': 0.1, 'vqoe_score': 9.5, 'latency': 20 + tunnel, 'jitter': 1.5,
+                                 'rx_octets': 123456, 'tx_octets': 654321})
+
+        return {'data': rows}
+
+    def _scroll(self, query):
+        count = int(query.get('count', 10000))
+        offset = int(query.get('scrollId', 0))
+        rows = [{'vdevice_name': self.device_ips[x % len(self.device_ips)], 'entry_time': x, 'latency': x % 100,
+                 'loss_percentage': 0.0} for x in range(offset, min(offset + count, self.statistics_rows))]
+        has_more = offset + count < self.statistics_rows
+
+        return {'data': rows, 'pageInfo': {'scrollId': str(offset + count), 'hasMoreData': has_more,
+                                           'count': len(rows)}}
+
+    def route(self, method, path, query, body, headers):
+        if path == '/j_security_check':
+            return 200, '', {'Set-Cookie': 'JSESSIONID=benchmark; Path=/; HttpOnly'}
+        if path == '/dataservice/client/token':
+            return 200, 'benchmark-token', None
+        if path == '/dataservice/device':
+            return 200, {'data': self.devices}, None
+        if path in ('/dataservice/template/policy/list/dataprefix', '/dataservice/template/policy/security',
+                    '/dataservice/template/policy/definition/zonebasedfw'):
+            return 200, {'data': self.policies}, None
+        if path.startswith('/dataservice/template/policy/definition/zonebasedfw/'):
+            return 200, self.policies[int(path.rsplit('/', 1)[1]) % len(self.policies)], None
+        if path == '/dataservice/statistics/approute/fec/aggregation':
+            return 200, self._aggregation(json.loads(body)), None
+        if path.startswith('/dataservice/statistics/') and path.endswith('/page'):
+            return 200, self._scroll(query), None
+
+        return 404, {'error': {'message': f"Unknown path {path}"}}, None
+
+
+class MockNFVIS(MockController):
+    """
+    NFVIS server with the platform details, physical NICs and switch interfaces of the mock data. All servers of a
+    fleet are simulated by the same mock, as the clients only differ by the hostname
+    """
+    tls = True
+
+    def __init__(self, latency=0.0):
+        super(MockNFVIS, self).__init__(latency)
+        seed = load_mock_data('nfvis')
+        self.responses = {
+            '/api/operational/platform-detail': {'platform_info:platform-detail':
+                                                 seed['platform_info:platform-detail']},
+            '/api/operational/pnics': {'pnic:pnics': seed['pnic:pnics']},
+            '/api/operational/switch/interface/status': {'switch:status': seed['switch:status']},
+            '/api/operational/switch/interface/switchPort': {'switch:switchPort': seed['switch:switchPort']}
+        }
+
+    def route(self, method, path, query, body, headers):
+        if path in self.responses:
+            return 200, self.responses[path], None
+
+        return 404, {'error': f"Unknown path {path}"}, None
+
+
+class MockNetBox(MockController):
+    """
+    NetBox with `devices` devices, `prefixes` prefixes and `ip_addresses` IP addresses assigned to the interfaces of
+    the devices, with limit/offset pagination and bulk PATCH of devices
+    """
+    def __init__(self, devices=5000, prefixes=2000, ip_addresses=5000, latency=0.0):
+        super(MockNetBox, self).__init__(latency)
+        seed = load_mock_data('netbox')
+
+        self.data = {'dcim/devices': [], 'ipam/prefixes': [], 'ipam/ip-addresses': []}
+        for index in range(devices):
+            device = copy.deepcopy(seed['devices'][index % len(seed['devices'])])
+            device.update({'id': index + 1, 'name': f"device{index + 1}", 'serial': f"SN{index % (devices - 10)}",
+                           'primary_ip': None})
+            self.data['dcim/devices'].append(device)
+        for index in range(prefixes):
+            prefix = copy.deepcopy(seed['prefixes'][index % len(seed['prefixes'])])
+            prefix.update({'id': index + 1, 'prefix': f"10.{index // 256 % 256}.{index % 256}.0/24",
+                           'vrf': None if index % 4 else {'id': index % 3 + 1, 'name': f"vrf{index % 3 + 1}"}})
+            self.data['ipam/prefixes'].append(prefix)
+        for index in range(ip_addresses):
+            ip_address = copy.deepcopy(seed['ip_addresses'][index % len(seed['ip_addresses'])])
+            device_id = index % devices + 1
+            ip_address.update({'id': index + 1, 'address': f"10.{index // 256 % 256}.{index % 256}.1/24",
+                               'vrf': None, 'assigned_object_type': 'dcim.interface',
+                               'assigned_object_id': index + 1,
+                               'assigned_object': {'id': index + 1, 'name': 'GigabitEthernet0/0',
+                                                   'device': {'id': device_id, 'name': f"device{device_id}"}}})
+            self.data['ipam/ip-addresses'].append(ip_address)
+
+    @property
+    def url(self):
+        return f"http://{self.address}"
+
+    def route(self, method, path, query, body, headers):
+        endpoint = path[len('/api/'):].strip('/')
+        if endpoint not in self.data:
+            return 404, {'detail': 'Not found.'}, None
+
+        if method == 'PATCH':
+            updates = json.loads(body)
+            return 200, updates, None
+
+        results = self.data[endpoint]
+        if query.get('has_primary_ip') == 'False':
+            results = [x for x in results if not x.get('primary_ip')]
+        if 'assigned_object_type' in query:
+            results = [x for x in results if x.get('assigned_object_type') == query['assigned_object_type']]
+
+        limit = int(query.get('limit', 50)) or len(results)
+        offset = int(query.get('offset', 0))
+        page = results[offset:offset + limit]
+        next_url = None
+        if offset + limit < len(results):
+            next_url = f"{self.url}{path}?{urlencode({**query, 'limit': limit, 'offset': offset + limit})}"
+
+        return 200, {'count': len(results), 'next': next_url, 'previous': None, 'results': page}, None
@@ -0,0 +1,359 @@
+"""
+Benchmarks of the public getters against the local mock controllers.
+
+    python -m benchmarks.run                                # run and compare with benchmarks/baseline.json
+    python -m benchmarks.run --output results.json          # also record the results
+    python -m benchmarks.run --save-baseline                # store the results as the new baseline
+    python -m benchmarks.run --latency 0.02 --filter apic   # slower controllers, APIC getters only
+
+The exit code is 1 if a benchmark is slower than the baseline by more than the tolerance
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+
+from benchmarks.mock_controllers import MockAPIC, MockVManage, MockNFVIS, MockNetBox, load_mock_data
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+DEFAULT_SIZES = {
+    'apic_nodes': 100,
+    'apic_interfaces': 48,
+    'apic_tenants': 100,
+    'vmanage_devices': 1000,
+    'vmanage_policies': 200,
+    'vmanage_statistics_rows': 100000,
+    'nfvis_hosts': 20,
+    'netbox_devices': 5000,
+    'netbox_prefixes': 2000,
+    'netbox_ip_addresses': 5000,
+    'parsing_interfaces': 1000
+}
+
+
+@contextlib.contextmanager
+def apic_benchmarks(sizes, latency):
+    from network_automation.apic import CiscoACI, AsyncCiscoACI
+
+    with MockAPIC(sizes['apic_nodes'], sizes['apic_interfaces'], sizes['apic_tenants'], latency) as server:
+        apic = CiscoACI(server.url, username='admin', password='password')
+        node, tenant = server.node_dns[0], server.tenant_dns[0].split('/')[-1]
+
+        def fabric_inventory():
+            async def collect():
+                async with AsyncCiscoACI(server.url, username='admin', password='password') as async_apic:
+                    return await async_apic.get_fabric_inventory()
+            return asyncio.run(collect())
+
+        yield {
+            'apic.get_aci_pods': apic.get_aci_pods,
+            'apic.get_aci_nodes': lambda: apic.get_aci_nodes('topology/pod-1'),
+            'apic.get_node_mgmt_ip': lambda: apic.get_node_mgmt_ip(node),
+            'apic.get_physical_intfs': lambda: apic.get_physical_intfs(node),
+            'apic.get_l3_loopbacks': lambda: apic.get_l3_loopbacks(node),
+            'apic.get_all_node_mgmt_ips': apic.get_all_node_mgmt_ips,
+            'apic.get_all_physical_intfs': apic.get_all_physical_intfs,
+            'apic.get_all_l3_loopbacks': apic.get_all_l3_loopbacks,
+            'apic.get_tenants': apic.get_tenants,
+            'apic.get_tenant_bridge_domains': lambda: apic.get_tenant_bridge_domains(tenant),
+            'apic.async.get_fabric_inventory': fabric_inventory
+        }
+
+
+@contextlib.contextmanager
+def vmanage_benchmarks(sizes, latency):
+    from network_automation.vmanage import VManage, AsyncVManage, TunnelMetricsCollector
+
+    with MockVManage(sizes['vmanage_devices'], sizes['vmanage_policies'],
+                     statistics_rows=sizes['vmanage_statistics_rows'], latency=latency) as server:
+        vmanage = VManage(server.host, server.port, 'admin', 'password')
+        compact = VManage(server.host, server.port, 'admin', 'password', compact=True)
+        device_ips = server.device_ips
+        policy_ids = [x['definitionId'] for x in server.policies]
+
+        def collect_tunnel_metrics():
+            collector = TunnelMetricsCollector(vmanage)
+            collector.collect(device_ips)
+            return collector.query()
+
+        def zbf_policies_by_id():
+            async def collect():
+                async with AsyncVManage(server.host, server.port, 'admin', 'password') as async_vmanage:
+                    return await async_vmanage.get_zbf_policies_by_id(policy_ids)
+            return asyncio.run(collect())
+
+        yield {
+            'vmanage.get_all_devices': vmanage.get_all_devices,
+            'vmanage.get_all_devices.compact': compact.get_all_devices,
+            'vmanage.get_prefix_lists': vmanage.get_prefix_lists,
+            'vmanage.get_security_policies': vmanage.get_security_policies,
+            'vmanage.get_zbf_policies': vmanage.get_zbf_policies,
+            'vmanage.get_zbf_policy': lambda: vmanage.get_zbf_policy(policy_ids[0]),
+            'vmanage.get_tunnel_metrics': lambda: vmanage.get_tunnel_metrics(device_ips[0], ['10.255.0.1']),
+            'vmanage.get_fleet_tunnel_metrics': lambda: vmanage.get_fleet_tunnel_metrics(device_ips),
+            'vmanage.iter_statistics': lambda: sum(1 for _ in vmanage.iter_statistics('approute', raw=True)),
+            'vmanage.collector.collect': collect_tunnel_metrics,
+            'vmanage.async.get_zbf_policies_by_id': zbf_policies_by_id
+        }
+
+
+@contextlib.contextmanager
+def nfvis_benchmarks(sizes, latency):
+    from network_automation.nfvis import NFVISServer, collect_nfvis_inventory
+
+    with MockNFVIS(latency) as server:
+        nfvis = NFVISServer(server.address, 'admin', 'password', verify=False)
+        # The fleet is simulated by the same mock server
+        hostnames = [server.address] * sizes['nfvis_hosts']
+
+        yield {
+            'nfvis.get_platform_details': lambda: nfvis.get_platform_details(refresh=True),
+            'nfvis.get_interfaces': nfvis.get_interfaces,
+            'nfvis.get_switch_interfaces': nfvis.get_switch_interfaces,
+            'nfvis.get_switchport_status': nfvis.get_switchport_status,
+            'nfvis.get_inventory': nfvis.get_inventory,
+            'nfvis.collect_nfvis_inventory': lambda: collect_nfvis_inventory(hostnames, 'admin', 'password',
+                                                                             verify=False)
+        }
+
+
+@contextlib.contextmanager
+def netbox_benchmarks(sizes, latency):
+    from network_automation.netbox import NetBoxInstance, NetBoxSync
+
+    with MockNetBox(sizes['netbox_devices'], sizes['netbox_prefixes'], sizes['netbox_ip_addresses'],
+                    latency) as server:
+        netbox = NetBoxInstance(server.url, token='benchmark-token')
+        # Every tenth device has a new serial number
+        discovered = [{'name': x['name'], 'serial': x['serial'] + ('-new' if x['id'] % 10 == 0 else '')}
+                      for x in server.data['dcim/devices']]
+        device_sync = NetBoxSync(netbox, 'dcim.devices', key='name')
+
+        yield {
+            'netbox.duplicated_device_serials': netbox.duplicated_device_serials,
+            'netbox.get_ip_addresses_without_prefix': netbox.get_ip_addresses_without_prefix,
+            'netbox.get_prefixes': netbox.get_prefixes,
+            'netbox.get_prefixes.compact': lambda: netbox.get_prefixes(compact=True),
+            'netbox.iter_all.ip_addresses': lambda: list(netbox.iter_all('ipam.ip_addresses')),
+            'netbox.bulk_assign_primary_ip': lambda: netbox.bulk_assign_primary_ip(dry_run=True),
+            'netbox.sync.devices': lambda: device_sync.sync(discovered, dry_run=True)['update']
+        }
+
+
+@contextlib.contextmanager
+def offline_benchmarks(sizes, latency):
+    from network_automation.ipam import PrefixIndex
+    from network_automation.parsing import parse_output
+    from network_automation.records import IOSIPInterface, wrap
+
+    rows = ['Interface              IP-Address      OK? Method Status                Protocol']
+    rows += [f"GigabitEthernet0/{x:<10} 10.{x // 256 % 256}.{x % 256}.1     YES NVRAM  up                    up"
+             for x in range(sizes['parsing_interfaces'])]
+    output = '\n'.join(rows)
+    parsed = [dict(x) for x in load_mock_data('cisco')['ip_int_brief']] * (sizes['parsing_interfaces'] // 4)
+
+    prefixes = PrefixIndex(f"10.{x // 256 % 256}.{x % 256}.0/24" for x in range(sizes['netbox_prefixes']))
+    addresses = [f"10.{x // 256 % 256}.{x % 256}.{x % 200 + 1}" for x in range(sizes['netbox_ip_addresses'])]
+
+    yield {
+        'parsing.parse_output': lambda: parse_output('cisco_ios', 'show ip interface brief', output),
+        'records.wrap.mydict': lambda: wrap(parsed, IOSIPInterface, compact=False),
+        'records.wrap.compact': lambda: wrap(parsed, IOSIPInterface, compact=True),
+        'ipam.prefix_index.lookup': lambda: [prefixes.lookup(x) for x in addresses]
+    }
+
+
+# The modules which tests/test_imports.py checks for side effects
+IMPORT_SCRIPT = ('import network_automation.cisco, network_automation.environment, network_automation.parsing, '
+                 'network_automation.utils')
+
+
+@contextlib.contextmanager
+def import_benchmarks(sizes, latency):
+    import network_automation
+
+    # Each run imports the package in a fresh interpreter, so a dependency which is imported eagerly again shows up as
+    # a regression. The duration includes the interpreter start-up
+    env = {**os.environ, 'PYTHONPATH': os.path.dirname(os.path.dirname(network_automation.__file__))}
+
+    yield {
+        'import.network_automation': lambda: subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], env=env,
+                                                            check=True)
+    }
+
+
+GROUPS = [import_benchmarks, offline_benchmarks, apic_benchmarks, vmanage_benchmarks, nfvis_benchmarks, netbox_benchmarks]
+
+
+def measure(func, repeat):
+    """
+    Runs a getter once to warm up, then `repeat` times
+    :return: A dictionary with the latency statistics in milliseconds and the throughput
+    """
+    result = func()
+    if isinstance(result, int):
+        items = result
+    else:
+        items = len(result) if hasattr(result, '__len__') else 1
+
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+
+    durations.sort()
+    median = statistics.median(durations)
+
+    return {
+        'runs': repeat,
+        'items': items,
+        'min_ms': round(durations[0] * 1000, 3),
+        'median_ms': round(median * 1000, 3),
+        'mean_ms': round(statistics.mean(durations) * 1000, 3),
+        'p95_ms': round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 3),
+        'calls_per_sec': round(1 / median, 2) if median else None,
+        'items_per_sec': round(items / median, 2) if median else None
+    }
+
+
+def calibrate(repeat=30):
+    """
+    Times a fixed pure Python workload (JSON encoding and decoding, sorting and regex matching), which measures the
+    speed of the machine. The medians are compared with the baseline relative to it, so a baseline recorded on other
+    hardware is still meaningful
+    :return: The fastest duration of the workload in milliseconds, which is the least affected by other processes
+    """
+    import re
+
+    document = [{'dn': f'topology/pod-1/node-{x}/sys/phys-[eth1/{x % 48}]', 'id': x, 'tags': ['a', 'b'],
+                 'descr': 'calibration'} for x in range(2000)]
+    pattern = re.compile(r'node-(\d+)/sys/phys-\[(.*?)\]')
+
+    def workload():
+        rows = json.loads(json.dumps(document))
+        rows.sort(key=lambda x: x['dn'])
+        return [pattern.search(x['dn']).groups() for x in rows]
+
+    workload()
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        workload()
+        durations.append(time.perf_counter() - started)
+
+    return round(min(durations) * 1000, 3)
+
+
+def run(sizes, latency, repeat, name_filter=None):
+    results = {}
+    for group in GROUPS:
+        with group(sizes, latency) as benchmarks:
+            for name, func in benchmarks.items():
+                if name_filter and name_filter not in name:
+                    continue
+                results[name] = measure(func, repeat)
+                print(f"{name:<45} {results[name]['median_ms']:>10.3f} ms {results[name]['items']:>10} items",
+                      file=sys.stderr)
+
+    return results
+
+
+def compare(results, baseline, tolerance, speed=1.0):
+    """
+    Compares the median latencies with the baseline
+    :param speed: The calibration time of this machine divided by the one of the baseline machine, which scales the
+    baseline medians
+    :return: The list of regressions, as tuples (name, scaled baseline median, median)
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]['median_ms'] * speed
+        if result['median_ms'] > expected * (1 + tolerance):
+            regressions.append((name, expected, result['median_ms']))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the network_automation getters against mock "
+                                                 "controllers")
+    parser.add_argument('--latency', type=float, default=0.0, help="response delay of the mock controllers (s)")
+    parser.add_argument('--repeat', type=int, default=5, help="number of measured runs of each getter")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplier of the dataset sizes")
+    parser.add_argument('--filter', help="only run the benchmarks containing this string")
+    parser.add_argument('--output', help="file to record the results as JSON")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline file to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="allowed slowdown against the baseline, e.g. 0.5 for 50%%")
+    args = parser.parse_args(argv)
+
+    # The clients disable TLS verification for the self-signed mock certificates. requests prefers a CA bundle from
+    # the environment over session.verify=False, so it is removed
+    for name in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(name, None)
+    warnings.filterwarnings('ignore', message='Unverified HTTPS request')
+    logging.disable(logging.CRITICAL)
+
+    sizes = {name: max(1, int(size * args.scale)) for name, size in DEFAULT_SIZES.items()}
+    calibration_ms = calibrate()
+    results = run(sizes, args.latency, args.repeat, args.filter)
+    calibration_ms = min(calibration_ms, calibrate())
+    for result in results.values():
+        # The median in units of the calibration workload, comparable across machines
+        result['relative'] = round(result['median_ms'] / calibration_ms, 4)
+    report = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+                 'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'calibration_ms': calibration_ms,
+                 'latency': args.latency, 'repeat': args.repeat, 'sizes': sizes,
+                 'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one", file=sys.stderr)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['meta']['sizes'] != sizes or baseline['meta']['latency'] != args.latency:
+        print("The baseline was recorded with different sizes or latency, the comparison is not meaningful",
+              file=sys.stderr)
+
+    # Baselines without a calibration are compared as recorded, and so are runs with latency, which are dominated by
+    # the response delays instead of the speed of the machine
+    speed = calibration_ms / baseline['meta'].get('calibration_ms', calibration_ms) if not args.latency else 1.0
+    if abs(speed - 1) > 0.1:
+        print(f"This machine is {1 / speed:.2f}x the speed of the baseline machine, the baseline is scaled",
+              file=sys.stderr)
+
+    regressions = compare(results, baseline['results'], args.tolerance, speed)
+    for name, expected, actual in regressions:
+        print(f"REGRESSION {name}: {actual:.3f} ms (baseline {expected:.3f} ms)", file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,43 +1,129 @@
+import asyncio
+import functools
+import json
+import logging
 import os
 import re
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
 from network_automation import environment
+from network_automation.metrics import registry as metrics
+from network_automation.cache import CachingSession, new_session
+from network_automation.jsonstream import JSONArrayStream
 
+NODE_DN_RE = re.compile(r'^(topology/pod-\d+/node-\d+)/')
 
-class CiscoACI:
-    def __init__(self, url, username=None, password=None):
-        apic_auth_data = {
-            "aaaUser": {
-                "attributes": {
-                    "name": username or environment.get_cisco_username(),
-                    "pwd": password or environment.get_cisco_password()
-                }
+
+def _auth_data(username, password):
+    environment.load_environment()
+
+    return {
+        "aaaUser": {
+            "attributes": {
+                "name": username or environment.get_cisco_username(),
+                "pwd": password or environment.get_cisco_password()
             }
         }
+    }
+
+
+def _node_mgmt_ip_path(path):
+    return f"node/mo/{path}/sys/ipv4/inst/dom-management/if-[mgmt0].json?query-target=children&target-subtree-class=ipv4Addr"
+
+
+def _physical_intfs_path(path):
+    return f"node/class/{path}/l1PhysIf.json?rsp-subtree=children&rsp-subtree-class=ethpmPhysIf"
+
+
+def _l3_loopbacks_path(path):
+    return f"node/class/{path}/l3LbRtdIf.json?query-target=children&target-subtree-class=ethpmLbRtdIf"
+
+
+def _loopback_ip_path(path, intf_id):
+    return f"node/mo/{path}/sys/ipv4/inst/dom-overlay-1/if-[{intf_id}].json?query-target=children&target-subtree-class=ipv4Addr"
+
+
+def _node_dn(dn):
+    """Returns the DN of the node of a managed object, e.g. topology/pod-1/node-101"""
+    match = NODE_DN_RE.match(dn)
+    return match.group(1) if match else None
+
+
+def _query_class(url_path):
+    # The class of the returned objects: the first target-subtree-class, or the class of a class query, which is the
+    # last path segment of both class/<class>.json and node/class/<dn>/<class>.json
+    match = (re.search(r'target-subtree-class=(\w+)', url_path) or
+             re.search(r'(?:^|/)class/(?:[^?]*/)?(\w+)\.json', url_path))
+    return match.group(1) if match else None
+
+
+def _physical_intf(mo):
+    return {
+        'name': mo['l1PhysIf']['attributes']['id'],
+        'admin_status': mo['l1PhysIf']['attributes']['adminSt'],
+        'desc': mo['l1PhysIf']['attributes']['descr'],
+        'mode': mo['l1PhysIf']['attributes']['mode'],
+        'mac': mo['l1PhysIf']['children'][0]['ethpmPhysIf']['attributes']['backplaneMac']
+    }
+
+
+class CiscoACI:
+    def __init__(self, url, username=None, password=None, page_size=10000, cache=None):
+        """
+        :param cache: Optional ResponseCache for the GET requests, e.g. tenants and bridge domains
+        """
+        self._auth_data = _auth_data(username, password)
 
         self.url = url
+        # Number of managed objects requested per page by the class queries
+        self.page_size = page_size
         self.auth_url = self.url + "aaaLogin.json"
 
-        self.session = requests.session()
+        self.session = new_session(cache, 'apic', self._auth_data['aaaUser']['attributes']['name'])
         self.session.verify = False
-        self.session.post(self.auth_url, json=apic_auth_data, verify=False)
+        self.login()
+
+    def login(self):
+        """
+        Logs in with aaaLogin, e.g. again after the login token expired
+        :return: The login token
+        """
+        with metrics.time_connect('apic'):
+            response = self.session.post(self.auth_url, json=self._auth_data, verify=False)
+
+        # The token is needed to open the websocket for subscriptions
+        try:
+            self.token = response.json()['imdata'][0]['aaaLogin']['attributes']['token']
+        except (ValueError, IndexError, KeyError):
+            self.token = None
+
+        return self.token
+
+    def refresh_token(self):
+        """
+        Refreshes the login token with aaaRefresh, to keep long-running sessions (e.g. subscriptions) logged in
+        :return: The new token
+        """
+        response = self.session.get(self.url + "aaaRefresh.json")
+        self.token = response.json()['imdata'][0]['aaaLogin']['attributes']['token']
+
+        return self.token
 
     def get_aci_pods(self):
         fabric_class = "node/class/fabricPod.json"
-        fabric_url = self.url + fabric_class
 
-        aci_fabrics = self.session.get(fabric_url)
-        return [x['fabricPod']['attributes']['dn'] for x in aci_fabrics.json()['imdata']]
+        return [x['fabricPod']['attributes']['dn'] for x in self.iter_class(fabric_class)]
 
     def get_aci_nodes(self, pod):
         node_class = f"node/mo/{pod}.json?query-target=children&target-subtree-class=fabricNode"
-        node_url = self.url + node_class
 
-        return [x['fabricNode']['attributes'] for x in self.session.get(node_url).json()['imdata']]
+        return [x['fabricNode']['attributes'] for x in self.iter_class(node_class)]
 
     def get_node_mgmt_ip(self, path):
-        mgmt_intf_class = f"node/mo/{path}/sys/ipv4/inst/dom-management/if-[mgmt0].json?query-target=children&target-subtree-class=ipv4Addr"
-        mgmt_intf_url = self.url + mgmt_intf_class
+        mgmt_intf_url = self.url + _node_mgmt_ip_path(path)
 
         result = self.session.get(mgmt_intf_url).json()
 
@@ -50,31 +136,16 @@ class CiscoACI:
         return mgmt_ip
 
     def get_physical_intfs(self, path):
-        physical_intfs_class = f"node/class/{path}/l1PhysIf.json?rsp-subtree=children&rsp-subtree-class=ethpmPhysIf"
-        physical_intfs_url = self.url + physical_intfs_class
-        physical_intfs = self.session.get(physical_intfs_url).json()
-
-        result = [{
-            'name': x['l1PhysIf']['attributes']['id'],
-            'admin_status': x['l1PhysIf']['attributes']['adminSt'],
-            'desc': x['l1PhysIf']['attributes']['descr'],
-            'mode': x['l1PhysIf']['attributes']['mode'],
-            'mac': x['l1PhysIf']['children'][0]['ethpmPhysIf']['attributes']['backplaneMac']
-        } for x in physical_intfs['imdata']]
-
-        return result
+        return [_physical_intf(x) for x in self.iter_class(_physical_intfs_path(path))]
 
     def get_l3_loopbacks(self, path):
-        loopback_intfs_class = f"node/class/{path}/l3LbRtdIf.json?query-target=children&target-subtree-class=ethpmLbRtdIf"
-        loopback_intfs_url = self.url + loopback_intfs_class
-        loopback_intfs = self.session.get(loopback_intfs_url).json()['imdata']
+        loopback_intfs = self._get_class(_l3_loopbacks_path(path))
 
         for intf in loopback_intfs:
             intf_id_match = re.search(r'\[(.*?)\]', intf['ethpmLbRtdIf']['attributes']['dn'])
             if intf_id_match:
                 intf['id'] = intf_id_match.group(1)
-                loopback_ip_class = f"node/mo/{path}/sys/ipv4/inst/dom-overlay-1/if-[{intf['id']}].json?query-target=children&target-subtree-class=ipv4Addr"
-                loopback_ip_url = self.url + loopback_ip_class
+                loopback_ip_url = self.url + _loopback_ip_path(path, intf['id'])
                 try:
                     intf['ipv4_addr'] = self.session.get(loopback_ip_url).json()['imdata'][0]['ipv4Addr']['attributes']['addr']
                 except KeyError:
@@ -82,6 +153,64 @@ class CiscoACI:
 
         return loopback_intfs
 
+    def get_all_node_mgmt_ips(self):
+        """
+        Gets the management IP address of all nodes in the fabric with a single class query
+        :return: A dictionary with the node DN (e.g. topology/pod-1/node-101) as key and the IP address as value
+        """
+        addresses = self.iter_class('node/class/ipv4Addr.json?'
+                                    'query-target-filter=wcard(ipv4Addr.dn,"/dom-management/if-\\[mgmt0\\]/")&'
+                                    'rsp-prop-include=naming-only')
+
+        return {_node_dn(x['ipv4Addr']['attributes']['dn']): x['ipv4Addr']['attributes']['addr'] for x in addresses}
+
+    def get_all_physical_intfs(self):
+        """
+        Gets the physical interfaces of all nodes in the fabric with a single class query
+        :return: A dictionary with the node DN as key and the list of interfaces (as in get_physical_intfs) as value
+        """
+        physical_intfs = self.iter_class("node/class/l1PhysIf.json?rsp-subtree=children&rsp-subtree-class=ethpmPhysIf")
+
+        result = defaultdict(list)
+        for intf in physical_intfs:
+            result[_node_dn(intf['l1PhysIf']['attributes']['dn'])].append(_physical_intf(intf))
+
+        return dict(result)
+
+    def get_all_l3_loopbacks(self):
+        """
+        Gets the L3 loopbacks of all nodes in the fabric with their IPv4 address, using two class queries instead of
+        one query per loopback
+        :return: A dictionary with the node DN as key and the list of loopbacks (as in get_l3_loopbacks) as value
+        """
+        loopback_intfs = self._get_class("node/class/ethpmLbRtdIf.json")
+        addresses = self._get_class('node/class/ipv4Addr.json?'
+                                    'query-target-filter=wcard(ipv4Addr.dn,"/dom-overlay-1/if-\\[lo")&'
+                                    'rsp-prop-include=naming-only')
+
+        # (node DN, interface ID) -> IPv4 address
+        loopback_ips = {}
+        for address in addresses:
+            dn = address['ipv4Addr']['attributes']['dn']
+            intf_id_match = re.search(r'/if-\[(.*?)\]/', dn)
+            if intf_id_match:
+                loopback_ips[(_node_dn(dn), intf_id_match.group(1))] = address['ipv4Addr']['attributes']['addr']
+
+        result = defaultdict(list)
+        for intf in loopback_intfs:
+            dn = intf['ethpmLbRtdIf']['attributes']['dn']
+            node_dn = _node_dn(dn)
+            intf_id_match = re.search(r'\[(.*?)\]', dn)
+            if intf_id_match:
+                intf['id'] = intf_id_match.group(1)
+                if (node_dn, intf['id']) in loopback_ips:
+                    intf['ipv4_addr'] = loopback_ips[(node_dn, intf['id'])]
+                else:
+                    logging.warning(f"Could not get IP address for interface {intf['id']} of {node_dn}")
+            result[node_dn].append(intf)
+
+        return dict(result)
+
     def get_tenants(self):
         tenants = self._get_class("node/class/fvTenant.json")
 
@@ -92,7 +221,471 @@ class CiscoACI:
 
         return [x['fvBD']['attributes']['name'] for x in bds]
 
+    def iter_class(self, url_path, page_size=None):
+        """
+        Yields the managed objects returned by a query as they are parsed from the response, following the APIC
+        page/page-size pagination. Memory use is bounded by the size of one managed object, not of the class
+        :param url_path: The query, relative to the API URL (e.g. node/class/fvCEp.json)
+        :param page_size: The number of managed objects per page, defaults to the page_size of the instance
+        :return: A generator of managed objects
+        """
+        page_size = page_size or self.page_size
+        # The pages are only consistent when the objects are sorted, the default order of the APIC may change between
+        # page requests
+        order_class = _query_class(url_path)
+        if order_class and 'order-by=' not in url_path:
+            url_path += f"{'&' if '?' in url_path else '?'}order-by={order_class}.dn"
+        separator = '&' if '?' in url_path else '?'
+        page = 0
+
+        while True:
+            page_url = f"{self.url}{url_path}{separator}page={page}&page-size={page_size}"
+            # Queries with a TTL in the response cache are read whole, so that the response can be stored
+            stream = not (isinstance(self.session, CachingSession) and self.session.cache.get_ttl(page_url) is not None)
+            with self.session.get(page_url, stream=stream) as response:
+                if response.status_code != 200:
+                    raise ConnectionError(f"Query {url_path} failed with status {response.status_code}: "
+                                          f"{response.text}")
+
+                page_mos = JSONArrayStream(response.iter_content(chunk_size=65536), 'imdata')
+                count = 0
+                for mo in page_mos:
+                    count += 1
+                    yield mo
+
+            page += 1
+            # Without totalCount, the last page is the first one which isn't full
+            if count < page_size:
+                break
+            if 'totalCount' in page_mos.extra and page * page_size >= int(page_mos.extra['totalCount']):
+                break
+
     def _get_class(self, url_path):
-        class_url = self.url + url_path
+        return list(self.iter_class(url_path))
+
+
+class APICSubscriber:
+    """
+    Keeps a local cache of APIC managed objects current from the events of query subscriptions (subscription=yes),
+    pushed by the APIC over a websocket. The subscriptions and the login token are refreshed before they expire.
+    When the websocket closes, it logs in again, reconnects and subscribes to all queries again.
+    Requires the websocket-client package
+    """
+    # Number of events kept for subscription IDs which are not registered yet
+    pending_events = 1000
+
+    def __init__(self, apic, refresh_interval=30, reconnect_interval=5):
+        """
+        :param apic: A logged in CiscoACI instance
+        :param refresh_interval: The interval in seconds between refreshes of the subscriptions (they expire after 60)
+        :param reconnect_interval: The initial delay in seconds before reconnecting a closed websocket, doubled after
+        each failed attempt
+        """
+        self.apic = apic
+        self.refresh_interval = refresh_interval
+        self.reconnect_interval = reconnect_interval
+
+        self._lock = threading.Lock()
+        # subscription ID -> query
+        self.subscriptions = {}
+        # query -> {dn: managed object}
+        self._cache = {}
+        # query -> list of callbacks called with (status, dn, managed object) for each change
+        self._callbacks = defaultdict(list)
+        # (subscription ID, managed objects) of events received before their subscription query returned
+        self._pending = deque(maxlen=self.pending_events)
+
+        self._websocket = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Opens the websocket and starts the refresh thread. This must be done before subscribing
+        :return:
+        """
+        try:
+            import websocket  # noqa: F401
+        except ImportError:
+            raise ImportError("APIC subscriptions require the websocket-client package")
+
+        opened = threading.Event()
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._websocket_loop, args=(opened,), daemon=True),
+            threading.Thread(target=self._refresh_loop, daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        if not opened.wait(timeout=30):
+            self.stop()
+            raise ConnectionError(f"Could not open the websocket to {self.apic.url.split('/api/')[0]}")
+
+    def stop(self):
+        """
+        Closes the websocket and stops refreshing the subscriptions
+        :return:
+        """
+        self._stop.set()
+        if self._websocket:
+            self._websocket.close()
+            self._websocket = None
+
+    def subscribe(self, url_path, callback=None):
+        """
+        Runs a query with subscription=yes and caches the returned managed objects. The cache is then updated from
+        the events of the subscription
+        :param url_path: The query, relative to the API URL (e.g. node/class/fvTenant.json)
+        :param callback: Optional function called with (status, dn, managed object) for each change
+        :return: The subscription ID
+        """
+        if callback:
+            with self._lock:
+                self._callbacks[url_path].append(callback)
+
+        return self._subscribe(url_path)
+
+    def resubscribe(self):
+        """
+        Subscribes to all queries again, e.g. after a reconnect. The cache is rebuilt from the query results, and the
+        callbacks are called for the changes missed in between
+        :return:
+        """
+        with self._lock:
+            queries = list(self._cache)
+            self.subscriptions.clear()
+            self._pending.clear()
+
+        for url_path in queries:
+            self._subscribe(url_path)
+
+    def get_objects(self, url_path):
+        """
+        Returns the cached managed objects of a subscribed query
+        :param url_path: The subscribed query
+        :return: A list of managed objects
+        """
+        with self._lock:
+            return list(self._cache.get(url_path, {}).values())
+
+    def refresh(self):
+        """
+        Refreshes all subscriptions, so that the APIC doesn't expire them
+        :return:
+        """
+        for subscription_id in list(self.subscriptions):
+            response = self.apic.session.get(f"{self.apic.url}subscriptionRefresh.json?id={subscription_id}")
+            if response.status_code != 200:
+                logging.error(f"Failed to refresh APIC subscription {subscription_id}: {response.text}")
+
+    def handle_event(self, message):
+        """
+        Applies a subscription event to the cache and calls the change callbacks. Events of a subscription which is
+        not registered yet (its query hasn't returned) are kept, and applied once it is
+        :param message: The event, as JSON string or dictionary
+        :return:
+        """
+        if isinstance(message, (str, bytes)):
+            message = json.loads(message)
+
+        changes = []
+        with self._lock:
+            for subscription_id in message.get('subscriptionId', []):
+                url_path = self.subscriptions.get(subscription_id)
+                if url_path is None:
+                    self._pending.append((subscription_id, message.get('imdata', [])))
+                else:
+                    changes.extend(self._apply(url_path, message.get('imdata', [])))
+
+        for callback, status, dn, mo in changes:
+            callback(status, dn, mo)
+
+    def _subscribe(self, url_path):
+        separator = '&' if '?' in url_path else '?'
+        result = self.apic.session.get(f"{self.apic.url}{url_path}{separator}subscription=yes").json()
+        subscription_id = result['subscriptionId']
+        objects = {self._attributes(x)['dn']: x for x in result['imdata']}
+
+        changes = []
+        with self._lock:
+            # After a reconnect, the differences to the previous cache are the changes missed in between
+            previous = self._cache.get(url_path)
+            if previous is not None:
+                for dn, mo in previous.items():
+                    if dn not in objects:
+                        changes.append(('deleted', dn, mo))
+                for dn, mo in objects.items():
+                    if dn not in previous:
+                        changes.append(('created', dn, mo))
+                    elif mo != previous[dn]:
+                        changes.append(('modified', dn, mo))
+            changes = [(callback, status, dn, mo) for status, dn, mo in changes for callback in self._callbacks[url_path]]
+
+            self.subscriptions[subscription_id] = url_path
+            self._cache[url_path] = objects
+
+            # Events which arrived before the query returned
+            pending = [imdata for pending_id, imdata in self._pending if pending_id == subscription_id]
+            if pending:
+                self._pending = deque(((pending_id, imdata) for pending_id, imdata in self._pending
+                                       if pending_id != subscription_id), maxlen=self.pending_events)
+            for imdata in pending:
+                changes.extend(self._apply(url_path, imdata))
+
+        for callback, status, dn, mo in changes:
+            callback(status, dn, mo)
+
+        return subscription_id
+
+    def _apply(self, url_path, imdata):
+        # Must be called with the lock held, returns the callback calls for the changes
+        cache = self._cache[url_path]
+        changes = []
+        for mo in imdata:
+            attributes = self._attributes(mo)
+            dn = attributes['dn']
+            status = attributes.get('status') or 'modified'
+
+            if status == 'deleted':
+                cache.pop(dn, None)
+            elif status == 'modified' and dn in cache:
+                # Modification events only contain the changed attributes
+                self._attributes(cache[dn]).update(attributes)
+            else:
+                cache[dn] = mo
+
+            changes.extend((callback, status, dn, cache.get(dn, mo)) for callback in self._callbacks[url_path])
+
+        return changes
+
+    def _websocket_loop(self, opened):
+        import ssl
+        import websocket
+
+        delay = self.reconnect_interval
+        reconnect = False
+        while not self._stop.is_set():
+            if reconnect:
+                try:
+                    # The token in the websocket URL may have expired with the connection
+                    self.apic.login()
+                except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                    logging.error(f"Failed to log in to the APIC to reconnect the websocket: {e}")
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, 300)
+                    continue
+
+            def on_open(ws, reconnect=reconnect):
+                nonlocal delay
+                delay = self.reconnect_interval
+                if reconnect:
+                    try:
+                        self.resubscribe()
+                    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                        logging.error(f"Failed to subscribe to the APIC queries again: {e}")
+                        ws.close()
+                        return
+                opened.set()
+
+            ws_url = re.sub(r'^http', 'ws', self.apic.url.split('/api/')[0]) + f"/socket{self.apic.token}"
+            self._websocket = websocket.WebSocketApp(ws_url, on_open=on_open, on_message=self._on_message,
+                                                     on_error=self._on_error)
+            self._websocket.run_forever(sslopt={'cert_reqs': ssl.CERT_NONE})
+
+            if self._stop.is_set():
+                break
+            logging.warning(f"APIC websocket closed, reconnecting in {delay} seconds")
+            reconnect = True
+            self._stop.wait(delay)
+            delay = min(delay * 2, 300)
+
+    def _on_message(self, ws, message):
+        self.handle_event(message)
+
+    @staticmethod
+    def _on_error(ws, error):
+        logging.error(f"APIC websocket error: {error}")
+
+    def _refresh_loop(self):
+        # The login token expires after 600 seconds by default, refresh it every few subscription refreshes
+        last_token_refresh = time.monotonic()
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                if time.monotonic() - last_token_refresh > 240:
+                    self.apic.refresh_token()
+                    last_token_refresh = time.monotonic()
+                self.refresh()
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                logging.error(f"Failed to refresh APIC subscriptions: {e}")
+
+    @staticmethod
+    def _attributes(mo):
+        return next(iter(mo.values()))['attributes']
+
+
+class AsyncCiscoACI:
+    """
+    asyncio version of CiscoACI, with the same methods as coroutines. The requests are sent on a pooled HTTP session
+    from a thread pool, with at most `concurrency` requests in flight. The login token is refreshed with aaaRefresh
+    before it expires, and a new login is done if the APIC rejects the token
+    """
+    def __init__(self, url, username=None, password=None, concurrency=16, verify=False, cache=None):
+        self.url = url
+        self.auth_url = self.url + "aaaLogin.json"
+        self.refresh_url = self.url + "aaaRefresh.json"
+        self.concurrency = concurrency
+        self._auth_data = _auth_data(username, password)
+
+        self.session = new_session(cache, 'apic', self._auth_data['aaaUser']['attributes']['name'])
+        self.session.verify = verify
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+        self._auth_lock = None
+        self.token = None
+        self.token_expiry = 0
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def _set_token(self, response, action):
+        response.raise_for_status()
+        attributes = response.json()['imdata'][0][action]['attributes']
+        self.token = attributes['token']
+        # Refresh the token when half of its lifetime has passed
+        self.token_expiry = time.monotonic() + int(attributes.get('refreshTimeoutSeconds', 600)) / 2
+
+    async def login(self):
+        """
+        Logs in to the APIC and stores the session token
+        :return:
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._auth_lock = asyncio.Lock()
+
+        with metrics.time_connect('apic'):
+            response = await self._run(self.session.post, self.auth_url, json=self._auth_data)
+        self._set_token(response, 'aaaLogin')
+
+    async def refresh(self):
+        """
+        Refreshes the session token with aaaRefresh, or logs in again if the refresh fails
+        :return:
+        """
+        response = await self._run(self.session.get, self.refresh_url)
+        if response.status_code == 200:
+            self._set_token(response, 'aaaLogin')
+        else:
+            await self.login()
+
+    async def _get(self, url_path):
+        if self._semaphore is None:
+            await self.login()
+
+        if time.monotonic() > self.token_expiry:
+            async with self._auth_lock:
+                if time.monotonic() > self.token_expiry:
+                    await self.refresh()
+
+        token = self.token
+        async with self._semaphore:
+            response = await self._run(self.session.get, self.url + url_path)
+
+        if response.status_code in (401, 403):
+            # The token expired or was invalidated, log in again once
+            metrics.count_retry('apic', 'token_expired')
+            async with self._auth_lock:
+                if self.token == token:
+                    await self.login()
+            async with self._semaphore:
+                response = await self._run(self.session.get, self.url + url_path)
+
+        return response.json()
+
+    async def get_aci_pods(self):
+        result = await self._get("node/class/fabricPod.json")
+
+        return [x['fabricPod']['attributes']['dn'] for x in result['imdata']]
+
+    async def get_aci_nodes(self, pod):
+        result = await self._get(f"node/mo/{pod}.json?query-target=children&target-subtree-class=fabricNode")
+
+        return [x['fabricNode']['attributes'] for x in result['imdata']]
+
+    async def get_node_mgmt_ip(self, path):
+        result = await self._get(_node_mgmt_ip_path(path))
+
+        try:
+            return result['imdata'][0]['ipv4Addr']['attributes']['addr']
+        except (IndexError, KeyError):
+            logging.warning(f"Could not get management IP address for {path}: {result}")
+            return None
+
+    async def get_physical_intfs(self, path):
+        result = await self._get(_physical_intfs_path(path))
+
+        return [_physical_intf(x) for x in result['imdata']]
+
+    async def get_l3_loopbacks(self, path):
+        loopback_intfs = (await self._get(_l3_loopbacks_path(path)))['imdata']
+
+        async def get_loopback_ip(intf):
+            intf_id_match = re.search(r'\[(.*?)\]', intf['ethpmLbRtdIf']['attributes']['dn'])
+            if intf_id_match:
+                intf['id'] = intf_id_match.group(1)
+                result = await self._get(_loopback_ip_path(path, intf['id']))
+                try:
+                    intf['ipv4_addr'] = result['imdata'][0]['ipv4Addr']['attributes']['addr']
+                except (IndexError, KeyError):
+                    logging.warning(f"Could not get IP address for interface {intf['id']}")
+
+        await asyncio.gather(*[get_loopback_ip(x) for x in loopback_intfs])
+
+        return loopback_intfs
+
+    async def get_tenants(self):
+        tenants = await self._get_class("node/class/fvTenant.json")
+
+        return [x['fvTenant']['attributes']['name'] for x in tenants]
+
+    async def get_tenant_bridge_domains(self, tenant_name):
+        bds = await self._get_class(f"node/mo/uni/{tenant_name}.json?query-target=children&target-subtree-class=fvBD")
+
+        return [x['fvBD']['attributes']['name'] for x in bds]
+
+    async def _get_class(self, url_path):
+        return (await self._get(url_path))['imdata']
+
+    async def get_fabric_inventory(self):
+        """
+        Collects all nodes of all pods with their management IP and physical interfaces, running the requests
+        of all pods and nodes in parallel
+        :return: A list of node attributes, with the additional keys 'mgmt_ip' and 'physical_intfs'
+        """
+        pods = await self.get_aci_pods()
+        nodes = [node for pod_nodes in await asyncio.gather(*[self.get_aci_nodes(x) for x in pods])
+                 for node in pod_nodes]
+
+        async def get_node_details(node):
+            node['mgmt_ip'], node['physical_intfs'] = await asyncio.gather(self.get_node_mgmt_ip(node['dn']),
+                                                                           self.get_physical_intfs(node['dn']))
+            return node
 
-        return self.session.get(class_url).json()['imdata']
+        return await asyncio.gather(*[get_node_details(x) for x in nodes])
@@ -0,0 +1,265 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import requests
+from collections import OrderedDict
+from requests.structures import CaseInsensitiveDict
+from network_automation.metrics import instrument_session
+
+# Authentication, token refresh and subscription requests must always reach the controller, whatever the TTLs
+NEVER_CACHED_RE = re.compile(r'aaaLogin|aaaRefresh|aaaLogout|subscriptionRefresh|subscription=yes|j_security_check|'
+                             r'/client/token|/logout', re.IGNORECASE)
+# Response headers which are not stored with the cached responses
+PRIVATE_HEADERS = ('set-cookie',)
+
+
+class ResponseCache(object):
+    """
+    Cache for the responses of GET requests, shared by the REST clients. The entries are kept in an in-memory LRU and
+    optionally in a directory on disk, so that they survive the script. Only the endpoints with a TTL are cached
+    """
+    def __init__(self, ttls=None, default_ttl=None, max_entries=1024, path=None):
+        """
+        :param ttls: A dictionary with URL regular expressions as keys and the TTLs in seconds as values, e.g.
+        {r'/class/fvTenant': 3600}. The first matching expression is used
+        :param default_ttl: The TTL of the data queries which don't match any expression, None to not cache them.
+        Authentication, token refresh and subscription requests are never cached
+        :param max_entries: The maximum number of responses kept in memory
+        :param path: Optional directory to store the responses on disk
+        """
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or {}).items()]
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def get_ttl(self, url):
+        """
+        Returns the TTL of an endpoint
+        :param url: The URL of the request
+        :return: The TTL in seconds, or None if the endpoint is not cached
+        """
+        if NEVER_CACHED_RE.search(url):
+            return None
+
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+
+        return self.default_ttl
+
+    def get(self, key):
+        """
+        Returns a cached response, expired or not
+        :param key: The cache key
+        :return: A dictionary with the response, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = self._read(key)
+        if entry is not None:
+            self._store(key, entry)
+
+        return entry
+
+    def set(self, key, entry):
+        """
+        Stores a response
+        :param key: The cache key
+        :param entry: A dictionary with the response
+        :return:
+        """
+        self._store(key, entry)
+        self._write(key, entry)
+
+    def invalidate(self, pattern=None):
+        """
+        Removes the responses of the URLs matching a regular expression, or all responses
+        :param pattern: The regular expression, None to clear the cache
+        :return:
+        """
+        regex = re.compile(pattern) if pattern else None
+        with self._lock:
+            keys = [k for k, v in self._entries.items() if regex is None or regex.search(v['url'])]
+            for key in keys:
+                del self._entries[key]
+
+        if self.path:
+            for filename in os.listdir(self.path):
+                filepath = os.path.join(self.path, filename)
+                try:
+                    with open(filepath) as f:
+                        url = json.load(f)['url']
+                except (OSError, ValueError, KeyError):
+                    continue
+                if regex is None or regex.search(url):
+                    os.remove(filepath)
+
+    def stats(self):
+        """
+        Returns the hit, miss and revalidation counters
+        :return: A dictionary with the counters and the number of responses in memory
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                    'entries': len(self._entries)}
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _filepath(self, key):
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def _read(self, key):
+        if not self.path:
+            return None
+
+        try:
+            with open(self._filepath(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        entry['content'] = base64.b64decode(entry['content'])
+        return entry
+
+    def _write(self, key, entry):
+        if not self.path:
+            return
+
+        data = {**entry, 'content': base64.b64encode(entry['content']).decode()}
+        filepath = self._filepath(key)
+        try:
+            # Write to a temporary file first, so that concurrent readers never see a partial file
+            with open(filepath + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(filepath + '.tmp', filepath)
+        except OSError as e:
+            logging.error(f"Could not write the response cache file {filepath}: {e}")
+
+
+class CachingSession(requests.Session):
+    """
+    requests session which serves GET requests from a ResponseCache. Expired responses with an ETag or Last-Modified
+    header are revalidated with a conditional request, so an unchanged object costs a 304 response instead of a new
+    download
+    """
+    def __init__(self, cache, identity=None):
+        """
+        :param cache: The ResponseCache, which can be shared by several sessions
+        :param identity: The user of the session, part of the cache keys so that sessions of different users don't
+        share responses. By default the username of the session auth or a hash of the Authorization header is used
+        """
+        super(CachingSession, self).__init__()
+        self.cache = cache
+        self.identity = identity
+
+    def _cache_key(self, url, headers):
+        headers = CaseInsensitiveDict({**self.headers, **(headers or {})})
+        identity = self.identity
+        if identity is None and isinstance(self.auth, tuple):
+            identity = self.auth[0]
+        if identity is None and headers.get('Authorization'):
+            identity = hashlib.sha256(headers['Authorization'].encode()).hexdigest()[:16]
+
+        return f"{identity or ''}|{headers.get('Accept', '')}|{url}"
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        # Streamed responses are read by the caller piece by piece and are never loaded in memory to be cached
+        if method.upper() != 'GET' or kwargs.get('stream'):
+            return super(CachingSession, self).request(method, url, params=params, headers=headers, **kwargs)
+
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        ttl = self.cache.get_ttl(full_url)
+        if ttl is None:
+            return super(CachingSession, self).request(method, url, params=params, headers=headers, **kwargs)
+
+        key = self._cache_key(full_url, headers)
+        entry = self.cache.get(key)
+        if entry is not None and entry['expires'] > time.time():
+            self.cache._count('hits')
+            return self._build_response(entry)
+
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = super(CachingSession, self).request(method, url, params=params, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache._count('revalidations')
+            entry = {**entry, 'expires': time.time() + ttl}
+            self.cache.set(key, entry)
+            return self._build_response(entry)
+
+        self.cache._count('misses')
+        # Controllers like vManage answer with the HTML login page when the session expired, which must not be cached
+        if response.status_code == 200 and 'text/html' not in response.headers.get('Content-Type', ''):
+            self.cache.set(key, {
+                'url': full_url,
+                'status_code': response.status_code,
+                'headers': {k: v for k, v in response.headers.items() if k.lower() not in PRIVATE_HEADERS},
+                'encoding': response.encoding,
+                'content': response.content,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'expires': time.time() + ttl
+            })
+
+        return response
+
+    @staticmethod
+    def _build_response(entry):
+        response = requests.Response()
+        response.url = entry['url']
+        response.status_code = entry['status_code']
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = entry['encoding']
+        response._content = entry['content']
+        response._content_consumed = True
+        response.from_cache = True
+
+        return response
+
+
+def new_session(cache=None, client=None, identity=None):
+    """
+    Returns a CachingSession if a cache is provided, otherwise a plain requests session
+    :param cache: Optional ResponseCache
+    :param client: Optional client label, e.g. apic, to record the requests of the session in the metrics
+    :param identity: Optional user of the session, for the cache keys
+    :return: The session
+    """
+    session = CachingSession(cache, identity) if cache is not None else requests.Session()
+    if client:
+        instrument_session(session, client)
+
+    return session
@@ -1,19 +1,63 @@
+import hashlib
 import os
 import logging
+import re
+import threading
+import time
+import typing
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from network_automation import environment
-from mydict import MyDict
-from netmiko import ConnectHandler, NetMikoAuthenticationException, NetMikoTimeoutException
+from network_automation.metrics import registry as metrics
+from network_automation.parsing import parse_output
+from network_automation.records import IOSInterface, IOSIPInterface, wrap
+
+# Netmiko (and paramiko) take a long time to import, so they are imported when a connection is made
+_NETMIKO_NAMES = ('ConnectHandler', 'NetMikoAuthenticationException', 'NetMikoTimeoutException',
+                  'NetmikoBaseException')
+
+if typing.TYPE_CHECKING:
+    from netmiko import ConnectHandler, NetMikoAuthenticationException, NetMikoTimeoutException, NetmikoBaseException
+    from paramiko.ssh_exception import SSHException
+
+
+def _import_netmiko():
+    missing = [x for x in _NETMIKO_NAMES if x not in globals()]
+    if missing:
+        import netmiko
+        for name in missing:
+            globals()[name] = getattr(netmiko, name)
+    if 'SSHException' not in globals():
+        from paramiko.ssh_exception import SSHException
+        globals()['SSHException'] = SSHException
+
+
+def __getattr__(name):
+    if name in _NETMIKO_NAMES or name == 'SSHException':
+        _import_netmiko()
+        return globals()[name]
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class CiscoSSHDevice(object):
     """
     This class defines methods for fetching data from a Cisco device using NetMiko
     """
-    def __init__(self, hostname, username=None, password=None, device_type='cisco_ios'):
+    def __init__(self, hostname, username=None, password=None, device_type='cisco_ios', pool=None, compact=False,
+                 **netmiko_args):
         if not hostname:
             raise ValueError("hostname is mandatory")
 
         self.hostname = hostname
+        self.device_type = device_type
+        # If a connection pool is provided, the SSH session is borrowed from it and returned on disconnect
+        self.pool = pool
+        # Return the rows of the interface getters as compact records instead of MyDict, for large result sets
+        self.compact = compact
+
+        environment.load_environment()
+        _import_netmiko()
 
         # Username and passwords can be provided as parameters or as environment variables
         self.username = username or environment.get_cisco_username()
@@ -27,34 +71,125 @@ class CiscoSSHDevice(object):
             'ip': self.hostname,
             'username': self.username,
             'password': self.password,
-            'secret': self.password
+            'secret': self.password,
+            **netmiko_args
         }
         try:
-            self.conn = ConnectHandler(**netmiko_device)
+            if self.pool:
+                self.conn = self.pool.acquire(netmiko_device)
+            else:
+                with metrics.time_connect('cisco_ssh'):
+                    self.conn = ConnectHandler(**netmiko_device)
             msg = f"Successfully connected to {hostname}"
             logging.info(msg)
             if self.verbose:
                 print(msg)
-        except (NetMikoTimeoutException, NetMikoAuthenticationException) as e:
+        except (NetMikoTimeoutException, NetMikoAuthenticationException, SSHException) as e:
             raise ConnectionError(f"Failed to connect to {hostname}: {e}")
 
-    def execute_show_command(self, command, parse=True, timeout=10):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pool and self.conn and exc_type:
+            # Don't return a session in an unknown state to the pool
+            self.pool.release(self.conn, discard=True)
+            self.conn = None
+        self.disconnect()
+
+    def disconnect(self):
+        """
+        This method closes the SSH session to the device, or returns it to the connection pool
+        :return:
+        """
+        if self.conn:
+            if self.pool:
+                self.pool.release(self.conn)
+            else:
+                self.conn.disconnect()
+                logging.info(f"Disconnected from {self.hostname}")
+            self.conn = None
+
+    def execute_show_command(self, command, parse=True, timeout=10, parse_executor=None):
         """
         This method executes a command on Cisco CLI and returns the result
         :param command: The command to run
         :param parse: Parse the output with textfsm (True)
         :param timeout: Set the timeout for executing the command and getting the result
+        :param parse_executor: Optional thread/process pool executor to parse the output in. The SSH session is free
+        as soon as the output is received, and a Future of the parsed result is returned
         :return:
         """
         logging.info(f"Executing command '{command}' on {self.hostname}")
 
-        result = self.conn.send_command(command, use_textfsm=parse, read_timeout=timeout)
+        started = time.perf_counter()
+        result = self.conn.send_command(command, read_timeout=timeout)
+        metrics.observe_request('cisco_ssh', command, 'SSH', 'ok', time.perf_counter() - started, len(result))
+
+        if not parse:
+            return result
+        if parse_executor:
+            return parse_executor.submit(parse_output, self.device_type, command, result)
+
+        return self._parse_output(command, result)
+
+    def execute_show_commands(self, commands, parse=True, timeout=30):
+        """
+        This method sends several show commands in one channel write and returns the results keyed by command.
+        The combined output is split by the device prompt, so the batch costs roughly one round trip of latency
+        :param commands: The list of commands to run
+        :param parse: Parse the output of each command with textfsm (True)
+        :param timeout: Set the timeout for getting the result of each command
+        :return: A dictionary with the commands as keys and their results as values
+        """
+        logging.info(f"Executing commands {commands} on {self.hostname}")
+
+        prompt = self.conn.find_prompt()
+        self.conn.write_channel(''.join(f"{x}\n" for x in commands))
 
-        if type(result) is not str and self.verbose:
+        # Each command output ends with the prompt at the beginning of a line
+        pattern = r'\n' + re.escape(prompt)
+        result = {}
+        started = time.perf_counter()
+        for command in commands:
+            section = self.conn.read_until_pattern(pattern=pattern, read_timeout=timeout)
+            # The commands run back to back, each one is timed from the end of the previous output
+            finished = time.perf_counter()
+            metrics.observe_request('cisco_ssh', command, 'SSH', 'ok', finished - started, len(section))
+            started = finished
+            # Remove the command echo from the first line and the prompt from the last line
+            lines = section.replace('\r', '').split('\n')[1:-1]
+            output = '\n'.join(lines)
+            result[command] = self._parse_output(command, output) if parse else output
+
+        return result
+
+    def _parse_output(self, command, output):
+        result = parse_output(self.device_type, command, output)
+
+        if type(result) is str and self.verbose:
             print(f"Could not parse command result")
 
         return result
 
+    def get_device_snapshot(self, timeout=30):
+        """
+        This method collects the interface details, IP interfaces, CDP neighbors and serial number of the device
+        with a single batch of commands
+        :param timeout: Set the timeout for getting the result of each command
+        :return: A dictionary with the collected data
+        """
+        commands = ['show interface', 'show ip interface brief', 'show cdp neighbors',
+                    'show version | include Processor']
+        output = self.execute_show_commands(commands, parse=False, timeout=timeout)
+
+        return {
+            'interfaces': wrap(self._parse_output(commands[0], output[commands[0]]), IOSInterface, self.compact),
+            'ip_interfaces': wrap(self._parse_output(commands[1], output[commands[1]]), IOSIPInterface, self.compact),
+            'cdp_neighbors': self._parse_output(commands[2], output[commands[2]]),
+            'serial': output[commands[3]].strip().split(' ')[-1]
+        }
+
     def get_interface_details(self, timeout=30):
         """
         This method executes the 'show interface' command and returns the result parsed with textfsm
@@ -63,7 +198,7 @@ class CiscoSSHDevice(object):
         """
         interfaces = self.execute_show_command('show interface', timeout=timeout)
 
-        return [MyDict(x) for x in interfaces]
+        return wrap(interfaces, IOSInterface, self.compact)
 
     def get_cdp_neighbors(self, detail=False):
         """
@@ -91,4 +226,323 @@ class CiscoSSHDevice(object):
         This method gets interface IP information
         :return:
         """
-        return [MyDict(x) for x in self.execute_show_command('show ip interface brief')]
+        return wrap(self.execute_show_command('show ip interface brief'), IOSIPInterface, self.compact)
+
+
+class SSHConnectionPool(object):
+    """
+    This class keeps Netmiko sessions open for reuse, keyed by (host, device type, credentials).
+    Idle sessions are kept alive and health checked by a background thread, and closed after max_idle seconds
+    """
+    def __init__(self, max_idle=300, keepalive_interval=30, max_per_device=1, acquire_timeout=60):
+        """
+        :param max_idle: Close sessions which have not been used for this number of seconds
+        :param keepalive_interval: The interval in seconds between keepalives of the idle sessions, 0 to disable
+        :param max_per_device: The maximum number of sessions open at the same time for one device, idle or in use
+        :param acquire_timeout: The maximum number of seconds to wait for a free session of a device
+        """
+        _import_netmiko()
+
+        self.max_idle = max_idle
+        self.keepalive_interval = keepalive_interval
+        self.max_per_device = max_per_device
+        self.acquire_timeout = acquire_timeout
+
+        self._lock = threading.Lock()
+        # Notified when a session of a device is returned or closed
+        self._released = threading.Condition(self._lock)
+        # key -> list of (session, last used time)
+        self._idle = defaultdict(list)
+        # key -> number of open sessions of the device: idle, in use and being checked by the keepalive thread
+        self._open = defaultdict(int)
+        # id(session) -> key, for the sessions in use
+        self._in_use = {}
+        self._closed = False
+        self._stop = threading.Event()
+        self._keepalive_thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _key(netmiko_device):
+        password = netmiko_device.get('password') or ''
+        return (netmiko_device['ip'], netmiko_device['device_type'], netmiko_device.get('username'),
+                hashlib.sha256(password.encode()).hexdigest())
+
+    def acquire(self, netmiko_device):
+        """
+        Borrows a session from the pool, or opens a new one if there is no healthy idle session
+        :param netmiko_device: The Netmiko ConnectHandler arguments
+        :return: A Netmiko connection
+        """
+        key = self._key(netmiko_device)
+        expired = []
+        conn = self._reserve(key, netmiko_device['ip'], expired)
+
+        for stale in expired:
+            self._disconnect(stale)
+
+        conn = self._open_session(key, netmiko_device, conn)
+
+        with self._lock:
+            self._in_use[id(conn)] = key
+            if self.keepalive_interval and not self._keepalive_thread:
+                self._keepalive_thread = threading.Thread(target=self._keepalive, daemon=True)
+                self._keepalive_thread.start()
+
+        return conn
+
+    def _reserve(self, key, host, expired):
+        """
+        Waits for an idle session of a device, or for a free slot to open a new one
+        :param expired: The list which the expired idle sessions are added to, to be closed without holding the lock
+        :return: The idle session, or None if a slot was reserved for a new session
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+
+        with self._released:
+            while True:
+                if self._closed:
+                    raise ConnectionError("The connection pool is closed")
+
+                conn = self._get_idle(key, expired)
+                if conn is not None:
+                    return conn
+                if self._open[key] < self.max_per_device:
+                    # Reserve the slot of the new session before connecting
+                    self._open[key] += 1
+                    return None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectionError(f"Timed out waiting for a free session to {host}")
+                self._released.wait(remaining)
+
+    def _open_session(self, key, netmiko_device, conn):
+        """
+        Checks an idle session, or opens a new session in the reserved slot. The slot is freed if connecting fails
+        :param conn: The idle session, or None to open a new one
+        :return: A healthy Netmiko connection
+        """
+        try:
+            if conn is not None and not conn.is_alive():
+                # The dead session is replaced by a new one in the same slot
+                self._disconnect(conn)
+                conn = None
+            if conn is None:
+                with metrics.time_connect('cisco_ssh'):
+                    conn = ConnectHandler(**netmiko_device)
+        except BaseException:
+            self._forget(key)
+            raise
+
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Returns a session to the pool. Releasing a session which is not in use does nothing
+        :param conn: The Netmiko connection
+        :param discard: Close the session instead of keeping it for reuse (e.g. after an error)
+        :return:
+        """
+        with self._released:
+            key = self._in_use.pop(id(conn), None)
+            if key is None:
+                logging.debug(f"SSH session to {getattr(conn, 'host', None)} released twice or not from this pool")
+                return
+
+            if not discard and not self._closed:
+                self._idle[key].append((conn, time.monotonic()))
+                self._released.notify()
+                return
+
+        self._disconnect(conn)
+        self._forget(key)
+
+    def close(self):
+        """
+        Stops the keepalive thread and closes all idle sessions. Sessions in use are closed when released
+        :return:
+        """
+        self._stop.set()
+        with self._released:
+            self._closed = True
+            idle = [conn for sessions in self._idle.values() for conn, _ in sessions]
+            for key, sessions in self._idle.items():
+                self._open[key] -= len(sessions)
+            self._idle.clear()
+            # Waiting acquires fail now
+            self._released.notify_all()
+
+        for conn in idle:
+            self._disconnect(conn)
+
+    def _forget(self, key, count=1):
+        # Frees the slots of sessions which were closed, or could not be opened
+        with self._released:
+            self._open[key] -= count
+            self._released.notify(count)
+
+    def _get_idle(self, key, expired):
+        # Must be called with the lock held. Returns the most recently used idle session which has not expired, the
+        # expired ones are added to the list to be closed without the lock
+        idle = self._idle[key]
+        while idle:
+            conn, last_used = idle.pop()
+            if time.monotonic() - last_used < self.max_idle:
+                return conn
+            self._open[key] -= 1
+            expired.append(conn)
+
+        return None
+
+    def _keepalive(self):
+        while not self._stop.wait(self.keepalive_interval):
+            for key in list(self._idle):
+                # The sessions being checked stay counted in _open, so no other session is opened meanwhile
+                with self._lock:
+                    sessions = self._idle.pop(key, [])
+
+                alive = []
+                for conn, last_used in sessions:
+                    # is_alive() sends a null byte on the channel, which also acts as a keepalive
+                    if time.monotonic() - last_used < self.max_idle and conn.is_alive():
+                        alive.append((conn, last_used))
+                    else:
+                        self._disconnect(conn)
+
+                with self._released:
+                    if self._closed:
+                        stale = alive
+                    else:
+                        self._idle[key] = alive + self._idle[key]
+                        stale = []
+                    self._open[key] -= len(sessions) - len(alive) + len(stale)
+                    self._released.notify(len(sessions))
+
+                for conn, _ in stale:
+                    self._disconnect(conn)
+
+    @staticmethod
+    def _disconnect(conn):
+        try:
+            conn.disconnect()
+        except (OSError, NetmikoBaseException) as e:
+            logging.info(f"Error closing SSH session to {conn.host}: {e}")
+
+
+def _abort(device):
+    """Closes the session of a device which is still in use by a worker, so that its pending read fails"""
+    conn = device.conn if device else None
+    if conn is None:
+        return
+
+    try:
+        conn.disconnect()
+    except Exception as e:
+        logging.info(f"Error closing SSH session to {device.hostname}: {e}")
+
+
+def _fleet_result(future, hostname, started):
+    """Returns the result of a host whose worker finished, with the error if it failed"""
+    result = {'hostname': hostname, 'result': None, 'error': None,
+              'elapsed': time.monotonic() - (started or time.monotonic())}
+    try:
+        result['result'] = future.result()
+    except Exception as e:
+        # Any failure, e.g. an SSH or parsing error, is the failure of this host only
+        logging.error(f"Failed to collect data from {hostname}: {e}")
+        result['error'] = str(e) or type(e).__name__
+
+    return result
+
+
+def _expire_hosts(pending, hosts, started, devices, timeout):
+    """
+    Gives up on the hosts which exceed the timeout, and closes their session so that the worker is released
+    :param pending: The futures of the hosts in progress, with the indexes of the hosts in the inventory as values.
+    The hosts which timed out are removed
+    :return: The list of results of the hosts which timed out
+    """
+    now = time.monotonic()
+    expired = []
+    for future, index in list(pending.items()):
+        if index in started and now - started[index] > timeout:
+            del pending[future]
+            hostname = hosts[index]['hostname']
+            logging.error(f"Timed out collecting data from {hostname}")
+            _abort(devices.get(index))
+            expired.append({'hostname': hostname, 'result': None, 'error': f"Timed out after {timeout} seconds",
+                            'elapsed': now - started[index]})
+
+    return expired
+
+
+def run_fleet_commands(inventory, commands, parse=True, max_workers=32, timeout=60, pool=None, parse_executor=None):
+    """
+    This function executes show commands on many Cisco devices concurrently, using a bounded pool of worker threads.
+    The results are yielded as soon as each host finishes, in completion order
+    :param inventory: A list of hostnames, or of dictionaries with the CiscoSSHDevice arguments (hostname, username,
+    password, device_type and any other Netmiko argument). A hostname may be listed more than once, e.g. with other
+    credentials, and gets one result per entry
+    :param commands: The list of show commands to execute on each host
+    :param parse: Parse the output with textfsm (True)
+    :param max_workers: The maximum number of hosts processed at the same time
+    :param timeout: The maximum number of seconds spent on one host, including connection and all commands
+    :param pool: An optional SSHConnectionPool to borrow the sessions from
+    :param parse_executor: Optional thread/process pool executor to parse the outputs in, after the session is released
+    :return: A generator of dictionaries with the hostname, the result of each command, the error and the elapsed time
+    """
+    _import_netmiko()
+    # The start times and devices of the hosts, by index in the inventory
+    started = {}
+    devices = {}
+
+    def collect(index, host_args):
+        started[index] = time.monotonic()
+        # All commands of the host share one deadline, each command gets the time left
+        deadline = started[index] + timeout
+        host_args.setdefault('conn_timeout', timeout)
+        host_args.setdefault('auth_timeout', timeout)
+        host_args.setdefault('banner_timeout', timeout)
+        host_args.setdefault('pool', pool)
+
+        with CiscoSSHDevice(**host_args) as device:
+            devices[index] = device
+            result = {}
+            for command in commands:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Timed out after {timeout} seconds")
+                result[command] = device.execute_show_command(command, parse=parse and not parse_executor,
+                                                              timeout=remaining)
+            device_type = device.device_type
+
+        if parse and parse_executor:
+            futures = {command: parse_executor.submit(parse_output, device_type, command, output)
+                       for command, output in result.items()}
+            result = {command: future.result() for command, future in futures.items()}
+
+        return result
+
+    hosts = [{'hostname': x} if isinstance(x, str) else dict(x) for x in inventory]
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {executor.submit(collect, index, x): index for index, x in enumerate(hosts)}
+
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index = pending.pop(future)
+                yield _fleet_result(future, hosts[index]['hostname'], started.get(index))
+
+            yield from _expire_hosts(pending, hosts, started, devices, timeout)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -1,59 +1,88 @@
 import logging
 import os
-import pathlib
-import sys
-from dotenv import load_dotenv
-
-# Get environment variables from local .env file and user's home directory .env file
-dotenv_current_path = os.path.join(pathlib.Path().resolve(), '.env')
-dotenv_home_path = os.path.join(pathlib.Path.home().resolve(), '.env')
-load_dotenv(dotenv_home_path)
-load_dotenv(dotenv_current_path)
-
-# Logging config
-if sys.version_info.major >= 3 and sys.version_info.minor >= 9:
-    logging.basicConfig(filename='network_automation.log',
-                        encoding='utf-8',
-                        level=logging.INFO,
-                        format='%(levelname)s:%(asctime)s %(message)s',
-                        datefmt='%d/%m/%Y %H:%M:%S')
-else:
-    logging.basicConfig(filename='network_automation.log',
-                        level=logging.INFO,
-                        format='%(levelname)s:%(asctime)s %(message)s',
-                        datefmt='%d/%m/%Y %H:%M:%S')
-
-# GENERAL SETTINGS
-VERBOSE = False
-if 'VERBOSE' in os.environ and (
-        os.environ["VERBOSE"].lower() == "true"
-        or os.environ["VERBOSE"].lower() == "yes"
-        or os.environ["VERBOSE"] == 1):
-    VERBOSE = True
-
-DEBUG = False
-if 'DEBUG' in os.environ and (
-        os.environ["DEBUG"].lower() == "true"
-        or os.environ["DEBUG"].lower() == "yes"
-        or os.environ["DEBUG"] == 1):
-    DEBUG = True
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_environment():
+    """
+    Loads the environment variables from the local .env file and the user's home directory .env file, and configures
+    logging to network_automation.log. This is done once, on first use, so importing the package has no side effects
+    :return:
+    """
+    global _loaded
+
+    if _loaded:
+        return
+
+    with _lock:
+        if _loaded:
+            return
+
+        import pathlib
+        import sys
+        from dotenv import load_dotenv
+
+        # Get environment variables from local .env file and user's home directory .env file
+        dotenv_current_path = os.path.join(pathlib.Path().resolve(), '.env')
+        dotenv_home_path = os.path.join(pathlib.Path.home().resolve(), '.env')
+        load_dotenv(dotenv_home_path)
+        load_dotenv(dotenv_current_path)
+
+        # Logging config
+        if sys.version_info.major >= 3 and sys.version_info.minor >= 9:
+            logging.basicConfig(filename='network_automation.log',
+                                encoding='utf-8',
+                                level=logging.INFO,
+                                format='%(levelname)s:%(asctime)s %(message)s',
+                                datefmt='%d/%m/%Y %H:%M:%S')
+        else:
+            logging.basicConfig(filename='network_automation.log',
+                                level=logging.INFO,
+                                format='%(levelname)s:%(asctime)s %(message)s',
+                                datefmt='%d/%m/%Y %H:%M:%S')
+
+        _loaded = True
+
+
+def _get_flag(name):
+    load_environment()
+
+    return name in os.environ and (
+        os.environ[name].lower() == "true"
+        or os.environ[name].lower() == "yes"
+        or os.environ[name] == "1")
+
+
+def __getattr__(name):
+    # GENERAL SETTINGS, read from the environment on first access
+    if name in ('VERBOSE', 'DEBUG'):
+        return _get_flag(name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_cisco_username():
     """Get username for Cisco devices from environment variables"""
+    load_environment()
     return os.environ.get("CISCO_USERNAME")
 
 
 def get_cisco_password():
     """Get password for Cisco devices from environment variables"""
+    load_environment()
     return os.environ.get("CISCO_PASSWORD")
 
 
 def get_netbox_url():
     """Get URL for NetBox from environment variables"""
+    load_environment()
     return os.environ.get("NETBOX_URL")
 
 
 def get_netbox_token():
     """Get token for NetBox from environment variables"""
+    load_environment()
     return os.environ.get("NETBOX_TOKEN")
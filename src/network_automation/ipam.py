@@ -0,0 +1,100 @@
+import socket
+from collections import defaultdict
+
+ADDRESS_BITS = {4: 32, 6: 128}
+
+
+def parse_address(address):
+    """
+    Parses an IPv4/IPv6 address or prefix into integers, without the overhead of the ipaddress module
+    :param address: Address or prefix as string, e.g. '10.0.0.1', '10.0.0.0/8' or '2001:db8::/32'
+    :return: A tuple (version, address as integer, prefix length)
+    """
+    host, _, length = str(address).partition('/')
+
+    if ':' in host:
+        version = 6
+        packed = socket.inet_pton(socket.AF_INET6, host.split('%')[0])
+    else:
+        version = 4
+        packed = socket.inet_pton(socket.AF_INET, host)
+
+    prefix_length = int(length) if length else ADDRESS_BITS[version]
+    if not 0 <= prefix_length <= ADDRESS_BITS[version]:
+        raise ValueError(f"Invalid prefix length in {address}")
+
+    return version, int.from_bytes(packed, 'big'), prefix_length
+
+
+class PrefixIndex(object):
+    """
+    Longest-prefix-match index for IPv4 and IPv6 prefixes, separated by VRF.
+
+    Prefixes are stored in one hash table per prefix length, keyed by the network bits of the prefix. A lookup probes
+    the prefix lengths present in the VRF from the longest to the shortest, so its cost depends on the number of
+    distinct prefix lengths and not on the number of prefixes.
+    """
+    def __init__(self, prefixes=None):
+        # (vrf, version) -> {prefix length: {network bits: value}}
+        self._tables = defaultdict(dict)
+        # (vrf, version) -> prefix lengths present in the table, longest first
+        self._lengths = {}
+        self._size = 0
+
+        for prefix in prefixes or []:
+            self.add(prefix)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, prefix, vrf=None, value=None):
+        """
+        Adds a prefix to the index
+        :param prefix: The prefix as string, e.g. '10.0.0.0/8'
+        :param vrf: The VRF of the prefix, None for the global table
+        :param value: The value returned by lookup() for this prefix, defaults to the prefix itself
+        :return:
+        """
+        version, network, prefix_length = parse_address(prefix)
+        key = (vrf, version)
+
+        tables = self._tables[key]
+        if prefix_length not in tables:
+            tables[prefix_length] = {}
+            self._lengths[key] = sorted(tables, reverse=True)
+
+        table = tables[prefix_length]
+        network_bits = network >> (ADDRESS_BITS[version] - prefix_length)
+        if network_bits not in table:
+            self._size += 1
+        table[network_bits] = prefix if value is None else value
+
+    def lookup(self, address, vrf=None):
+        """
+        Finds the longest prefix containing an address
+        :param address: The IP address, with or without prefix length (e.g. '10.0.0.1/24')
+        :param vrf: The VRF of the address, None for the global table
+        :return: The value of the longest matching prefix, None if there is no match
+        """
+        version, ip, prefix_length = parse_address(address)
+        key = (vrf, version)
+        bits = ADDRESS_BITS[version]
+        tables = self._tables.get(key)
+        if not tables:
+            return None
+
+        for length in self._lengths[key]:
+            value = tables[length].get(ip >> (bits - length))
+            if value is not None:
+                return value
+
+        return None
+
+    def contains(self, address, vrf=None):
+        """
+        Checks if an address is covered by any prefix in the index
+        :param address: The IP address, with or without prefix length
+        :param vrf: The VRF of the address, None for the global table
+        :return: True if a covering prefix exists, False otherwise
+        """
+        return self.lookup(address, vrf) is not None
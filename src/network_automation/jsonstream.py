@@ -0,0 +1,180 @@
+import codecs
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class _ValueScanner(object):
+    """
+    Finds the end of the JSON value which starts at a position of a growing buffer, tracking the nesting depth and the
+    strings. A value split over many chunks is scanned once, instead of being decoded again after each chunk
+    """
+    structure = re.compile(r'["{}\[\]]')
+    string_end = re.compile(r'["\\]')
+    delimiter = re.compile(r'[ \t\n\r,\]}]')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # The scan position, relative to the start of the value, the depth and whether it is in a string
+        self.offset, self.depth, self.in_string = 0, 0, False
+
+    def end(self, buffer, pos):
+        """
+        :return: The end of the value starting at pos, or None if it continues after the end of the buffer
+        """
+        if self.offset == 0 and buffer[pos] not in '{["':
+            # A number or literal ends at the next delimiter
+            match = self.delimiter.search(buffer, pos)
+            return match.start() if match else None
+
+        # Each step returns the next position and whether the value ends there (True), continues after the end of the
+        # buffer (False) or the scan goes on (None)
+        i, done = pos + self.offset, None
+        while done is None:
+            i, done = self._string_step(buffer, i) if self.in_string else self._structure_step(buffer, i)
+
+        if done:
+            return i
+
+        self.offset = i - pos
+        return None
+
+    def _string_step(self, buffer, i):
+        match = self.string_end.search(buffer, i)
+        if match is None:
+            return len(buffer), False
+        if match.group() == '\\':
+            if match.end() == len(buffer):
+                # The escaped character is in the next chunk
+                return match.start(), False
+            return match.end() + 1, None
+
+        self.in_string = False
+        return match.end(), True if self.depth == 0 else None
+
+    def _structure_step(self, buffer, i):
+        match = self.structure.search(buffer, i)
+        if match is None:
+            return len(buffer), False
+
+        char = match.group()
+        if char == '"':
+            self.in_string = True
+        elif char in '{[':
+            self.depth += 1
+        else:
+            self.depth -= 1
+            if self.depth <= 0:
+                return match.end(), True
+
+        return match.end(), None
+
+
+class _StreamReader(object):
+    """
+    The text of a stream of chunks which is not parsed yet. Chunks are only read when the next token or value continues
+    after the end of the buffer
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.scanner = _ValueScanner()
+        self.buffer, self.pos, self.eof = '', 0, False
+
+    def read(self):
+        # Read more data, dropping what was already parsed
+        if self.eof:
+            raise ValueError("Unexpected end of JSON stream")
+
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            chunk, self.eof = b'', True
+        if isinstance(chunk, bytes):
+            chunk = self.text_decoder.decode(chunk, final=self.eof)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """
+        :return: The next character which isn't whitespace
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self.read()
+
+    def expect(self, chars):
+        """
+        Consumes the next character, which must be one of `chars`
+        :return: The character
+        """
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f"Invalid JSON at position {self.pos}: {self.buffer[self.pos:self.pos + 20]!r}")
+
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Consumes the next value. It is decoded once, when the scanner found its end
+        :return: The value
+        """
+        self.peek()
+        while self.scanner.end(self.buffer, self.pos) is None and not self.eof:
+            self.read()
+
+        self.scanner.reset()
+        value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+        return value
+
+
+class JSONArrayStream(object):
+    """
+    Incrementally parses a JSON object from an iterable of chunks (bytes or str), yielding the elements of one of its
+    top-level arrays as soon as they are parsed. Only the element being parsed is kept in memory.
+    The other top-level values of the object are available in `extra` after the iteration
+    """
+    def __init__(self, chunks, key):
+        """
+        :param chunks: An iterable of bytes or str chunks, e.g. requests' response.iter_content()
+        :param key: The key of the top-level array to stream
+        """
+        self.chunks = chunks
+        self.key = key
+        self.extra = {}
+
+    def __iter__(self):
+        reader = _StreamReader(self.chunks)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key == self.key and reader.peek() == '[':
+                yield from self._elements(reader)
+            else:
+                self.extra[key] = reader.value()
+
+            if reader.expect(',}') == '}':
+                return
+
+    @staticmethod
+    def _elements(reader):
+        reader.expect('[')
+        if reader.peek() == ']':
+            reader.pos += 1
+            return
+
+        while True:
+            yield reader.value()
+            if reader.expect(',]') == ']':
+                return
@@ -0,0 +1,347 @@
+import bisect
+import functools
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Numbers and UUIDs in URLs and commands are replaced, so that the endpoints have a bounded number of label values
+ID_RE = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+')
+
+
+@functools.lru_cache(maxsize=4096)
+def endpoint_name(url):
+    """
+    Returns the endpoint label of a URL or command, without the host, the query string and the IDs
+    :param url: The URL, e.g. https://apic/api/node/mo/topology/pod-1/node-101/sys.json?query-target=children
+    :return: The endpoint, e.g. /api/node/mo/topology/pod-{id}/node-{id}/sys.json
+    """
+    if '://' in url:
+        url = urlsplit(url).path
+
+    return ID_RE.sub('{id}', url)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    if extra:
+        labels = f'{labels},{extra}' if labels else extra
+
+    return f'{{{labels}}}' if labels else ''
+
+
+class Counter(object):
+    """
+    Monotonic counter with labels
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        """
+        :param labels: The tuple of label values, in the order of the label names
+        :param amount: The increment
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels):
+        return self._values.get(labels, 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def export(self):
+        with self._lock:
+            values = list(self._values.items())
+
+        return [f'{self.name}{_format_labels(self.labels, labels)} {value}' for labels, value in values]
+
+
+class Histogram(object):
+    """
+    Histogram with fixed buckets and labels, exported with cumulative buckets like the Prometheus client
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """
+        :param labels: The tuple of label values, in the order of the label names
+        :param value: The observed value, e.g. a duration in seconds
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def get(self, labels):
+        """
+        :return: A tuple (count, sum) of the observations with the labels
+        """
+        counts = self._values.get(labels)
+        if counts is None:
+            return 0, 0.0
+
+        return sum(counts[:-1]), counts[-1]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def export(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+
+        lines = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}')
+
+        return lines
+
+
+class _Timer(object):
+    def __init__(self, registry, histogram, labels, span_name, attributes):
+        self.registry = registry
+        self.histogram = histogram
+        self.labels = labels
+        self.span_name = span_name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        duration = time.perf_counter() - self.started
+        self.histogram.observe(self.labels, duration)
+        attributes = self.attributes if exc_type is None else {**self.attributes, 'error': exc_type.__name__}
+        self.registry._span(self.span_name, self.start_ns, duration, attributes)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry(object):
+    """
+    Collects the request latency, transferred bytes, retries, parse time and connection setup time of the clients.
+    Recording is disabled by default, so the instrumented code paths cost one attribute check. The metrics are
+    exported in the Prometheus text format, and each observation can also be sent as an OpenTelemetry span
+    """
+    def __init__(self):
+        self.enabled = False
+        self.tracer = None
+
+        self.request_duration = Histogram('network_automation_request_duration_seconds',
+                                          "Duration of the API requests and CLI commands",
+                                          ('client', 'endpoint', 'method', 'status'))
+        self.request_bytes = Counter('network_automation_request_bytes_total', "Bytes sent in the request bodies",
+                                     ('client', 'endpoint'))
+        self.response_bytes = Counter('network_automation_response_bytes_total',
+                                      "Bytes received in the response bodies and command outputs",
+                                      ('client', 'endpoint'))
+        self.retries = Counter('network_automation_retries_total', "Requests retried after an error",
+                               ('client', 'reason'))
+        self.parse_duration = Histogram('network_automation_parse_duration_seconds',
+                                        "Duration of the parsing of command outputs", ('platform', 'command'))
+        self.connect_duration = Histogram('network_automation_connect_duration_seconds',
+                                          "Duration of the connection setup and authentication", ('client',))
+        self.metrics = [self.request_duration, self.request_bytes, self.response_bytes, self.retries,
+                        self.parse_duration, self.connect_duration]
+
+    def enable(self, tracing=False, tracer=None):
+        """
+        Starts recording the metrics
+        :param tracing: Also send an OpenTelemetry span for each observation, with the tracer of the global tracer
+        provider. Requires the opentelemetry-api package
+        :param tracer: Optional OpenTelemetry tracer to use for the spans instead of the global one
+        :return:
+        """
+        if tracing and tracer is None:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise ImportError("Tracing requires the opentelemetry-api package")
+            tracer = trace.get_tracer('network_automation')
+
+        self.tracer = tracer
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stops recording the metrics and sending spans. The recorded metrics are kept
+        :return:
+        """
+        self.enabled = False
+        self.tracer = None
+
+    def reset(self):
+        """
+        Removes all recorded metrics
+        :return:
+        """
+        for metric in self.metrics:
+            metric.clear()
+
+    def _span(self, name, start_ns, duration, attributes):
+        if self.tracer is None:
+            return
+
+        span = self.tracer.start_span(name, start_time=start_ns, attributes=attributes)
+        span.end(end_time=start_ns + int(duration * 1e9))
+
+    def observe_request(self, client, endpoint, method, status, duration, response_bytes=0, request_bytes=0):
+        """
+        Records one API request or CLI command
+        :param client: The client, e.g. apic, vmanage, nfvis, netbox or cisco_ssh
+        :param endpoint: The URL or the command, which is normalized with endpoint_name
+        :param method: The HTTP method, or SSH for commands
+        :param status: The HTTP status code, or ok for commands
+        :param duration: The duration in seconds
+        :param response_bytes: The size of the response body or the command output
+        :param request_bytes: The size of the request body
+        :return:
+        """
+        if not self.enabled:
+            return
+
+        endpoint = endpoint_name(endpoint)
+        self.request_duration.observe((client, endpoint, method, str(status)), duration)
+        if response_bytes:
+            self.response_bytes.inc((client, endpoint), response_bytes)
+        if request_bytes:
+            self.request_bytes.inc((client, endpoint), request_bytes)
+
+        if self.tracer is not None:
+            self._span(f'{client} {method} {endpoint}', time.time_ns() - int(duration * 1e9), duration,
+                       {'client': client, 'endpoint': endpoint, 'method': method, 'status': str(status),
+                        'response_bytes': response_bytes})
+
+    def count_retry(self, client, reason):
+        """
+        Records a request which is retried, e.g. after the session expired
+        :param client: The client
+        :param reason: The reason of the retry, e.g. session_expired
+        :return:
+        """
+        if self.enabled:
+            self.retries.inc((client, reason))
+
+    def time_parse(self, platform, command):
+        """
+        Returns a context manager which records the parse time of a command output
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+
+        command = endpoint_name(command)
+        return _Timer(self, self.parse_duration, (platform, command), f'parse {command}',
+                      {'platform': platform, 'command': command})
+
+    def time_connect(self, client):
+        """
+        Returns a context manager which records the connection setup (and authentication) time of a client
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+
+        return _Timer(self, self.connect_duration, (client,), f'{client} connect', {'client': client})
+
+    def export_prometheus(self):
+        """
+        Returns the recorded metrics in the Prometheus text exposition format
+        :return: The text, e.g. to serve on a /metrics endpoint or to write for the node_exporter textfile collector
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.export())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _response_hook(client, response, **kwargs):
+    if not registry.enabled:
+        return
+
+    started = time.perf_counter()
+    # Streamed responses are read by the caller later, their size is known from the headers only
+    if kwargs.get('stream'):
+        size = int(response.headers.get('Content-Length') or 0)
+    else:
+        size = len(response.content)
+    duration = response.elapsed.total_seconds() + time.perf_counter() - started
+
+    body = response.request.body
+    registry.observe_request(client, response.request.path_url.split('?')[0], response.request.method,
+                             response.status_code, duration, size, len(body) if body else 0)
+
+
+def instrument_session(session, client):
+    """
+    Adds a response hook to a requests session, which records the requests of the session when metrics are enabled
+    :param session: The requests session
+    :param client: The client label, e.g. apic
+    :return: The session
+    """
+    session.hooks['response'].append(functools.partial(_response_hook, client))
+
+    return session
+
+
+def enable(tracing=False, tracer=None):
+    registry.enable(tracing, tracer)
+
+
+def disable():
+    registry.disable()
+
+
+def reset():
+    registry.reset()
+
+
+def export_prometheus():
+    return registry.export_prometheus()
@@ -1,8 +1,33 @@
 import ipaddress
 import logging
+import requests
 from network_automation import environment
-from collections import defaultdict
-from pynetbox import api as netbox_api
+from network_automation.cache import CachingSession
+from network_automation.ipam import PrefixIndex
+from network_automation.metrics import instrument_session
+from network_automation.records import NetBoxPrefix, wrap
+from network_automation.utils import chunked
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pynetbox import api as netbox_api, ContentError, RequestError
+
+
+def _vrf_id(obj):
+    """Returns the ID of the VRF of a NetBox object (dictionary), None for the global table"""
+    vrf = obj.get('vrf')
+    return vrf['id'] if vrf else None
+
+
+class _UncachedSession(object):
+    """
+    Sends the GET requests of a CachingSession without the response cache, with the same connections, hooks and
+    settings. Bulk reads are read once, caching them would only evict the responses which are worth keeping
+    """
+    def __init__(self, session):
+        self.session = session
+
+    def get(self, url, **kwargs):
+        return requests.Session.request(self.session, 'GET', url, **kwargs)
 
 
 class NetBoxInstance(netbox_api):
@@ -10,45 +35,143 @@ class NetBoxInstance(netbox_api):
     This class extends the pynetbox api class by adding additional methods that are not strictly related to NetBox
     data itself, but more like custom methods that help a manage data within NetBox
     """
-    def __init__(self, url=None, token=None):
+    def __init__(self, url=None, token=None, cache=None, max_workers=8, page_size=1000):
+        """
+        :param cache: Optional ResponseCache for the GET requests of pynetbox, e.g. sites. The bulk reads of iter_all
+        and NetBoxSync are never cached
+        :param max_workers: The number of pages requested at the same time by iter_all
+        :param page_size: The number of objects requested per page by iter_all. NetBox returns at most MAX_PAGE_SIZE
+        (1000 by default) objects per page
+        """
+        environment.load_environment()
+
         self.url = url or environment.get_netbox_url()
         self.token = token or environment.get_netbox_token()
+        self.max_workers = max_workers
+        self.page_size = page_size
 
         super(NetBoxInstance, self).__init__(url=self.url, token=self.token)
 
+        if cache is not None:
+            self.http_session = CachingSession(cache)
+        instrument_session(self.http_session, 'netbox')
+
+    def _get_page(self, url, params):
+        # The requests and errors are those of pynetbox: RequestError for failed requests, ContentError for responses
+        # which are not JSON
+        session = self.http_session
+        if isinstance(session, CachingSession):
+            session = _UncachedSession(session)
+
+        headers = {'accept': 'application/json'}
+        if self.token:
+            headers['authorization'] = f"Token {self.token}"
+
+        response = session.get(url, headers=headers, params=params)
+        if not response.ok:
+            raise RequestError(response)
+
+        try:
+            return response.json()
+        except ValueError:
+            raise ContentError(response)
+
+    def iter_all(self, endpoint, fields=None, brief=False, page_size=None, max_workers=None, **filters):
+        """
+        Gets all objects of an endpoint as plain dictionaries, with the pages requested in parallel. The first page
+        returns the total count, so the offsets of the remaining pages are known and don't have to be discovered by
+        following the next links one by one. The objects are yielded in the order of the pages, while the next pages
+        are being fetched. Objects created during the fetch, after the first page, may be missed. The pages bypass
+        the response cache
+        :param endpoint: The endpoint as app.name, e.g. ipam.ip_addresses
+        :param fields: Optional field names (list or comma separated string) to return, to reduce the response size.
+        Requires NetBox 4.0 or newer
+        :param brief: Return the brief representation of the objects, e.g. only the ID and the address of IP addresses
+        :param page_size: The number of objects per page, the instance page_size by default
+        :param max_workers: The number of pages requested at the same time, the instance max_workers by default
+        :param filters: Optional NetBox filters, e.g. vrf_id=1
+        :return: A generator of dictionaries
+        """
+        app, name = endpoint.split('.')
+        # The list URLs end with a slash, NetBox redirects the requests without it
+        url = getattr(getattr(self, app), name).url.rstrip('/') + '/'
+        page_size = page_size or self.page_size
+        max_workers = max_workers or self.max_workers
+
+        params = dict(filters)
+        if fields:
+            params['fields'] = fields if isinstance(fields, str) else ','.join(fields)
+        if brief:
+            params['brief'] = 'true'
+
+        first = self._get_page(url, {**params, 'limit': page_size, 'offset': 0})
+        yield from first['results']
+        if not first.get('next') or not first['results']:
+            return
+
+        # NetBox caps the page size to MAX_PAGE_SIZE, so the size of the first page is the real one
+        page_size = len(first['results'])
+        offsets = range(page_size, first['count'], page_size)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = deque()
+        try:
+            for offset in offsets:
+                pending.append(executor.submit(self._get_page, url, {**params, 'limit': page_size, 'offset': offset}))
+                # Keep a bounded number of pages in flight and in memory
+                if len(pending) >= max_workers * 2:
+                    yield from pending.popleft().result()['results']
+            while pending:
+                yield from pending.popleft().result()['results']
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     def duplicated_device_serials(self):
         """
-        Check if there are multiple devices with the same serial. This should not happen normally
-        :return: The duplicated serial numbers
+        Check if there are multiple devices with the same serial. This should not happen normally.
+        The devices are consumed lazily from the paginated API, requesting only the ID, name and serial fields
+        :return: A dictionary with the duplicated serial numbers as keys and all devices (ID and name) with that serial
         """
-        duplicates = []
+        # serial -> (id, name) of every device seen with that serial
         seen_values = defaultdict(list)
 
-        for entry in [x for x in self.dcim.devices.all() if x.serial]:
-            serial = entry['serial']
-            if seen_values[serial]:
-                duplicates.extend(seen_values[serial])
-            else:
-                seen_values[serial].append(entry['serial'])
+        for entry in self.dcim.devices.filter(fields='id,name,serial'):
+            if entry.serial:
+                seen_values[entry.serial].append((entry.id, entry.name))
+
+        return {serial: [{'id': device_id, 'name': name} for device_id, name in devices]
+                for serial, devices in seen_values.items() if len(devices) > 1}
 
-        return duplicates
+    def get_prefixes(self, compact=False, **filters):
+        """
+        Gets the prefixes as plain rows instead of pynetbox Record objects, which are expensive to build for large
+        IPAM tables
+        :param compact: Return compact records instead of MyDict
+        :param filters: Optional NetBox filters, e.g. vrf_id=1
+        :return: A list with the prefixes
+        """
+        return wrap(self.iter_all('ipam.prefixes', **filters), NetBoxPrefix, compact)
 
     def get_ip_addresses_without_prefix(self):
         """
-        This function returns all IP addresses that have no associated prefix
+        This function returns all IP addresses that have no associated prefix. An IP address is associated with a
+        prefix if any prefix in the same VRF contains it (longest-prefix match), not only a prefix of the same length
         :return:
         """
-        # Get prefixes and IP addresses from NetBox
-        prefixes = [x.prefix for x in self.ipam.prefixes.all()]
-        ip_addresses = [x.address for x in self.ipam.ip_addresses.all()]
+        # Index the prefixes from NetBox by VRF
+        prefixes = PrefixIndex()
+        for prefix in self.iter_all('ipam.prefixes', fields='id,prefix,vrf'):
+            prefixes.add(prefix['prefix'], vrf=_vrf_id(prefix))
 
         result = []
         # Loop through the IP addresses and check each one
-        for ip_address in ip_addresses:
-            # Get the corresponding network
-            subnet = ipaddress.ip_network(ip_address, False)
-            if str(subnet) not in prefixes:
-                logging.info(f"Adding {ip_address} to the list")
+        for ip_address in self.iter_all('ipam.ip_addresses', fields='id,address,vrf'):
+            if not prefixes.contains(ip_address['address'], vrf=_vrf_id(ip_address)):
+                # Get the corresponding network
+                subnet = ipaddress.ip_network(ip_address['address'], False)
+                logging.info(f"Adding {ip_address['address']} to the list")
                 result.append(str(subnet))
 
         return result
@@ -73,3 +196,295 @@ class NetBoxInstance(netbox_api):
                     logging.info(f"Updated primary IP of {device} to {only_ip}")
                 else:
                     logging.error(f"Failed to update primary IP of {device}")
+
+    def bulk_assign_primary_ip(self, dry_run=False, chunk_size=500):
+        """
+        Bulk version of assign_primary_ip. All IP addresses assigned to device interfaces are fetched in one paginated
+        sweep and grouped by device in memory. The primary IP changes are then sent as chunked bulk PATCH requests
+        :param dry_run: Only compute the changes, without writing anything to NetBox
+        :param chunk_size: The maximum number of devices updated by one PATCH request
+        :return: A summary with the planned/applied changes, the failed changes and the skipped devices
+        """
+        summary = {
+            'dry_run': dry_run,
+            'changes': [],
+            'failed': [],
+            'multiple_ips': [],
+            'no_ips': []
+        }
+
+        # Group the IP addresses of all device interfaces by device ID
+        device_ip_addresses = defaultdict(list)
+        for ip_address in self.ipam.ip_addresses.filter(assigned_object_type='dcim.interface'):
+            device = getattr(ip_address.assigned_object, 'device', None) if ip_address.assigned_object else None
+            if device:
+                device_ip_addresses[device.id].append(ip_address)
+
+        for device in self.dcim.devices.filter(has_primary_ip=False):
+            _plan_primary_ip(summary, device, device_ip_addresses.get(device.id, []))
+
+        if not dry_run:
+            self._update_primary_ips(summary, chunk_size)
+
+        return summary
+
+    def _update_primary_ips(self, summary, chunk_size):
+        """
+        Sends the primary IP changes of a bulk_assign_primary_ip summary as chunked bulk PATCH requests. The changes of
+        the chunks which failed are moved from 'changes' to 'failed'
+        """
+        for chunk in chunked(summary['changes'], chunk_size):
+            payload = [{k: v for k, v in x.items() if k not in ('name', 'address')} for x in chunk]
+            try:
+                self.dcim.devices.update(payload)
+                logging.info(f"Updated primary IP of {len(payload)} devices")
+            except RequestError as e:
+                logging.error(f"Failed to update primary IP of {len(payload)} devices: {e}")
+                summary['failed'].extend(chunk)
+
+        if summary['failed']:
+            failed_ids = {x['id'] for x in summary['failed']}
+            summary['changes'] = [x for x in summary['changes'] if x['id'] not in failed_ids]
+
+
+def _plan_primary_ip(summary, device, ip_addresses):
+    """
+    Adds the primary IP change of a device without a primary IP to a bulk_assign_primary_ip summary, or skips the device
+    if it doesn't have exactly one IP address
+    """
+    if not ip_addresses:
+        summary['no_ips'].append(device.name)
+        return
+    if len(ip_addresses) > 1:
+        summary['multiple_ips'].append(device.name)
+        return
+
+    only_ip = ip_addresses[0]
+    version = ipaddress.ip_interface(only_ip.address).version
+    summary['changes'].append({
+        'id': device.id,
+        'name': device.name,
+        'address': only_ip.address,
+        f'primary_ip{version}': only_ip.id
+    })
+
+
+def _comparable(value):
+    """
+    Reduces a NetBox field value to what is written for it: the ID of a related object, the value of a choice field,
+    and the IDs of a list of related objects (e.g. tags)
+    """
+    if isinstance(value, dict):
+        if 'value' in value and 'label' in value:
+            return value['value']
+        if 'id' in value:
+            return value['id']
+        return {k: _comparable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_comparable(x) for x in value]
+
+    return value
+
+
+def _hashable(value):
+    # A hashable form of a comparable value, for the natural keys, e.g. a related object given by its fields
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(_hashable(x) for x in value)
+
+    return value
+
+
+def _matches(current, wanted):
+    """
+    Tells if a NetBox field value already has the value which would be written for it. A related object can be given
+    by ID, or by some of its fields (e.g. {'id': 3} or {'name': 'core'}), and lists (e.g. tags) are compared in any
+    order
+    """
+    if isinstance(wanted, dict):
+        if not isinstance(current, dict):
+            return False
+        return all(_matches(current.get(k), v) for k, v in wanted.items())
+
+    if isinstance(wanted, (list, tuple)):
+        if not isinstance(current, list) or len(current) != len(wanted):
+            return False
+        remaining = list(current)
+        for item in wanted:
+            match = next((i for i, x in enumerate(remaining) if _matches(x, item)), None)
+            if match is None:
+                return False
+            del remaining[match]
+        return True
+
+    return _comparable(current) == wanted
+
+
+def _related_ids(objects, field, fields):
+    """
+    Indexes the related objects in a field of NetBox objects by some of their fields
+    :return: A dictionary with the hashable values of the fields as keys and the IDs of the related objects as values
+    """
+    index = {}
+    for obj in objects:
+        related = obj.get(field)
+        if isinstance(related, dict) and 'id' in related:
+            index[_hashable({x: _comparable(related.get(x)) for x in fields})] = related['id']
+
+    return index
+
+
+class NetBoxSync(object):
+    """
+    Synchronizes the discovered state of one NetBox endpoint, e.g. the devices collected with CiscoSSHDevice or
+    VManage. The existing objects are loaded once and indexed by a natural key (serial, name, address...), the
+    discovered objects are diffed against them, and only the differences are written with the bulk create, update
+    and delete endpoints, in chunks sent concurrently. Unchanged objects are never written, so a second run without
+    changes makes no write requests at all
+    """
+    def __init__(self, netbox, endpoint, key, filters=None, delete=False, chunk_size=200, max_workers=4):
+        """
+        :param netbox: The NetBoxInstance
+        :param endpoint: The endpoint as app.name, e.g. dcim.devices or ipam.ip_addresses
+        :param key: The natural key field, or a tuple of fields, e.g. 'serial' or ('device', 'name') for interfaces.
+        Related objects are compared by ID and choice fields by value. A discovered related object can also be given
+        by other fields, e.g. {'name': 'sw1'}, which are matched against the related objects of the existing objects
+        :param filters: Optional NetBox filters which select the objects managed by the sync, e.g. site_id=1
+        :param delete: Delete the selected objects which were not discovered
+        :param chunk_size: The maximum number of objects written by one bulk request
+        :param max_workers: The maximum number of bulk requests sent at the same time
+        """
+        app, name = endpoint.split('.')
+        self.netbox = netbox
+        self.endpoint_name = endpoint
+        self.endpoint = getattr(getattr(netbox, app), name)
+        self.key = (key,) if isinstance(key, str) else tuple(key)
+        self.filters = filters or {}
+        self.delete = delete
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+
+    def _key(self, obj):
+        return tuple(_hashable(_comparable(obj.get(x))) for x in self.key)
+
+    def _discovered_key(self, obj, existing, related):
+        """
+        Returns the natural key of a discovered object. A related object given by other fields than its ID is replaced
+        by the ID of the related object with these fields in the existing objects, if there is one
+        :param related: The cache of the related object IDs by key field and fields, filled by this method
+        """
+        key = []
+        for field in self.key:
+            value = _comparable(obj.get(field))
+            if isinstance(value, dict):
+                fields = tuple(sorted(value))
+                if (field, fields) not in related:
+                    related[(field, fields)] = _related_ids(existing.values(), field, fields)
+                value = _hashable(value)
+                value = related[(field, fields)].get(value, value)
+            key.append(_hashable(value))
+
+        return tuple(key)
+
+    def load(self):
+        """
+        Loads the existing objects with one paginated sweep, with the pages fetched in parallel, and indexes them by
+        natural key
+        :return: A dictionary with the natural keys as keys and the objects (dictionaries) as values
+        """
+        index = {}
+        for obj in self.netbox.iter_all(self.endpoint_name, **self.filters):
+            key = self._key(obj)
+            if key in index:
+                logging.warning(f"Duplicated key {key} in {self.endpoint.url}, only the first object is synchronized")
+                continue
+            index[key] = obj
+
+        return index
+
+    def diff(self, discovered, existing=None):
+        """
+        Computes the changes which make NetBox match the discovered objects
+        :param discovered: An iterable of dictionaries with the natural key fields and the fields to synchronize, in
+        the format of the NetBox API write requests (e.g. 'site': 3 or {'id': 3}, 'status': 'active',
+        'tags': [{'name': 'core'}]). Lists of related objects are compared in any order
+        :param existing: Optional index returned by load(), loaded from NetBox if not provided
+        :return: A dictionary with the 'create' payloads, the 'update' payloads (ID and changed fields only), the
+        'delete' IDs and the number of 'unchanged' objects
+        """
+        if existing is None:
+            existing = self.load()
+
+        plan = {'create': [], 'update': [], 'delete': [], 'unchanged': 0}
+        seen = set()
+        related = {}
+
+        for obj in discovered:
+            key = self._discovered_key(obj, existing, related)
+            if key in seen:
+                logging.warning(f"Duplicated discovered key {key}, only the first object is synchronized")
+                continue
+            seen.add(key)
+
+            current = existing.get(key)
+            if current is None:
+                plan['create'].append(dict(obj))
+                continue
+
+            changes = {k: v for k, v in obj.items() if not _matches(current.get(k), v)}
+            if changes:
+                plan['update'].append({'id': current['id'], **changes})
+            else:
+                plan['unchanged'] += 1
+
+        if self.delete:
+            plan['delete'] = [obj['id'] for key, obj in existing.items() if key not in seen]
+
+        return plan
+
+    def apply(self, plan):
+        """
+        Writes the changes of a plan with the bulk endpoints. The deletions run first, so that their names and
+        addresses are free for the updates and creations. The chunks of each step are sent concurrently
+        :param plan: The plan returned by diff()
+        :return: A summary with the 'created', 'updated' and 'deleted' objects and the 'failed' ones with their error
+        """
+        summary = {'created': [], 'updated': [], 'deleted': [], 'failed': []}
+
+        steps = [('delete', 'deleted', self.endpoint.delete), ('update', 'updated', self.endpoint.update),
+                 ('create', 'created', self.endpoint.create)]
+        for action, done, write in steps:
+            chunks = list(chunked(plan[action], self.chunk_size))
+            if not chunks:
+                continue
+
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+                futures = [(executor.submit(write, chunk), chunk) for chunk in chunks]
+
+            for future, chunk in futures:
+                try:
+                    future.result()
+                    summary[done].extend(chunk)
+                    logging.info(f"{action.capitalize()}d {len(chunk)} objects in {self.endpoint.url}")
+                except Exception as e:
+                    # A failed chunk, whatever the error, doesn't stop the other chunks and steps
+                    logging.error(f"Failed to {action} {len(chunk)} objects in {self.endpoint.url}: {e}")
+                    summary['failed'].extend({'action': action, 'object': x, 'error': str(e)} for x in chunk)
+
+        return summary
+
+    def sync(self, discovered, dry_run=False):
+        """
+        Loads the existing objects, computes the diff and applies it
+        :param discovered: An iterable of dictionaries with the discovered objects, see diff()
+        :param dry_run: Only compute the changes, without writing anything to NetBox
+        :return: The plan of diff() with 'dry_run', and with the summary of apply() unless dry_run is set
+        """
+        plan = self.diff(discovered)
+        result = {'dry_run': dry_run, **plan}
+
+        if not dry_run:
+            result.update(self.apply(plan))
+
+        return result
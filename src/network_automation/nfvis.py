@@ -1,6 +1,10 @@
 import json
+import logging
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from network_automation import environment
+from network_automation.cache import new_session
 
 header = {
     "content-type": "application/vnd.yang.collection+json",
@@ -12,10 +16,18 @@ class NFVISServer(object):
     """
     This represents a Cisco NFVIS server
     """
-    def __init__(self, hostname, username=None, password=None, verify=True):
+    def __init__(self, hostname, username=None, password=None, verify=True, timeout=None, platform_ttl=300,
+                 cache=None):
+        """
+        :param timeout: Optional timeout in seconds for each API request
+        :param platform_ttl: The number of seconds the platform details are cached for, None to cache them forever
+        :param cache: Optional ResponseCache for the API requests, e.g. shared by the servers of a job
+        """
         if not hostname:
             raise ValueError("Hostname is missing")
 
+        environment.load_environment()
+
         self.hostname = hostname
         self.url = 'https://' + hostname
         self.username = username or environment.get_cisco_username()
@@ -24,29 +36,71 @@ class NFVISServer(object):
         if not self.username or not self.password:
             raise ValueError("username/password is missing and could not be retrieved from environment variables")
 
-        self.session = requests.Session()
+        self.session = new_session(cache, 'nfvis')
         if not verify:
             self.session.verify = False
 
         self.session.auth = (self.username, self.password)
+        self.timeout = timeout
+        self.platform_ttl = platform_ttl
+
+        # The platform details are fetched on first use, so creating the object doesn't connect to the server
+        self._platform = None
+        self._platform_time = None
+
+    @property
+    def platform(self):
+        if self._platform_expired():
+            try:
+                self.get_platform_details(refresh=True)
+            except (ConnectionError, requests.exceptions.RequestException) as e:
+                # The getters return empty values for an unreachable server, the details are fetched again next time
+                logging.warning(f"Failed to get the platform details of {self.hostname}: {e}")
+                return None
+
+        return self._platform
+
+    @platform.setter
+    def platform(self, value):
+        self._platform = value
+        self._platform_time = time.monotonic()
 
-        self.platform = None
-        self.get_platform_details()
+    def _platform_expired(self):
+        if self._platform_time is None:
+            return True
 
-    def get_platform_details(self):
-        if self.platform:
-            return self.platform
+        return self.platform_ttl is not None and time.monotonic() - self._platform_time > self.platform_ttl
+
+    def get_platform_details(self, refresh=False):
+        """
+        Gets the platform details of the server, from the cache if they have not expired
+        :param refresh: Fetch the platform details even if they are cached
+        :return: The platform details, or None if they could not be parsed. A response which could not be parsed
+        isn't cached. An error response, or one without the platform details, raises a ConnectionError
+        """
+        if not refresh and not self._platform_expired():
+            return self._platform
 
         uri = self.url + '/api/operational/platform-detail'
         try:
-            resp = self.session.get(uri, headers=header)
+            resp = self.session.get(uri, headers=header, timeout=self.timeout)
         except requests.exceptions.ConnectionError:
             raise ConnectionError(f"Could not connect to {self.hostname}")
 
+        if resp.status_code != 200:
+            raise ConnectionError(f"Could not get the platform details of {self.hostname}, "
+                                  f"status code {resp.status_code}")
+
         try:
             self.platform = json.loads(resp.text)["platform_info:platform-detail"]
         except json.decoder.JSONDecodeError:
             print(f"Error getting platform details, raw response: {resp.text}")
+            self._platform = None
+            self._platform_time = None
+        except (KeyError, TypeError):
+            raise ConnectionError(f"Unexpected platform details response from {self.hostname}: {resp.text}")
+
+        return self._platform
 
     def get_serial(self):
         try:
@@ -73,7 +127,7 @@ class NFVISServer(object):
             uri = self.url + '/api/operational/pnics'
 
         try:
-            resp = self.session.get(uri, headers=header)
+            resp = self.session.get(uri, headers=header, timeout=self.timeout)
         except requests.exceptions.ConnectionError:
             print("Could not get interface information")
             return None
@@ -90,7 +144,7 @@ class NFVISServer(object):
             uri = self.url + '/api/operational/switch/interface/status'
 
         try:
-            resp = self.session.get(uri, headers=header)
+            resp = self.session.get(uri, headers=header, timeout=self.timeout)
         except requests.exceptions.ConnectionError:
             print("Could not get switch interface information")
             return None
@@ -107,7 +161,7 @@ class NFVISServer(object):
             uri = self.url + '/api/operational/switch/interface/switchPort'
 
         try:
-            resp = self.session.get(uri, headers=header)
+            resp = self.session.get(uri, headers=header, timeout=self.timeout)
         except requests.exceptions.ConnectionError:
             print("Could not get switchport information")
             return None
@@ -116,3 +170,126 @@ class NFVISServer(object):
             return json.loads(resp.text)["switch:switchPort"]
 
         return []
+
+    def get_inventory(self, detailed=False, executor=None):
+        """
+        Gets the platform details, interfaces, switch interfaces and switchport status of the server. The operational
+        endpoints are requested in parallel
+        :param detailed: Get the detailed (deep) interface information
+        :param executor: Optional thread pool executor for the requests, a new one is used if None
+        :return: A dictionary with the inventory of the server
+        """
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=3)
+
+        try:
+            futures = {
+                'interfaces': executor.submit(self.get_interfaces, detailed),
+                'switch_interfaces': executor.submit(self.get_switch_interfaces, detailed),
+                'switchports': executor.submit(self.get_switchport_status, detailed)
+            }
+            # Raises for an unreachable server, unlike the getters
+            self.get_platform_details()
+            inventory = {'hostname': self.hostname, 'serial': self.get_serial(), 'pid': self.get_pid(),
+                         'version': self.get_version()}
+            inventory.update({key: future.result() for key, future in futures.items()})
+        finally:
+            if own_executor:
+                executor.shutdown(wait=False)
+
+        return inventory
+
+
+def prefetch_platform_details(servers, max_workers=32):
+    """
+    This function fetches the platform details of many NFVIS servers concurrently, so that the serial, PID and version
+    getters don't make one request per server
+    :param servers: The list of NFVISServer objects
+    :param max_workers: The maximum number of requests at the same time
+    :return: A dictionary with the hostnames of the servers which could not be reached as keys and the errors as values
+    """
+    errors = {}
+
+    def fetch(server):
+        try:
+            server.get_platform_details()
+        except (ConnectionError, requests.exceptions.RequestException) as e:
+            logging.error(f"Failed to get the platform details of {server.hostname}: {e}")
+            errors[server.hostname] = str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(fetch, servers))
+
+    return errors
+
+
+def _failed_inventory(hostname, error):
+    return {'hostname': hostname, 'serial': None, 'pid': None, 'version': None, 'interfaces': None,
+            'switch_interfaces': None, 'switchports': None, 'error': error}
+
+
+def _inventory_result(future, hostname):
+    # Any error of a server, e.g. an unexpected response, is recorded without stopping the other servers
+    try:
+        return {**future.result(), 'error': None}
+    except Exception as e:
+        logging.error(f"Failed to collect the inventory of {hostname}: {e}")
+        return _failed_inventory(hostname, str(e) or type(e).__name__)
+
+
+def collect_nfvis_inventory(hostnames, username=None, password=None, verify=True, detailed=False, max_workers=32,
+                            timeout=60, cache=None):
+    """
+    This function collects the inventory of many NFVIS servers concurrently. The servers are connected to in parallel
+    and the operational endpoints of each server are requested in parallel too. A failed or slow server doesn't stop
+    the collection of the others
+    :param hostnames: The list of NFVIS hostnames
+    :param username: The username, or None to use the environment variables
+    :param password: The password, or None to use the environment variables
+    :param verify: Verify the TLS certificates
+    :param detailed: Get the detailed (deep) interface information
+    :param max_workers: The maximum number of servers processed at the same time
+    :param timeout: The maximum number of seconds spent on one server
+    :param cache: Optional ResponseCache for the API requests
+    :return: A dictionary with the hostnames as keys and the inventory of each server as values. The inventory has an
+    'error' key, which is None if the collection succeeded
+    """
+    started = {}
+
+    def collect(hostname):
+        started[hostname] = time.monotonic()
+        server = NFVISServer(hostname, username, password, verify=verify, timeout=timeout, cache=cache)
+        try:
+            return server.get_inventory(detailed, executor=endpoint_executor)
+        finally:
+            server.session.close()
+
+    host_executor = ThreadPoolExecutor(max_workers=max_workers)
+    # The endpoint requests run in their own pool, so that hosts waiting for them never block the pool they need
+    endpoint_executor = ThreadPoolExecutor(max_workers=max_workers * 3)
+    pending = {host_executor.submit(collect, x): x for x in hostnames}
+    inventory = {}
+
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=min(1, timeout), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                hostname = pending.pop(future)
+                inventory[hostname] = _inventory_result(future, hostname)
+
+            # Give up on servers which exceed the timeout. Their worker thread is released by the request timeouts
+            now = time.monotonic()
+            for future, hostname in list(pending.items()):
+                if hostname in started and now - started[hostname] > timeout:
+                    del pending[future]
+                    logging.error(f"Timed out collecting the inventory of {hostname}")
+                    inventory[hostname] = _failed_inventory(hostname, f"Timed out after {timeout} seconds")
+    finally:
+        for future in pending:
+            future.cancel()
+        host_executor.shutdown(wait=False)
+        endpoint_executor.shutdown(wait=False)
+
+    return {x: inventory[x] for x in hostnames}
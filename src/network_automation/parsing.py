@@ -0,0 +1,103 @@
+import os
+import threading
+import textfsm
+from textfsm import clitable
+from network_automation.metrics import registry as metrics
+
+# (platform, command) -> (compiled TextFSM template, lock), or None if there is no single template for the command
+_templates = {}
+_templates_lock = threading.Lock()
+_index = None
+
+
+def _get_index():
+    global _index
+
+    if _index is None:
+        from netmiko.utilities import get_template_dir
+
+        template_dir = get_template_dir()
+        _index = clitable.CliTable(os.path.join(template_dir, 'index'), template_dir)
+
+    return _index
+
+
+def _compile_template(platform, command):
+    index = _get_index()
+    row = index.index.GetRowMatch({'Command': command, 'Platform': platform})
+    if not row:
+        return None
+
+    templates = index.index.index[row]['Template'].split(':')
+    if len(templates) != 1:
+        # Merging the results of several templates is left to Netmiko
+        return None
+
+    with open(os.path.join(index.template_dir, templates[0])) as f:
+        return textfsm.TextFSM(f), threading.Lock()
+
+
+def get_template(platform, command):
+    """
+    Returns the compiled ntc-templates TextFSM template for a command. The templates are looked up and compiled only
+    once per process
+    :param platform: The Netmiko device type, e.g. cisco_ios
+    :param command: The command
+    :return: A tuple (TextFSM template, lock), or None if there is no single template for the command
+    """
+    key = (platform, command)
+    try:
+        return _templates[key]
+    except KeyError:
+        pass
+
+    with _templates_lock:
+        if key not in _templates:
+            _templates[key] = _compile_template(platform, command)
+
+    return _templates[key]
+
+
+def clear_template_cache():
+    """
+    Removes all compiled templates from the cache
+    :return:
+    """
+    global _index
+
+    with _templates_lock:
+        _templates.clear()
+        _index = None
+
+
+def parse_output(platform, command, output):
+    """
+    Parses the output of a command with the cached TextFSM template, like Netmiko use_textfsm=True does.
+    This function can be submitted to a thread or process pool, so that parsing doesn't hold the SSH session
+    :param platform: The Netmiko device type, e.g. cisco_ios
+    :param command: The command which produced the output
+    :param output: The raw output
+    :return: A list of dictionaries with lowercase keys, or the raw output if it could not be parsed
+    """
+    try:
+        template = get_template(platform, command)
+    except (clitable.CliTableError, textfsm.TextFSMTemplateError, OSError, ValueError):
+        return output
+
+    if template is None:
+        if platform == 'cisco_xe':
+            return parse_output('cisco_ios', command, output)
+
+        from netmiko.utilities import get_structured_data
+        return get_structured_data(output, platform=platform, command=command)
+
+    fsm, lock = template
+    with metrics.time_parse(platform, command), lock:
+        fsm.Reset()
+        header = [x.lower() for x in fsm.header]
+        rows = fsm.ParseText(output)
+
+    if not rows:
+        return output
+
+    return [dict(zip(header, row)) for row in rows]
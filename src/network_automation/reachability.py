@@ -0,0 +1,284 @@
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import struct
+import time
+
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+ICMP_PROTOCOL = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+
+    return ~total & 0xffff
+
+
+def open_icmp_socket(family=socket.AF_INET):
+    """
+    Opens a non-blocking ICMP socket. An unprivileged datagram (ping) socket is tried first, then a raw socket
+    :param family: socket.AF_INET or socket.AF_INET6
+    :return: A tuple (socket, raw), or (None, None) if ICMP sockets are not permitted
+    """
+    for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(family, sock_type, ICMP_PROTOCOL[family])
+        except OSError:
+            continue
+
+        sock.setblocking(False)
+        try:
+            # Many replies can arrive at the same time in large sweeps
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
+
+        return sock, sock_type == socket.SOCK_RAW
+
+    return None, None
+
+
+class ICMPProber(object):
+    """
+    Sends ICMP echo requests to many addresses from one socket per address family, and matches the replies by
+    address and sequence number in the event loop
+    """
+    def __init__(self):
+        self.identifier = os.getpid() & 0xffff
+        self._sequence = itertools.count()
+        self._sockets = {}
+        self._waiters = {}
+
+    @property
+    def available(self):
+        """
+        True if ICMP sockets are permitted for IPv4
+        """
+        return self._get_socket(socket.AF_INET) is not None
+
+    def _get_socket(self, family):
+        if family not in self._sockets:
+            sock, raw = open_icmp_socket(family)
+            self._sockets[family] = (sock, raw)
+            if sock is not None:
+                asyncio.get_running_loop().add_reader(sock.fileno(), self._read, sock, family, raw)
+
+        return self._sockets[family][0]
+
+    def close(self):
+        for sock, _ in self._sockets.values():
+            if sock is not None:
+                asyncio.get_running_loop().remove_reader(sock.fileno())
+                sock.close()
+        self._sockets.clear()
+
+    def _read(self, sock, family, raw):
+        while True:
+            try:
+                data, address = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logging.debug(f"Error reading from the ICMP socket: {e}")
+                return
+
+            if raw and family == socket.AF_INET:
+                # Raw IPv4 sockets return the IP header too
+                data = data[(data[0] & 0x0f) * 4:]
+            if len(data) < 8 or data[0] != ICMP_ECHO_REPLY[family]:
+                continue
+
+            identifier, sequence = struct.unpack('!HH', data[4:8])
+            # Datagram sockets get the replies of their own requests only, with an identifier chosen by the kernel
+            if raw and identifier != self.identifier:
+                continue
+
+            waiter = self._waiters.pop((address[0].split('%')[0], sequence), None)
+            if waiter and not waiter.done():
+                waiter.set_result(time.perf_counter())
+
+    async def ping(self, address, family, timeout):
+        """
+        Sends one echo request and waits for the reply
+        :param address: The IP address
+        :param family: The address family
+        :param timeout: The number of seconds to wait for the reply
+        :return: The round trip time in milliseconds, or None if there was no reply
+        """
+        sock = self._get_socket(family)
+        if sock is None:
+            raise PermissionError("ICMP sockets are not permitted")
+
+        sequence = next(self._sequence) & 0xffff
+        header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST[family], 0, 0, self.identifier, sequence)
+        payload = b'network_automation'
+        if family == socket.AF_INET:
+            header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST[family], 0, _checksum(header + payload), self.identifier,
+                                 sequence)
+
+        key = (address, sequence)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[key] = waiter
+        deadline = time.perf_counter() + timeout
+        try:
+            while True:
+                try:
+                    sent = time.perf_counter()
+                    sock.sendto(header + payload, (address, 0))
+                    break
+                except (BlockingIOError, InterruptedError):
+                    # The socket buffer is full, wait for it to drain
+                    if time.perf_counter() > deadline:
+                        return None
+                    await asyncio.sleep(0.001)
+                except OSError as e:
+                    logging.debug(f"Could not send an echo request to {address}: {e}")
+                    return None
+
+            received = await asyncio.wait_for(waiter, max(deadline - time.perf_counter(), 0))
+            return (received - sent) * 1000
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._waiters.pop(key, None)
+
+
+async def _tcp_connect(address, port):
+    # Returns the connection time in milliseconds, or None if the port didn't answer
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.open_connection(address, port)
+    except ConnectionRefusedError:
+        return (time.perf_counter() - started) * 1000
+    except OSError:
+        return None
+
+    rtt = (time.perf_counter() - started) * 1000
+    writer.close()
+    return rtt
+
+
+async def tcp_probe(address, ports=(22, 443), timeout=2):
+    """
+    Checks if a host is alive by connecting to TCP ports. A refused connection proves that the host is alive too.
+    The ports are tried at the same time, and the probe stops at the first answer
+    :param address: The IP address or hostname
+    :param ports: The ports to try
+    :param timeout: The number of seconds to wait for an answer
+    :return: The round trip time of the first answered port in milliseconds, or None if no port answered
+    """
+    tasks = [asyncio.ensure_future(_tcp_connect(address, port)) for port in ports]
+    try:
+        for task in asyncio.as_completed(tasks, timeout=timeout):
+            rtt = await task
+            if rtt is not None:
+                return rtt
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return None
+
+
+def _use_icmp(method, prober):
+    """
+    Chooses between ICMP and TCP probes
+    :return: True if ICMP probes are sent, False if only TCP probes are
+    """
+    use_icmp = method != 'tcp' and prober.available
+    if method == 'icmp' and not use_icmp:
+        raise PermissionError("ICMP sockets are not permitted, use method='tcp' or 'auto'")
+    if method == 'auto' and not use_icmp:
+        logging.info("ICMP sockets are not permitted, using TCP probes")
+
+    return use_icmp
+
+
+async def _probe_address(prober, address, family, method, use_icmp, count, timeout, tcp_ports):
+    """
+    Probes a resolved address `count` times, with TCP as fallback of ICMP in 'auto' mode
+    :return: The round trip times, None for the probes which were not answered, and the method of the probes
+    """
+    rtts, probe_method = [], None
+    if use_icmp:
+        try:
+            rtts = [await prober.ping(address, family, timeout) for _ in range(count)]
+            probe_method = 'icmp'
+        except PermissionError:
+            # ICMP may be permitted for IPv4 only
+            if method == 'icmp':
+                raise
+    if method == 'tcp' or method == 'auto' and not any(x is not None for x in rtts):
+        probe_method = 'tcp'
+        rtts = [await tcp_probe(address, tcp_ports, timeout) for _ in range(count)]
+
+    return rtts, probe_method
+
+
+def _sweep_result(rtts, count, method):
+    # The result of a host, unreachable with all probes lost if there are no round trip times
+    answered = [x for x in rtts if x is not None]
+    return {'reachable': bool(answered), 'rtt': sum(answered) / len(answered) if answered else None,
+            'loss': 1 - len(answered) / count, 'method': method}
+
+
+async def async_ping_sweep(hosts, count=2, timeout=2, concurrency=1000, tcp_ports=(22, 443), method='auto'):
+    """
+    Checks the reachability of many hosts concurrently from one event loop. ICMP echo requests are sent from a single
+    datagram or raw socket when permitted. Otherwise, and for hosts which don't answer ICMP in 'auto' mode, TCP
+    connections are tried on tcp_ports
+    :param hosts: The list of IP addresses or hostnames
+    :param count: The number of probes per host
+    :param timeout: The number of seconds to wait for each probe
+    :param concurrency: The maximum number of hosts probed at the same time
+    :param tcp_ports: The TCP ports of the fallback probes
+    :param method: 'auto', 'icmp' or 'tcp'
+    :return: A dictionary with the hosts as keys and dictionaries with reachable, rtt (average, milliseconds), loss
+    (fraction of the probes) and method as values
+    """
+    if method not in ('auto', 'icmp', 'tcp'):
+        raise ValueError("method must be 'auto', 'icmp' or 'tcp'")
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    prober = ICMPProber()
+    use_icmp = _use_icmp(method, prober)
+
+    async def probe(host):
+        async with semaphore:
+            try:
+                family, _, _, _, sockaddr = (await loop.getaddrinfo(host, None, type=socket.SOCK_DGRAM))[0]
+            except (socket.gaierror, UnicodeError) as e:
+                logging.info(f"Could not resolve {host}: {e}")
+                return _sweep_result([], count, None)
+
+            rtts, probe_method = await _probe_address(prober, sockaddr[0], family, method, use_icmp, count, timeout,
+                                                      tcp_ports)
+
+        return _sweep_result(rtts, count, probe_method)
+
+    try:
+        results = await asyncio.gather(*[probe(x) for x in hosts])
+    finally:
+        prober.close()
+
+    return dict(zip(hosts, results))
+
+
+def ping_sweep(hosts, count=2, timeout=2, concurrency=1000, tcp_ports=(22, 443), method='auto'):
+    """
+    Synchronous version of async_ping_sweep, which runs the sweep in a new event loop
+    :return: A dictionary with the hosts as keys and dictionaries with reachable, rtt, loss and method as values
+    """
+    return asyncio.run(async_ping_sweep(hosts, count, timeout, concurrency, tcp_ports, method))
@@ -0,0 +1,198 @@
+from collections.abc import Mapping
+from operator import attrgetter
+from mydict import MyDict
+
+
+class Record(Mapping):
+    """
+    Compact read-only record for rows of a known schema. The known fields are stored in slots instead of a per-row
+    dictionary, so large result sets use less memory than MyDict and attribute access is a slot lookup. A record is a
+    read-only mapping with the keys of the row it was created from: iteration, len(), `in` and equality are those of
+    the row, and it isn't hashable. Like MyDict, a field which is missing in the row returns None as an attribute,
+    but like a dictionary, item access raises a KeyError for it. Keys which are not part of the schema are kept in a
+    small dictionary, so no data is lost
+    """
+    __slots__ = ('_extra', '_missing')
+    # Original keys of the schema, and the matching attribute names (e.g. 'host-name' -> host_name)
+    _keys = ()
+    _fields = ()
+    # Original key or attribute name -> attribute name
+    _attributes = {}
+    _key_set = frozenset()
+    # Slot setters of the fields, and a getter of all their values
+    _setters = ()
+    _values = staticmethod(lambda record: ())
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a record from a dictionary, e.g. a parsed command output row or a JSON object
+        :param data: The dictionary
+        :return: The record
+        """
+        record = object.__new__(cls)
+        for setter, value in zip(cls._setters, map(data.get, cls._keys)):
+            setter(record, value)
+
+        unknown = data.keys() - cls._attributes.keys()
+        object.__setattr__(record, '_extra', {x: data[x] for x in unknown} if unknown else None)
+        # The attribute names of the fields which are missing in the row, None if the row has all of them
+        missing = cls._key_set.difference(data)
+        object.__setattr__(record, '_missing', {cls._attributes[x] for x in missing} if missing else None)
+
+        return record
+
+    def __getattr__(self, name):
+        # Only called for attributes which are not fields, e.g. keys outside of the schema
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        extra = self._extra
+        if extra:
+            if name in extra:
+                return extra[name]
+            if name.replace('_', '-') in extra:
+                return extra[name.replace('_', '-')]
+
+        return None
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __getitem__(self, key):
+        attribute = self._attributes.get(key)
+        if attribute is not None:
+            missing = self._missing
+            if missing and attribute in missing:
+                raise KeyError(key)
+
+            return getattr(self, attribute)
+
+        extra = self._extra
+        if extra and key in extra:
+            return extra[key]
+
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        attribute = self._attributes.get(key)
+        if attribute is not None:
+            missing = self._missing
+            return not missing or attribute not in missing
+
+        extra = self._extra
+        return bool(extra) and key in extra
+
+    def __iter__(self):
+        missing = self._missing
+        if missing:
+            yield from (key for key, field in zip(self._keys, self._fields) if field not in missing)
+        else:
+            yield from self._keys
+
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self._keys) - len(self._missing or ()) + len(self._extra or ())
+
+    # Records hold lists and dictionaries (e.g. tags), so they can't be hashed, like the rows they replace
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return self.from_dict, (self.to_dict(),)
+
+    def to_dict(self):
+        """
+        Returns the record as a dictionary with the original keys
+        :return:
+        """
+        result = dict(zip(self._keys, self._values(self)))
+        if self._missing:
+            for key, field in zip(self._keys, self._fields):
+                if field in self._missing:
+                    del result[key]
+
+        if self._extra:
+            result.update(self._extra)
+
+        return result
+
+
+def record_type(name, keys):
+    """
+    Creates a Record subclass for a schema
+    :param name: The name of the class
+    :param keys: The keys of the schema. Dashes are replaced by underscores in the attribute names
+    :return: The Record subclass
+    """
+    keys = tuple(keys)
+    fields = tuple(x.replace('-', '_') for x in keys)
+    # Allow item access with the original keys and the attribute names, e.g. record['host-name'] or ['host_name']
+    attributes = {**{x: x for x in fields}, **dict(zip(keys, fields))}
+
+    cls = type(name, (Record,), {'__slots__': fields, '__module__': __name__, '_keys': keys, '_fields': fields,
+                                 '_attributes': attributes, '_key_set': frozenset(keys)})
+    cls._setters = tuple(getattr(cls, x).__set__ for x in fields)
+    # attrgetter returns a single value instead of a tuple for one field
+    cls._values = staticmethod(attrgetter(*fields) if len(fields) > 1 else lambda record: (getattr(record, fields[0]),))
+
+    return cls
+
+
+def wrap(rows, cls, compact):
+    """
+    Wraps result rows in MyDict, or in compact records if requested
+    :param rows: The list of dictionaries
+    :param cls: The Record subclass of the schema
+    :param compact: Return compact records instead of MyDict
+    :return: The list of records
+    """
+    if compact:
+        return [cls.from_dict(x) for x in rows]
+
+    return [MyDict(x) for x in rows]
+
+
+IOSInterface = record_type('IOSInterface', [
+    'interface', 'link_status', 'protocol_status', 'hardware_type', 'mac_address', 'bia', 'description',
+    'ip_address', 'prefix_length', 'mtu', 'duplex', 'speed', 'media_type', 'bandwidth', 'delay', 'encapsulation',
+    'last_input', 'last_output', 'last_output_hang', 'queue_strategy', 'input_rate', 'output_rate', 'input_pps',
+    'output_pps', 'input_packets', 'output_packets', 'runts', 'giants', 'input_errors', 'crc', 'frame', 'overrun',
+    'abort', 'output_errors', 'vlan_id', 'vlan_id_inner', 'vlan_id_outer', 'queue_size', 'queue_max', 'queue_drops',
+    'queue_flushes', 'queue_output_drops'
+])
+
+IOSIPInterface = record_type('IOSIPInterface', ['interface', 'ip_address', 'status', 'proto'])
+
+VManageDevice = record_type('VManageDevice', [
+    'deviceId', 'system-ip', 'host-name', 'reachability', 'status', 'personality', 'device-type', 'timezone',
+    'device-groups', 'lastupdated', 'bfdSessionsUp', 'domain-id', 'board-serial', 'certificate-validity',
+    'max-controllers', 'uuid', 'bfdSessions', 'controlConnections', 'device-model', 'version', 'connectedVManages',
+    'site-id', 'ompPeers', 'latitude', 'longitude', 'isDeviceGeoData', 'platform', 'uptime-date', 'statusOrder',
+    'device-os', 'validity', 'state', 'state_description', 'model_sku', 'local-system-ip', 'total_cpu_count',
+    'linux_cpu_count', 'testbed_mode', 'layoutLevel'
+])
+
+VManagePolicy = record_type('VManagePolicy', [
+    'listId', 'definitionId', 'policyId', 'name', 'type', 'description', 'entries', 'definition', 'sequences',
+    'policyName', 'policyDescription', 'policyType', 'policyDefinition', 'lastUpdated', 'owner', 'infoTag',
+    'referenceCount', 'references', 'isActivatedByVsmart', 'mode', 'optimized'
+])
+
+TunnelMetrics = record_type('TunnelMetrics', [
+    'vdevice_name', 'name', 'state', 'proto', 'entry_time', 'count', 'loss_percentage', 'vqoe_score', 'latency',
+    'jitter', 'rx_octets', 'tx_octets'
+])
+
+NetBoxPrefix = record_type('NetBoxPrefix', [
+    'id', 'url', 'display_url', 'display', 'family', 'prefix', 'vrf', 'scope_type', 'scope_id', 'scope', 'site',
+    'tenant', 'vlan', 'status', 'role', 'is_pool', 'mark_utilized', 'description', 'comments', 'tags',
+    'custom_fields', 'created', 'last_updated', 'children', '_depth'
+])
@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+
+
+class TimeSeriesStore(object):
+    """
+    Local SQLite store for statistics histogram buckets. Each bucket is one row with the series (query), device,
+    name (e.g. tunnel), the other grouping fields of the query, bucket start time and one REAL column per metric, so
+    range queries don't need the controller.
+    The store also keeps the high-water mark of each series and device for incremental collection
+    """
+    def __init__(self, path=':memory:', metrics=(), keys=()):
+        """
+        :param path: The SQLite database file, or ':memory:'
+        :param metrics: The names of the metric columns
+        :param keys: The names of the fields besides the name which the buckets are grouped by, e.g. state and proto.
+        Buckets which only differ in one of them are stored apart
+        """
+        self.metrics = list(metrics)
+        self.keys = list(keys)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        keys = ''.join(f', "{x}" TEXT' for x in self.keys)
+        columns = ''.join(f', "{x}" REAL' for x in self.metrics)
+        primary_key = ''.join(f', "{x}"' for x in self.keys)
+        with self._db:
+            self._db.execute(f'CREATE TABLE IF NOT EXISTS samples (series TEXT, device TEXT, name TEXT{keys}, '
+                             f'entry_time INTEGER{columns}, PRIMARY KEY (series, device, entry_time, name'
+                             f'{primary_key})) WITHOUT ROWID')
+            self._db.execute('CREATE TABLE IF NOT EXISTS watermarks (series TEXT, device TEXT, entry_time INTEGER, '
+                             'PRIMARY KEY (series, device))')
+
+    def close(self):
+        self._db.close()
+
+    def append(self, series, device, rows):
+        """
+        Stores histogram buckets. A bucket which is already stored is replaced, so the last (partial) bucket can be
+        fetched again. The high-water mark of the device is moved to the newest bucket
+        :param series: The name of the series, e.g. the query
+        :param device: The device
+        :param rows: Dictionaries with 'name', 'entry_time' (epoch milliseconds), the keys and the metrics. A missing
+        key is stored as an empty string
+        :return: The number of stored buckets
+        """
+        columns = ''.join(f', "{x}"' for x in self.keys + self.metrics)
+        placeholders = ', ?' * (len(self.keys) + len(self.metrics) + 4)
+        values = [(series, device, x['name'], int(x['entry_time']), *[str(x.get(k) or '') for k in self.keys],
+                   *[x.get(m) for m in self.metrics]) for x in rows]
+        if not values:
+            return 0
+
+        with self._lock, self._db:
+            self._db.executemany(f'INSERT OR REPLACE INTO samples (series, device, name, entry_time{columns}) '
+                                 f'VALUES ({placeholders[2:]})', values)
+            self._db.execute('INSERT INTO watermarks VALUES (?, ?, ?) ON CONFLICT (series, device) DO UPDATE SET '
+                             'entry_time = MAX(entry_time, excluded.entry_time)',
+                             (series, device, max(x[3] for x in values)))
+
+        return len(values)
+
+    def get_watermark(self, series, device):
+        """
+        Returns the start time of the newest stored bucket of a device
+        :param series: The name of the series
+        :param device: The device
+        :return: The time in epoch milliseconds, or None if nothing is stored
+        """
+        with self._lock:
+            row = self._db.execute('SELECT entry_time FROM watermarks WHERE series = ? AND device = ?',
+                                   (series, device)).fetchone()
+
+        return row[0] if row else None
+
+    def range(self, series, device=None, start=None, end=None):
+        """
+        Reads the stored buckets of a series
+        :param series: The name of the series
+        :param device: Only return the buckets of this device
+        :param start: Only return the buckets starting at or after this time (epoch milliseconds)
+        :param end: Only return the buckets starting before this time (epoch milliseconds)
+        :return: A list of dictionaries with device, name, the keys, entry_time and the metrics, ordered by time
+        """
+        conditions, params = ['series = ?'], [series]
+        for condition, value in (('device = ?', device), ('entry_time >= ?', start), ('entry_time < ?', end)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+
+        columns = ['device', 'name'] + self.keys + ['entry_time'] + self.metrics
+        select = ', '.join(f'"{x}"' for x in columns)
+        order = ''.join(f', "{x}"' for x in self.keys)
+        with self._lock:
+            rows = self._db.execute(f'SELECT {select} FROM samples WHERE {" AND ".join(conditions)} '
+                                    f'ORDER BY entry_time, device, name{order}', params).fetchall()
+
+        return [dict(zip(columns, x)) for x in rows]
@@ -15,3 +15,42 @@ def ip_reachable(host):
     command = ['ping', count, '2', wait, '5', host]
 
     return subprocess.call(command, stdout=subprocess.DEVNULL) == 0
+
+
+def ip_sweep(hosts, count=2, timeout=2, concurrency=1000, tcp_ports=(22, 443), method='auto'):
+    """
+    Checks the reachability of many hosts concurrently, without a ping process per host. ICMP echo requests are sent
+    from one socket when permitted, with TCP connection probes as fallback
+    :param hosts: The list of IP addresses or hostnames
+    :param count: The number of probes per host
+    :param timeout: The number of seconds to wait for each probe
+    :param concurrency: The maximum number of hosts probed at the same time
+    :param tcp_ports: The TCP ports of the fallback probes
+    :param method: 'auto', 'icmp' or 'tcp'
+    :return: A dictionary with the hosts as keys and dictionaries with reachable, rtt (average, milliseconds), loss
+    (fraction of the probes) and method as values
+    """
+    from network_automation.reachability import ping_sweep
+
+    return ping_sweep(hosts, count, timeout, concurrency, tcp_ports, method)
+
+
+def chunked(items, size):
+    """
+    Splits an iterable into lists of at most `size` elements
+    :param items: The iterable to split
+    :param size: The maximum number of elements in each chunk
+    :return: A generator of lists
+    """
+    if size < 1:
+        raise ValueError("chunk size must be a positive integer")
+
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
@@ -1,19 +1,144 @@
+import asyncio
+import functools
 import json
+import logging
 import os
+import re
+import threading
+import time
 import requests
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from mydict import MyDict
+from network_automation import environment
+from network_automation.cache import CachingSession, new_session
+from network_automation.metrics import registry as metrics
+from network_automation.records import TunnelMetrics, VManageDevice, VManagePolicy, wrap
+from network_automation.timeseries import TimeSeriesStore
+from network_automation.utils import chunked
+from requests.adapters import HTTPAdapter
+
+IPV4_RE = re.compile(r'(?:\d{1,3}\.){3}\d{1,3}')
+TUNNEL_METRICS = ['loss_percentage', 'vqoe_score', 'latency', 'jitter', 'rx_octets', 'tx_octets']
+# The fields besides the tunnel name which the tunnel metrics query groups by
+TUNNEL_KEYS = ['state', 'proto']
+
+
+def _tunnel_metrics_query(device_ips, hours, interval, start=None, end=None):
+    query = {
+        "query": {
+            "condition": "AND",
+            "rules":
+                [
+                    {
+                        "value": [str(hours)],
+                        "field": "entry_time",
+                        "type": "date",
+                        "operator": "last_n_hours"
+                    },
+                    {
+                        "value": device_ips,
+                        "field": "vdevice_name",
+                        "type": "string",
+                        "operator": "in"
+                    }
+                ]
+        },
+        "aggregation":
+            {
+                "field": [
+                    {
+                        "property": "name",
+                        "sequence": 1,
+                        "size": 262},
+                    {
+                        "property": "state",
+                        "sequence": 1
+                    },
+                    {
+                        "property": "proto",
+                        "sequence": 2
+                    }
+                ],
+                "histogram": {
+                    "property": "entry_time",
+                    "type": "hour",
+                    "interval": interval,
+                    "order": "asc"
+                },
+                "metrics": [
+                    {
+                        "property": "loss_percentage",
+                        "type": "avg"},
+                    {
+                        "property": "vqoe_score",
+                        "type": "avg"
+                    },
+                    {
+                        "property": "latency",
+                        "type": "avg"
+                    },
+                    {
+                        "property": "jitter",
+                        "type": "avg"
+                    },
+                    {
+                        "property": "rx_octets",
+                        "type": "sum"
+                    },
+                    {
+                        "property": "tx_octets",
+                        "type": "sum"}
+                ]
+            }
+    }
+
+    if start is not None:
+        # Only get the buckets of the time window, instead of the last N hours
+        query["query"]["rules"][0] = {
+            "value": [str(start), str(end)],
+            "field": "entry_time",
+            "type": "date",
+            "operator": "between"
+        }
+
+    if len(device_ips) > 1:
+        # Group the results by device first
+        query["aggregation"]["field"].insert(0, {"property": "vdevice_name", "sequence": 0, "size": len(device_ips)})
+
+    return query
+
+
+class _EndpointMatcher:
+    """
+    Matches tunnel names against remote endpoints. IP address endpoints are looked up in a set built from the IP
+    addresses found in the tunnel name, other endpoints fall back to a substring search
+    """
+    def __init__(self, remote_endpoints):
+        self.addresses = {x for x in remote_endpoints if IPV4_RE.fullmatch(x)}
+        self.others = [x for x in remote_endpoints if x not in self.addresses]
+
+    def matches(self, name):
+        if not self.addresses.isdisjoint(IPV4_RE.findall(name)):
+            return True
+
+        return any(x in name for x in self.others)
 
 
 class Authentication:
-    def __init__(self, host, port, usr, pwd, proxies):
+    def __init__(self, host, port, usr, pwd, proxies, session=None):
+        environment.load_environment()
+
         self.host = host or os.environ.get("VMANAGE_HOST")
         self.port = port or os.environ.get("VMANAGE_PORT", 443)
         self.usr = usr or os.environ.get("VMANAGE_USER")
         self.pwd = pwd or os.environ.get("VMANAGE_PASS")
         self.proxies = proxies or {}
+        self.session = session or requests.Session()
 
-        self.jsessionid = self.get_jsessionid()
-        self.token = self.get_token()
+        with metrics.time_connect('vmanage'):
+            self.jsessionid = self.get_jsessionid()
+            self.token = self.get_token()
 
     def get_jsessionid(self):
         api = "/j_security_check"
@@ -21,7 +146,7 @@ class Authentication:
         url = base_url + api
         payload = {'j_username': self.usr, 'j_password': self.pwd}
 
-        response = requests.post(url=url, data=payload, proxies=self.proxies, verify=False)
+        response = self.session.post(url=url, data=payload, proxies=self.proxies, verify=False)
         try:
             cookies = response.headers["Set-Cookie"]
             jsessionid = cookies.split(";")
@@ -35,7 +160,7 @@ class Authentication:
         base_url = f'https://{self.host}:{self.port}'
         api = "/dataservice/client/token"
         url = base_url + api
-        response = requests.get(url=url, headers=headers, proxies=self.proxies, verify=False)
+        response = self.session.get(url=url, headers=headers, proxies=self.proxies, verify=False)
         if response.status_code != 200:
             raise ConnectionError("No valid token returned")
 
@@ -43,133 +168,311 @@ class Authentication:
 
 
 class VManage:
-    def __init__(self, host=None, port=None, usr=None, pwd=None, proxies=None):
-        self.auth = Authentication(host, port, usr, pwd, proxies)
+    def __init__(self, host=None, port=None, usr=None, pwd=None, proxies=None, pool_maxsize=10, compact=False,
+                 cache=None):
+        """
+        :param pool_maxsize: The maximum number of connections kept open to vManage, for concurrent requests
+        :param compact: Return the rows of the getters as compact records instead of MyDict, for large result sets
+        :param cache: Optional ResponseCache for the GET requests, e.g. policy definitions
+        """
+        self.compact = compact
+        # All requests share one session, so TCP/TLS connections are kept alive and reused
+        self.session = new_session(cache, 'vmanage')
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.auth = Authentication(host, port, usr, pwd, proxies, session=self.session)
+        if isinstance(self.session, CachingSession):
+            # The session cookie changes on every login, the cached responses are shared by the user instead
+            self.session.identity = self.auth.usr
         # self.jsessionid = self.auth.get_jsessionid(vmanage_host, vmanage_port, vmanage_username, vmanage_password)
         # self.token = self.auth.get_token(vmanage_host, vmanage_port, self.jsessionid)
         self.base_url = f'https://{self.auth.host}:{self.auth.port}/dataservice'
         self.proxies = self.auth.proxies
+        self._auth_lock = threading.Lock()
 
+        self._set_headers()
+
+    def _set_headers(self):
         if self.auth.token is not None:
             self.headers = {'Content-Type': "application/json", 'Cookie': self.auth.jsessionid,
                             'X-XSRF-TOKEN': self.auth.token}
         else:
             self.headers = {'Content-Type': "application/json", 'Cookie': self.auth.jsessionid}
 
+    def reauthenticate(self):
+        """
+        Logs in again to vManage and updates the session headers
+        :return:
+        """
+        self.auth.jsessionid = self.auth.get_jsessionid()
+        self.auth.token = self.auth.get_token()
+        self._set_headers()
+
+    @staticmethod
+    def _session_expired(response):
+        # An expired session is answered with an authentication error or with the HTML login page
+        return response.status_code in (401, 403) or 'text/html' in response.headers.get('Content-Type', '')
+
+    def _request(self, method, url_path, **kwargs):
+        headers = self.headers
+        response = self.session.request(method, self.base_url + url_path, headers=headers,
+                                        proxies=self.proxies, verify=False, **kwargs)
+
+        if self._session_expired(response):
+            metrics.count_retry('vmanage', 'session_expired')
+            with self._auth_lock:
+                # Another thread may have already logged in again
+                if self.headers is headers:
+                    logging.info("vManage session expired, authenticating again")
+                    self.reauthenticate()
+            response = self.session.request(method, self.base_url + url_path, headers=self.headers,
+                                            proxies=self.proxies, verify=False, **kwargs)
+
+        return response
+
+    def iter_scroll(self, url_path, query=None, page_size=10000, raw=False):
+        """
+        Follows the scroll pages (scrollId/hasMoreData) of an endpoint and yields the rows as the pages arrive, so
+        large statistics exports are processed with the memory of one page. Endpoints without pageInfo return a
+        single page
+        :param url_path: The endpoint, e.g. /statistics/approute/page
+        :param query: Optional statistics query, sent as the body of POST requests
+        :param page_size: The number of rows per page
+        :param raw: Yield the rows as dictionaries instead of MyDict, which is faster for large datasets
+        :return: A generator of rows
+        """
+        params = {'count': page_size}
+        while True:
+            if query is not None:
+                response = self._request('POST', url_path, params=params, data=json.dumps(query))
+            else:
+                response = self._request('GET', url_path, params=params)
+
+            if response.status_code != 200:
+                raise ConnectionError(f"vManage returned status code {response.status_code} for {url_path}")
+
+            result = response.json()
+            data = result.get('data', [])
+            yield from data if raw else map(MyDict, data)
+
+            page_info = result.get('pageInfo') or {}
+            if not page_info.get('hasMoreData') or not data or not page_info.get('scrollId'):
+                return
+
+            params = {'count': page_size, 'scrollId': page_info['scrollId']}
+
+    def iter_statistics(self, stats_type, query=None, page_size=10000, raw=False):
+        """
+        Streams the rows of a statistics type with the scroll API
+        :param stats_type: The statistics type, e.g. approute or interface
+        :param query: Optional statistics query, e.g. with an entry_time rule
+        :param page_size: The number of rows per page
+        :param raw: Yield the rows as dictionaries instead of MyDict
+        :return: A generator of rows
+        """
+        return self.iter_scroll(f'/statistics/{stats_type}/page', query, page_size, raw)
+
     def get_all_devices(self):
+        """
+        Gets all devices with iter_scroll, so the request carries count=10000. A response without pageInfo is a single
+        page, and the scroll pages are followed if vManage returns them
+        :return: A list of devices
+        """
         url_path = '/device'
 
-        result = requests.get(self.base_url + url_path, headers=self.headers,
-                              proxies=self.proxies, verify=False).json()
-
-        return [MyDict(x) for x in result['data']]
+        return wrap(self.iter_scroll(url_path, raw=True), VManageDevice, self.compact)
 
     def get_prefix_lists(self):
         url_path = '/template/policy/list/dataprefix'
 
-        result = requests.get(self.base_url + url_path, headers=self.headers,
-                              proxies=self.proxies, verify=False).json()
+        result = self._request('GET', url_path).json()
 
-        return [MyDict(x) for x in result['data']]
+        return wrap(result['data'], VManagePolicy, self.compact)
 
     def get_security_policies(self):
         url_path = '/template/policy/security'
 
-        result = requests.get(self.base_url + url_path, headers=self.headers,
-                              proxies=self.proxies, verify=False).json()
+        result = self._request('GET', url_path).json()
 
-        return [MyDict(x) for x in result['data']]
+        return wrap(result['data'], VManagePolicy, self.compact)
 
     def get_zbf_policies(self):
         url_path = '/template/policy/definition/zonebasedfw'
 
-        result = requests.get(self.base_url + url_path, headers=self.headers,
-                              proxies=self.proxies, verify=False).json()
+        result = self._request('GET', url_path).json()
 
-        return [MyDict(x) for x in result['data']]
+        return wrap(result['data'], VManagePolicy, self.compact)
 
     def get_zbf_policy(self, policy_id):
         url_path = f'/template/policy/definition/zonebasedfw/{policy_id}'
 
-        return MyDict(requests.get(self.base_url + url_path, headers=self.headers,
-                                   proxies=self.proxies, verify=False).json())
+        return wrap([self._request('GET', url_path).json()], VManagePolicy, self.compact)[0]
 
     def get_tunnel_metrics(self, device_ip, remote_endpoints, hours=24, interval=1):
+        """
+        Gets the tunnel metrics histogram of a device
+        :param device_ip: The system IP of the device
+        :param remote_endpoints: Only keep the tunnels to these remote endpoints. IP addresses must match an address of
+        the tunnel name exactly, other endpoints (e.g. colors) match as substrings
+        :param hours: The number of hours of statistics
+        :param interval: The histogram interval in hours
+        :return: The matching rows, once each and in the order of the response
+        """
         url_path = '/statistics/approute/fec/aggregation'
-        query = {
-            "query": {
-                "condition": "AND",
-                "rules":
-                    [
-                        {
-                            "value": [str(hours)],
-                            "field": "entry_time",
-                            "type": "date",
-                            "operator": "last_n_hours"
-                        },
-                        {
-                            "value": [device_ip],
-                            "field": "vdevice_name",
-                            "type": "string",
-                            "operator": "in"
-                        }
-                    ]
-            },
-            "aggregation":
-                {
-                    "field": [
-                        {
-                            "property": "name",
-                            "sequence": 1,
-                            "size": 262},
-                        {
-                            "property": "state",
-                            "sequence": 1
-                        },
-                        {
-                            "property": "proto",
-                            "sequence": 2
-                        }
-                    ],
-                    "histogram": {
-                        "property": "entry_time",
-                        "type": "hour",
-                        "interval": interval,
-                        "order": "asc"
-                    },
-                    "metrics": [
-                        {
-                            "property": "loss_percentage",
-                            "type": "avg"},
-                        {
-                            "property": "vqoe_score",
-                            "type": "avg"
-                        },
-                        {
-                            "property": "latency",
-                            "type": "avg"
-                        },
-                        {
-                            "property": "jitter",
-                            "type": "avg"
-                        },
-                        {
-                            "property": "rx_octets",
-                            "type": "sum"
-                        },
-                        {
-                            "property": "tx_octets",
-                            "type": "sum"}
-                    ]
-                }
-        }
+        query = _tunnel_metrics_query([device_ip], hours, interval)
+
+        result = self._request('POST', url_path, data=json.dumps(query)).json()
+
+        matcher = _EndpointMatcher(remote_endpoints)
+
+        return wrap([x for x in result['data'] if matcher.matches(x['name'])], TunnelMetrics, self.compact)
+
+    def get_fleet_tunnel_metrics(self, device_ips, remote_endpoints=None, hours=24, interval=1, chunk_size=100,
+                                 start=None, end=None):
+        """
+        Gets the tunnel metrics of many devices, with one aggregation query per chunk of devices instead of one per
+        device
+        :param device_ips: The system IPs of the devices
+        :param remote_endpoints: Only keep the tunnels to these remote endpoints, all tunnels if None
+        :param hours: The number of hours of statistics
+        :param interval: The histogram interval in hours
+        :param chunk_size: The maximum number of devices per aggregation query
+        :param start: Optional start of the time window in epoch milliseconds, used instead of hours
+        :param end: The end of the time window in epoch milliseconds, required with start
+        :return: A dictionary with the device IPs as keys and the lists of tunnel metrics as values
+        """
+        url_path = '/statistics/approute/fec/aggregation'
+        matcher = _EndpointMatcher(remote_endpoints) if remote_endpoints is not None else None
+        result = {x: [] for x in device_ips}
+
+        for chunk in chunked(device_ips, chunk_size):
+            query = _tunnel_metrics_query(chunk, hours, interval, start, end)
+            response = self._request('POST', url_path, data=json.dumps(query)).json()
+
+            for row in wrap(response['data'], TunnelMetrics, self.compact):
+                if matcher is None or matcher.matches(row.name):
+                    # A single device query has no vdevice_name grouping
+                    result.setdefault(row.vdevice_name or chunk[0], []).append(row)
+
+        return result
+
+
+class TunnelMetricsCollector:
+    """
+    Incrementally collects the tunnel metrics histogram of many devices into a local TimeSeriesStore. Each run only
+    fetches the buckets after the high-water mark of each device, so repeated collections and dashboards don't
+    download the same statistics again
+    """
+    series_name = 'approute/fec/aggregation'
+
+    def __init__(self, vmanage, store=None, initial_hours=24, interval=1, chunk_size=100):
+        """
+        :param vmanage: A VManage instance
+        :param store: The TimeSeriesStore with the TUNNEL_KEYS keys and TUNNEL_METRICS metrics, defaults to an
+        in-memory store
+        :param initial_hours: The number of hours fetched for devices without stored data
+        :param interval: The histogram interval in hours
+        :param chunk_size: The maximum number of devices per aggregation query
+        """
+        self.vmanage = vmanage
+        self.store = store or TimeSeriesStore(metrics=TUNNEL_METRICS, keys=TUNNEL_KEYS)
+        self.initial_hours = initial_hours
+        self.interval = interval
+        self.chunk_size = chunk_size
+        # The buckets and high-water marks of each histogram interval are stored apart, so collectors with different
+        # intervals can share a store
+        self.series = f"{self.series_name}/{interval}h"
+
+    def collect(self, device_ips, now=None):
+        """
+        Fetches the new histogram buckets of the devices and stores them
+        :param device_ips: The system IPs of the devices
+        :param now: The end of the collection window in epoch milliseconds, defaults to the current time
+        :return: The number of stored buckets
+        """
+        now = now or int(time.time() * 1000)
+
+        # Devices with the same high-water mark are collected with the same queries. The bucket of the high-water
+        # mark is fetched again, because it may have been partial
+        devices_by_start = defaultdict(list)
+        for device_ip in device_ips:
+            start = self.store.get_watermark(self.series, device_ip)
+            devices_by_start[start or now - self.initial_hours * 3600 * 1000].append(device_ip)
+
+        stored = 0
+        for start, devices in devices_by_start.items():
+            rows_by_device = self.vmanage.get_fleet_tunnel_metrics(devices, interval=self.interval,
+                                                                   chunk_size=self.chunk_size, start=start, end=now)
+            for device_ip, rows in rows_by_device.items():
+                stored += self.store.append(self.series, device_ip, rows)
+
+        return stored
+
+    def query(self, device_ip=None, start=None, end=None):
+        """
+        Reads the collected tunnel metrics from the local store
+        :param device_ip: Only return the metrics of this device
+        :param start: Only return the buckets starting at or after this time (epoch milliseconds)
+        :param end: Only return the buckets starting before this time (epoch milliseconds)
+        :return: A list of dictionaries with device, name, entry_time and the metrics
+        """
+        return self.store.range(self.series, device=device_ip, start=start, end=end)
+
+
+class AsyncVManage:
+    """
+    asyncio variant of VManage, with the same getters as coroutines. The requests run on the pooled session of a
+    VManage instance in a thread pool, with at most `concurrency` requests in flight
+    """
+    def __init__(self, host=None, port=None, usr=None, pwd=None, proxies=None, concurrency=16, compact=False,
+                 cache=None):
+        self.vmanage = VManage(host, port, usr, pwd, proxies, pool_maxsize=concurrency, compact=compact, cache=cache)
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.vmanage.session.close()
+
+    async def _run(self, func, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def get_all_devices(self):
+        return await self._run(self.vmanage.get_all_devices)
+
+    async def get_prefix_lists(self):
+        return await self._run(self.vmanage.get_prefix_lists)
+
+    async def get_security_policies(self):
+        return await self._run(self.vmanage.get_security_policies)
 
-        result = MyDict(requests.post(self.base_url + url_path, headers=self.headers,
-                                      proxies=self.proxies, data=json.dumps(query), verify=False).json())
+    async def get_zbf_policies(self):
+        return await self._run(self.vmanage.get_zbf_policies)
 
-        filtered_list = []
+    async def get_zbf_policy(self, policy_id):
+        return await self._run(self.vmanage.get_zbf_policy, policy_id)
 
-        for endpoint in remote_endpoints:
-            filtered_list.extend([x for x in result.data if endpoint in x.name])
+    async def get_tunnel_metrics(self, device_ip, remote_endpoints, hours=24, interval=1):
+        return await self._run(self.vmanage.get_tunnel_metrics, device_ip, remote_endpoints, hours, interval)
 
-        return filtered_list
+    async def get_zbf_policies_by_id(self, policy_ids):
+        """
+        Gets the definitions of many zone based firewall policies concurrently
+        :param policy_ids: The list of policy IDs
+        :return: A list with the policy definitions, in the order of policy_ids
+        """
+        return await asyncio.gather(*[self.get_zbf_policy(x) for x in policy_ids])
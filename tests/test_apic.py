@@ -0,0 +1,314 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, unquote, parse_qs
+from network_automation.apic import CiscoACI, AsyncCiscoACI, APICSubscriber, _query_class
+from network_automation.cache import ResponseCache
+
+current_dir = os.path.dirname(__file__)
+
+test_file_path = os.path.join(current_dir, 'mock_data_apic.json')
+
+with open(test_file_path, "r") as f:
+    apic_data = json.load(f)
+
+
+class MockAPICHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200, cookie=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if cookie:
+            self.send_header("Set-Cookie", f"APIC-cookie={cookie}; path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _new_token(self):
+        server = self.server
+        with server.lock:
+            server.token_count += 1
+            server.token = f"token-{server.token_count}"
+        attributes = {"token": server.token, "refreshTimeoutSeconds": str(server.refresh_timeout)}
+        self._send_json({"totalCount": "1", "imdata": [{"aaaLogin": {"attributes": attributes}}]},
+                        cookie=server.token)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlsplit(self.path).path == "/api/aaaLogin.json":
+            self.server.logins += 1
+            self._new_token()
+        else:
+            self._send_json({"imdata": []}, status=400)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = unquote(url.path)[len("/api/"):]
+
+        if self.server.token is None or f"APIC-cookie={self.server.token}" not in self.headers.get("Cookie", ""):
+            self._send_json({"imdata": [{"error": {"attributes": {"code": "403", "text": "Token was invalid"}}}]},
+                            status=403)
+            return
+
+        if path == "aaaRefresh.json":
+            self.server.refreshes += 1
+            self._new_token()
+            return
+
+        query = parse_qs(url.query)
+        with self.server.lock:
+            self.server.requests.append(path)
+            self.server.queries.append(query)
+        imdata = self.server.data.get(path, [])
+
+        # Support wcard(class.property,"regex") filters
+        if "query-target-filter" in query:
+            match = re.match(r'wcard\((\w+)\.(\w+),"(.*)"\)', query["query-target-filter"][0])
+            if match:
+                class_name, prop, pattern = match.groups()
+                imdata = [x for x in imdata if re.search(pattern, x[class_name]["attributes"][prop])]
+
+        total_count = len(imdata)
+        if "page-size" in query:
+            page_size = int(query["page-size"][0])
+            page = int(query.get("page", ["0"])[0])
+            imdata = imdata[page * page_size:(page + 1) * page_size]
+
+        response = {"totalCount": str(total_count), "imdata": imdata} if self.server.total_count else {"imdata": imdata}
+        if query.get("subscription") == ["yes"]:
+            response["subscriptionId"] = "72057598349672449"
+
+        self._send_json(response)
+
+
+class MockAPIC(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data, refresh_timeout=600):
+        super().__init__(("127.0.0.1", 0), MockAPICHandler)
+        self.data = data
+        self.refresh_timeout = refresh_timeout
+        self.lock = threading.Lock()
+        self.token = None
+        self.token_count = 0
+        self.logins = 0
+        self.refreshes = 0
+        self.requests = []
+        self.queries = []
+        self.total_count = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/"
+
+
+@pytest.fixture
+def mock_apic():
+    server = MockAPIC(apic_data)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestCiscoACI:
+    def test_get_l3_loopbacks(self, mock_apic):
+        apic = CiscoACI(mock_apic.url, username="admin", password="password")
+
+        loopbacks = apic.get_l3_loopbacks("topology/pod-1/node-101")
+
+        assert len(loopbacks) == 1
+        assert loopbacks[0]["id"] == "lo0"
+        assert loopbacks[0]["ipv4_addr"] == "10.0.80.64/32"
+
+    def test_get_tenants(self, mock_apic):
+        apic = CiscoACI(mock_apic.url, username="admin", password="password")
+
+        assert apic.get_tenants() == ["common", "infra", "prod"]
+        assert apic.get_tenant_bridge_domains("tn-prod") == ["web", "db"]
+
+    def test_fabric_wide_queries(self, mock_apic):
+        apic = CiscoACI(mock_apic.url, username="admin", password="password")
+
+        assert apic.get_all_node_mgmt_ips() == {"topology/pod-1/node-101": "10.48.1.101/24",
+                                                "topology/pod-1/node-201": "10.48.1.201/24"}
+
+        physical_intfs = apic.get_all_physical_intfs()
+        assert physical_intfs["topology/pod-1/node-101"] == apic.get_physical_intfs("topology/pod-1/node-101")
+        assert len(physical_intfs["topology/pod-1/node-201"]) == 1
+
+        loopbacks = apic.get_all_l3_loopbacks()
+        assert loopbacks["topology/pod-1/node-101"] == apic.get_l3_loopbacks("topology/pod-1/node-101")
+        assert loopbacks["topology/pod-1/node-201"][0]["ipv4_addr"] == "10.0.80.65/32"
+
+    def test_pagination(self, mock_apic):
+        apic = CiscoACI(mock_apic.url, username="admin", password="password", page_size=2)
+
+        intfs = apic.iter_class("node/class/l1PhysIf.json?rsp-subtree=children&rsp-subtree-class=ethpmPhysIf")
+
+        # The managed objects are yielded before the next page is requested
+        assert next(intfs)["l1PhysIf"]["attributes"]["id"] == "eth1/1"
+        assert mock_apic.requests == ["node/class/l1PhysIf.json"]
+
+        assert len(list(intfs)) == 2
+        assert len(mock_apic.requests) == 2
+        # The pages are requested in a stable order
+        assert mock_apic.queries[0]["order-by"] == ["l1PhysIf.dn"]
+        assert apic.get_tenants() == ["common", "infra", "prod"]
+
+    def test_pagination_without_total_count(self, mock_apic):
+        mock_apic.total_count = False
+        apic = CiscoACI(mock_apic.url, username="admin", password="password", page_size=2)
+
+        intfs = list(apic.iter_class("node/class/l1PhysIf.json"))
+
+        # The full first page is followed by a short one
+        assert len(intfs) == 3
+        assert len(mock_apic.requests) == 2
+        query = "node/mo/topology/pod-1/node-101.json?query-target=subtree&target-subtree-class=l1PhysIf"
+        list(apic.iter_class(query))
+        assert mock_apic.queries[-1]["order-by"] == ["l1PhysIf.dn"]
+
+    def test_query_class(self):
+        # The pages are ordered by the class of the returned objects, for every form of class query
+        assert _query_class("class/fvTenant.json") == "fvTenant"
+        assert _query_class("node/class/l1PhysIf.json?rsp-subtree=children") == "l1PhysIf"
+        assert _query_class("node/class/topology/pod-1/node-101/l1PhysIf.json") == "l1PhysIf"
+        assert _query_class("node/class/topology/pod-1/node-101/sys/phys-[eth1/1]/ethpmPhysIf.json") == "ethpmPhysIf"
+        assert _query_class("node/mo/topology/pod-1/node-101.json?query-target=subtree&"
+                            "target-subtree-class=l1PhysIf") == "l1PhysIf"
+        assert _query_class("node/mo/topology/pod-1/node-101.json") is None
+
+    def test_response_cache(self, mock_apic):
+        cache = ResponseCache(ttls={r"/class/fvTenant": 3600})
+        apic = CiscoACI(mock_apic.url, username="admin", password="password", cache=cache)
+
+        assert apic.get_tenants() == ["common", "infra", "prod"]
+        assert apic.get_tenants() == ["common", "infra", "prod"]
+        apic.get_aci_pods()
+        apic.get_aci_pods()
+
+        assert mock_apic.requests.count("node/class/fvTenant.json") == 1
+        assert len(mock_apic.requests) == 3
+        assert cache.stats()["hits"] == 1
+
+
+class TestAPICSubscriber:
+    def test_subscription_cache(self, mock_apic):
+        apic = CiscoACI(mock_apic.url, username="admin", password="password")
+        subscriber = APICSubscriber(apic)
+        changes = []
+
+        subscription_id = subscriber.subscribe("node/class/fvTenant.json",
+                                               callback=lambda status, dn, mo: changes.append((status, dn)))
+        assert len(subscriber.get_objects("node/class/fvTenant.json")) == 3
+
+        subscriber.handle_event(json.dumps({"subscriptionId": [subscription_id], "imdata": [
+            {"fvTenant": {"attributes": {"dn": "uni/tn-dev", "name": "dev", "status": "created"}}},
+            {"fvTenant": {"attributes": {"dn": "uni/tn-prod", "descr": "production", "status": "modified"}}},
+            {"fvTenant": {"attributes": {"dn": "uni/tn-infra", "status": "deleted"}}}
+        ]}))
+
+        tenants = {x["fvTenant"]["attributes"]["dn"]: x["fvTenant"]["attributes"]
+                   for x in subscriber.get_objects("node/class/fvTenant.json")}
+        assert sorted(tenants) == ["uni/tn-common", "uni/tn-dev", "uni/tn-prod"]
+        # Modifications are merged into the cached object
+        assert tenants["uni/tn-prod"]["name"] == "prod"
+        assert tenants["uni/tn-prod"]["descr"] == "production"
+        assert changes == [("created", "uni/tn-dev"), ("modified", "uni/tn-prod"), ("deleted", "uni/tn-infra")]
+
+        # Events of unknown subscriptions don't change the cache
+        subscriber.handle_event({"subscriptionId": ["1"], "imdata": [
+            {"fvTenant": {"attributes": {"dn": "uni/tn-common", "status": "deleted"}}}]})
+        assert len(subscriber.get_objects("node/class/fvTenant.json")) == 3
+
+        subscriber.refresh()
+        assert "subscriptionRefresh.json" in mock_apic.requests
+
+    def test_events_before_subscription(self, mock_apic):
+        apic = CiscoACI(mock_apic.url, username="admin", password="password")
+        subscriber = APICSubscriber(apic)
+        changes = []
+
+        # The event arrives on the websocket before the subscription query returned its ID
+        subscriber.handle_event({"subscriptionId": ["72057598349672449"], "imdata": [
+            {"fvTenant": {"attributes": {"dn": "uni/tn-dev", "name": "dev", "status": "created"}}}]})
+        subscriber.subscribe("node/class/fvTenant.json", callback=lambda status, dn, mo: changes.append((status, dn)))
+
+        assert len(subscriber.get_objects("node/class/fvTenant.json")) == 4
+        assert changes == [("created", "uni/tn-dev")]
+
+    def test_resubscribe(self, mock_apic):
+        apic = CiscoACI(mock_apic.url, username="admin", password="password")
+        subscriber = APICSubscriber(apic)
+        changes = []
+        subscriber.subscribe("node/class/fvTenant.json", callback=lambda status, dn, mo: changes.append((status, dn)))
+
+        # Changes missed while the websocket was down
+        subscriber.handle_event({"subscriptionId": ["72057598349672449"], "imdata": [
+            {"fvTenant": {"attributes": {"dn": "uni/tn-dev", "name": "dev", "status": "created"}}},
+            {"fvTenant": {"attributes": {"dn": "uni/tn-infra", "status": "deleted"}}}]})
+        changes.clear()
+
+        mock_apic.token = "expired"
+        apic.login()
+        subscriber.resubscribe()
+
+        assert len(subscriber.get_objects("node/class/fvTenant.json")) == 3
+        assert sorted(changes) == [("created", "uni/tn-infra"), ("deleted", "uni/tn-dev")]
+        assert list(subscriber.subscriptions.values()) == ["node/class/fvTenant.json"]
+        assert mock_apic.logins == 2
+
+
+class TestAsyncCiscoACI:
+    def test_fabric_inventory(self, mock_apic):
+        async def collect():
+            async with AsyncCiscoACI(mock_apic.url, username="admin", password="password", concurrency=4) as apic:
+                return await apic.get_fabric_inventory()
+
+        nodes = asyncio.run(collect())
+
+        assert [x["name"] for x in nodes] == ["leaf101", "spine201"]
+        assert nodes[0]["mgmt_ip"] == "10.48.1.101/24"
+        assert nodes[0]["physical_intfs"][0] == {"name": "eth1/1", "admin_status": "up", "desc": "server1",
+                                                 "mode": "trunk", "mac": "00:3a:9c:5e:10:01"}
+        assert nodes[1]["physical_intfs"][0]["mode"] == "routed"
+
+    def test_same_methods_as_sync_client(self, mock_apic):
+        async def collect():
+            async with AsyncCiscoACI(mock_apic.url, username="admin", password="password") as apic:
+                return await asyncio.gather(apic.get_l3_loopbacks("topology/pod-1/node-201"), apic.get_tenants())
+
+        loopbacks, tenants = asyncio.run(collect())
+
+        assert loopbacks[0]["ipv4_addr"] == "10.0.80.65/32"
+        assert tenants == ["common", "infra", "prod"]
+
+    def test_token_refresh(self, mock_apic):
+        mock_apic.refresh_timeout = 0
+
+        async def collect():
+            async with AsyncCiscoACI(mock_apic.url, username="admin", password="password") as apic:
+                # The token is refreshed before the request, because its lifetime is over
+                pods = await apic.get_aci_pods()
+
+                # A rejected token triggers a new login
+                mock_apic.token = "expired"
+                tenants = await apic.get_tenants()
+
+                return pods, tenants
+
+        pods, tenants = asyncio.run(collect())
+
+        assert pods == ["topology/pod-1"]
+        assert tenants == ["common", "infra", "prod"]
+        assert mock_apic.refreshes >= 1
+        assert mock_apic.logins == 2
@@ -0,0 +1,29 @@
+import json
+import logging
+from benchmarks import run
+
+
+def test_benchmark_suite(tmp_path, monkeypatch):
+    for name in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.chdir(tmp_path)
+    baseline = tmp_path / 'baseline.json'
+    args = ['--scale', '0.01', '--repeat', '1', '--baseline', str(baseline)]
+
+    try:
+        assert run.main(args + ['--save-baseline']) == 0
+        report = json.loads(baseline.read_text())
+        assert report['meta']['repeat'] == 1
+        # Every getter ran against the mock controllers
+        assert {'apic.get_all_physical_intfs', 'vmanage.iter_statistics', 'nfvis.get_inventory',
+                'netbox.get_prefixes', 'parsing.parse_output', 'import.network_automation'} <= set(report['results'])
+        assert all(x['items'] > 0 for x in report['results'].values())
+
+        # A baseline which is much faster than the results is reported as a regression
+        for result in report['results'].values():
+            result['median_ms'] = 0.0001
+        baseline.write_text(json.dumps(report))
+        assert run.main(args + ['--filter', 'apic.get_tenants', '--output', str(tmp_path / 'results.json')]) == 1
+        assert list(json.loads((tmp_path / 'results.json').read_text())['results']) == ['apic.get_tenants']
+    finally:
+        logging.disable(logging.NOTSET)
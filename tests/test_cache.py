@@ -0,0 +1,131 @@
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from network_automation.cache import ResponseCache, CachingSession
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        etag = f'"v{self.server.version}"'
+
+        if self.path.startswith("/etag") and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = f'{{"path": "{self.path}", "version": {self.server.version}}}'.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.path.startswith("/etag"):
+            self.send_header("ETag", etag)
+        if self.path.startswith("/cookie"):
+            self.send_header("Set-Cookie", "JSESSIONID=secret")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.version = 1
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_ttl_per_endpoint(server):
+    cache = ResponseCache(ttls={r"/tenants": 60})
+    session = CachingSession(cache)
+
+    assert session.get(server.url + "/tenants", params={"page": 1}).json()["version"] == 1
+    server.version = 2
+    response = session.get(server.url + "/tenants", params={"page": 1})
+
+    # The second request is served from the cache, other queries and endpoints are not
+    assert response.json()["version"] == 1
+    assert response.from_cache
+    assert session.get(server.url + "/tenants", params={"page": 2}).json()["version"] == 2
+    assert session.get(server.url + "/nodes").json()["version"] == 2
+    assert session.get(server.url + "/nodes").json()["version"] == 2
+    assert server.requests == ["/tenants?page=1", "/tenants?page=2", "/nodes", "/nodes"]
+    assert cache.stats() == {"hits": 1, "misses": 2, "revalidations": 0, "entries": 2}
+
+
+def test_etag_revalidation(server):
+    cache = ResponseCache(default_ttl=0)
+    session = CachingSession(cache)
+
+    assert session.get(server.url + "/etag").json()["version"] == 1
+    response = session.get(server.url + "/etag")
+
+    # The expired response is revalidated and reused
+    assert response.status_code == 200
+    assert response.json()["version"] == 1
+    assert cache.stats()["revalidations"] == 1
+
+    server.version = 2
+    assert session.get(server.url + "/etag").json()["version"] == 2
+    assert len(server.requests) == 3
+
+
+def test_disk_store_and_lru(server, tmp_path):
+    cache = ResponseCache(default_ttl=60, max_entries=1, path=str(tmp_path))
+    session = CachingSession(cache)
+    session.get(server.url + "/a")
+    session.get(server.url + "/b")
+
+    assert cache.stats()["entries"] == 1
+
+    # A new cache on the same directory reads the stored responses
+    session = CachingSession(ResponseCache(default_ttl=60, path=str(tmp_path)))
+    assert session.get(server.url + "/a").json()["path"] == "/a"
+    assert server.requests == ["/a", "/b"]
+
+    session.cache.invalidate(r"/a$")
+    session.get(server.url + "/a")
+    session.get(server.url + "/b")
+    assert server.requests == ["/a", "/b", "/a"]
+
+
+def test_control_plane_never_cached(server):
+    cache = ResponseCache(ttls={r"aaaRefresh": 60}, default_ttl=60)
+    session = CachingSession(cache)
+
+    for path in ("/api/aaaRefresh.json", "/api/subscriptionRefresh.json?id=1", "/dataservice/client/token",
+                 "/api/node/class/fvTenant.json?subscription=yes"):
+        session.get(server.url + path)
+        session.get(server.url + path)
+
+    assert len(server.requests) == 8
+    assert cache.stats()["entries"] == 0
+
+
+def test_cache_key_and_stream(server, tmp_path):
+    cache = ResponseCache(default_ttl=60, path=str(tmp_path))
+    session = CachingSession(cache, identity="admin")
+    other_user = CachingSession(cache, identity="operator")
+
+    session.get(server.url + "/cookie")
+    session.get(server.url + "/cookie")
+    other_user.get(server.url + "/cookie")
+    session.get(server.url + "/cookie", headers={"Accept": "application/xml"})
+    # Streamed responses are not loaded in memory to be cached
+    with session.get(server.url + "/stream", stream=True) as response:
+        assert not getattr(response, "from_cache", False)
+
+    # The users and the Accept header have their own responses
+    assert server.requests == ["/cookie", "/cookie", "/cookie", "/stream"]
+    assert cache.stats()["entries"] == 3
+    # The session cookies of the responses are not stored
+    for filename in tmp_path.iterdir():
+        assert "JSESSIONID" not in filename.read_text()
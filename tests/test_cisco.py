@@ -1,9 +1,13 @@
 import json
 import os
+import threading
+import time
 import unittest
 from mydict import MyDict
 from unittest.mock import patch, MagicMock
-from network_automation.cisco import CiscoSSHDevice
+from netmiko import NetMikoTimeoutException
+from paramiko.ssh_exception import SSHException
+from network_automation.cisco import CiscoSSHDevice, SSHConnectionPool, run_fleet_commands
 
 current_dir = os.path.dirname(__file__)
 
@@ -31,10 +35,12 @@ mock_serial = test_data["serial_string"]
 
 class TestCiscoSSHDevice(unittest.TestCase):
     @patch('network_automation.cisco.ConnectHandler')  # Mock the ConnectHandler class
-    def test_get_interface_details(self, mock_connect_handler):
+    @patch('network_automation.cisco.parse_output')
+    def test_get_interface_details(self, mock_parse_output, mock_connect_handler):
         # Set up the mock connection's behavior
         mock_connection = MagicMock()
-        mock_connection.send_command.return_value = mock_interface_details
+        mock_connection.send_command.return_value = 'raw output'
+        mock_parse_output.return_value = mock_interface_details
         mock_connect_handler.return_value = mock_connection
 
         # Create an instance of CiscoSSHDevice
@@ -54,13 +60,16 @@ class TestCiscoSSHDevice(unittest.TestCase):
                 self.assertEqual(result[idx].description, 'router1_transit')
 
         # Ensure send_command was called with the correct command
-        mock_connection.send_command.assert_called_once_with('show interface', use_textfsm=True, read_timeout=30)
+        mock_connection.send_command.assert_called_once_with('show interface', read_timeout=30)
+        mock_parse_output.assert_called_once_with('cisco_ios', 'show interface', 'raw output')
 
     @patch('network_automation.cisco.ConnectHandler')  # Mock the ConnectHandler class
-    def test_get_ip_interface_brief(self, mock_connect_handler):
+    @patch('network_automation.cisco.parse_output')
+    def test_get_ip_interface_brief(self, mock_parse_output, mock_connect_handler):
         # Set up the mock connection's behavior
         mock_connection = MagicMock()
-        mock_connection.send_command.return_value = mock_ip_int_brief
+        mock_connection.send_command.return_value = 'raw output'
+        mock_parse_output.return_value = mock_ip_int_brief
         mock_connect_handler.return_value = mock_connection
 
         # Create an instance of CiscoSSHDevice
@@ -79,7 +88,8 @@ class TestCiscoSSHDevice(unittest.TestCase):
                 self.assertEqual(result[idx].proto, 'up')
 
         # Ensure send_command was called with the correct command
-        mock_connection.send_command.assert_called_once_with('show interface', use_textfsm=True, read_timeout=30)
+        mock_connection.send_command.assert_called_once_with('show interface', read_timeout=30)
+        mock_parse_output.assert_called_once_with('cisco_ios', 'show interface', 'raw output')
 
     @patch('network_automation.cisco.ConnectHandler')  # Mock the ConnectHandler class
     def test_get_device_serial(self, mock_connect_handler):
@@ -100,13 +110,46 @@ class TestCiscoSSHDevice(unittest.TestCase):
         # Ensure send_command was called with the correct command
         mock_connection.send_command.assert_called_once_with('show version | include Processor')
 
+    @patch('network_automation.cisco.ConnectHandler')
+    def test_execute_show_commands(self, mock_connect_handler):
+        mock_connection = MagicMock()
+        mock_connection.find_prompt.return_value = 'router1#'
+        mock_connection.read_until_pattern.side_effect = [
+            "show ip interface brief\r\n"
+            "Interface              IP-Address      OK? Method Status                Protocol\r\n"
+            "GigabitEthernet1       192.168.30.50   YES DHCP   up                    up\r\n"
+            "Loopback0              10.0.0.1        YES manual up                    up\r\n"
+            "router1#",
+            "show version | include Processor\r\n"
+            "Processor board ID FOX3986YDP3\r\n"
+            "router1#"
+        ]
+        mock_connect_handler.return_value = mock_connection
+
+        device = CiscoSSHDevice(hostname='192.168.1.1', username='user', password='pass')
+        result = device.execute_show_commands(['show ip interface brief', 'show version | include Processor'],
+                                              parse=False)
+
+        # Both commands are sent with a single channel write
+        mock_connection.write_channel.assert_called_once_with(
+            "show ip interface brief\nshow version | include Processor\n")
+        self.assertEqual(result['show version | include Processor'], "Processor board ID FOX3986YDP3")
+
+        # The output of each command is parsed separately
+        parsed = device._parse_output('show ip interface brief', result['show ip interface brief'])
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(parsed[1]['interface'], 'Loopback0')
+        self.assertEqual(parsed[1]['ip_address'], '10.0.0.1')
+
 
 class TestCDPNeighbors(unittest.TestCase):
     @patch('network_automation.cisco.ConnectHandler')
-    def test_get_cdp_neighbors_summary(self, mock_connect_handler):
+    @patch('network_automation.cisco.parse_output')
+    def test_get_cdp_neighbors_summary(self, mock_parse_output, mock_connect_handler):
         # Set up the mock connection
         mock_connection = MagicMock()
-        mock_connection.send_command.return_value = mock_cdp_neighbors
+        mock_connection.send_command.return_value = 'raw output'
+        mock_parse_output.return_value = mock_cdp_neighbors
         mock_connect_handler.return_value = mock_connection
 
         device = CiscoSSHDevice(hostname='192.168.1.1', username='user', password='pass')
@@ -120,14 +163,15 @@ class TestCDPNeighbors(unittest.TestCase):
                 self.assertEqual(result[idx].platform, 'C9410R')
 
         # Ensure the correct command was executed
-        mock_connection.send_command.assert_called_once_with(
-            'show cdp neighbors', use_textfsm=True, read_timeout=10
-        )
+        mock_connection.send_command.assert_called_once_with('show cdp neighbors', read_timeout=10)
+        mock_parse_output.assert_called_once_with('cisco_ios', 'show cdp neighbors', 'raw output')
 
     @patch('network_automation.cisco.ConnectHandler')
-    def test_get_cdp_neighbors_detail(self, mock_connect_handler):
+    @patch('network_automation.cisco.parse_output')
+    def test_get_cdp_neighbors_detail(self, mock_parse_output, mock_connect_handler):
         mock_connection = MagicMock()
-        mock_connection.send_command.return_value = mock_cdp_neighbors_detail
+        mock_connection.send_command.return_value = 'raw output'
+        mock_parse_output.return_value = mock_cdp_neighbors_detail
         mock_connect_handler.return_value = mock_connection
 
         device = CiscoSSHDevice(hostname='192.168.1.1', username='user', password='pass')
@@ -138,6 +182,154 @@ class TestCDPNeighbors(unittest.TestCase):
             if idx == 4:
                 self.assertEqual(result[idx].neighbor_interface, "FortyGigabitEthernet5/0/9")
 
-        mock_connection.send_command.assert_called_once_with(
-            'show cdp neighbors detail', use_textfsm=True, read_timeout=10
-        )
+        mock_connection.send_command.assert_called_once_with('show cdp neighbors detail', read_timeout=10)
+        mock_parse_output.assert_called_once_with('cisco_ios', 'show cdp neighbors detail', 'raw output')
+
+
+class TestFleet(unittest.TestCase):
+    @patch('network_automation.cisco.ConnectHandler')
+    def test_run_fleet_commands(self, mock_connect_handler):
+        def connect(**kwargs):
+            if kwargs['ip'] == '192.168.1.3':
+                raise NetMikoTimeoutException("timed out")
+            mock_connection = MagicMock()
+            mock_connection.send_command.return_value = mock_ip_int_brief
+            return mock_connection
+
+        mock_connect_handler.side_effect = connect
+
+        inventory = ['192.168.1.1', {'hostname': '192.168.1.2', 'username': 'admin'}, '192.168.1.3']
+        results = {x['hostname']: x for x in run_fleet_commands(inventory, ['show ip interface brief'],
+                                                                parse=False, max_workers=2, timeout=5)}
+
+        self.assertEqual(set(results), {'192.168.1.1', '192.168.1.2', '192.168.1.3'})
+        self.assertEqual(results['192.168.1.1']['result']['show ip interface brief'], mock_ip_int_brief)
+        self.assertIsNone(results['192.168.1.2']['error'])
+        self.assertIn('Failed to connect to 192.168.1.3', results['192.168.1.3']['error'])
+        self.assertIsNone(results['192.168.1.3']['result'])
+
+        # The per-host timeout is passed to Netmiko
+        self.assertEqual(mock_connect_handler.call_args.kwargs['conn_timeout'], 5)
+
+    @patch('network_automation.cisco.ConnectHandler')
+    def test_fleet_error_isolation(self, mock_connect_handler):
+        connections = {}
+
+        def connect(**kwargs):
+            mock_connection = connections[kwargs['ip']] = MagicMock()
+            if kwargs['ip'] == '192.168.1.1':
+                mock_connection.send_command.side_effect = SSHException("channel closed")
+            elif kwargs['ip'] == '192.168.1.2':
+                mock_connection.send_command.side_effect = ValueError("template error")
+            else:
+                mock_connection.send_command.return_value = 'raw output'
+            return mock_connection
+
+        mock_connect_handler.side_effect = connect
+
+        inventory = ['192.168.1.1', '192.168.1.2', '192.168.1.3']
+        commands = ['show version', 'show ip interface brief']
+        results = {x['hostname']: x for x in run_fleet_commands(inventory, commands, parse=False, timeout=5)}
+
+        # Errors of one host don't stop the others
+        self.assertEqual(results['192.168.1.1']['error'], 'channel closed')
+        self.assertEqual(results['192.168.1.2']['error'], 'template error')
+        self.assertEqual(results['192.168.1.3']['result'], {x: 'raw output' for x in commands})
+
+        # The commands of a host share its timeout, each one gets the time left
+        read_timeouts = [x.kwargs['read_timeout'] for x in connections['192.168.1.3'].send_command.call_args_list]
+        self.assertEqual(len(read_timeouts), 2)
+        self.assertTrue(5 >= read_timeouts[0] >= read_timeouts[1] > 0)
+
+    @patch('network_automation.cisco.ConnectHandler')
+    def test_fleet_duplicate_hostnames(self, mock_connect_handler):
+        connections = {}
+
+        def connect(**kwargs):
+            mock_connection = connections[kwargs['username']] = MagicMock()
+            if kwargs['username'] == 'slow':
+                # The command hangs until the session is closed
+                closed = threading.Event()
+                mock_connection.disconnect.side_effect = closed.set
+                mock_connection.send_command.side_effect = lambda *args, **kwargs: closed.wait(10) and 'closed'
+            else:
+                mock_connection.send_command.return_value = 'raw output'
+            return mock_connection
+
+        mock_connect_handler.side_effect = connect
+
+        inventory = [{'hostname': '192.168.1.1', 'username': 'slow'}, {'hostname': '192.168.1.1', 'username': 'fast'}]
+        started = time.monotonic()
+        results = list(run_fleet_commands(inventory, ['show version'], parse=False, timeout=1))
+
+        # Each entry gets its own result and deadline, and the session of the entry which timed out is closed
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([x['hostname'] for x in results], ['192.168.1.1', '192.168.1.1'])
+        self.assertEqual(sorted(str(x['error']) for x in results), ['None', 'Timed out after 1 seconds'])
+        self.assertIn({'show version': 'raw output'}, [x['result'] for x in results])
+        connections['slow'].disconnect.assert_called()
+
+    @patch('network_automation.cisco.ConnectHandler')
+    def test_ssh_exception_on_connect(self, mock_connect_handler):
+        mock_connect_handler.side_effect = SSHException("Error reading SSH protocol banner")
+
+        with self.assertRaises(ConnectionError):
+            CiscoSSHDevice('192.168.1.1', username='admin', password='password')
+
+
+class TestSSHConnectionPool(unittest.TestCase):
+    @patch('network_automation.cisco.ConnectHandler')
+    def test_session_reuse(self, mock_connect_handler):
+        mock_connection = MagicMock()
+        mock_connection.is_alive.return_value = True
+        mock_connect_handler.return_value = mock_connection
+
+        with SSHConnectionPool(keepalive_interval=0) as pool:
+            with CiscoSSHDevice(hostname='192.168.1.1', username='user', password='pass', pool=pool) as device:
+                self.assertIs(device.conn, mock_connection)
+            with CiscoSSHDevice(hostname='192.168.1.1', username='user', password='pass', pool=pool):
+                pass
+
+            # The second device borrowed the idle session instead of connecting again
+            mock_connect_handler.assert_called_once()
+            mock_connection.disconnect.assert_not_called()
+
+        # Closing the pool closes the idle sessions
+        mock_connection.disconnect.assert_called_once()
+
+    @patch('network_automation.cisco.ConnectHandler')
+    def test_dead_session_is_replaced(self, mock_connect_handler):
+        dead_connection, new_connection = MagicMock(), MagicMock()
+        dead_connection.is_alive.return_value = False
+        mock_connect_handler.side_effect = [dead_connection, new_connection]
+
+        pool = SSHConnectionPool(keepalive_interval=0)
+        netmiko_device = {'ip': '192.168.1.1', 'device_type': 'cisco_ios', 'username': 'user', 'password': 'pass'}
+
+        pool.release(pool.acquire(netmiko_device))
+        self.assertIs(pool.acquire(netmiko_device), new_connection)
+        dead_connection.disconnect.assert_called_once()
+
+    @patch('network_automation.cisco.ConnectHandler')
+    def test_expired_session_and_limits(self, mock_connect_handler):
+        old_connection, new_connection = MagicMock(), MagicMock()
+        mock_connect_handler.side_effect = [old_connection, new_connection]
+
+        pool = SSHConnectionPool(max_idle=60, keepalive_interval=0, max_per_device=1, acquire_timeout=0.1)
+        netmiko_device = {'ip': '192.168.1.1', 'device_type': 'cisco_ios', 'username': 'user', 'password': 'pass'}
+
+        conn = pool.acquire(netmiko_device)
+        # The session in use counts against the limit of the device
+        with self.assertRaises(ConnectionError):
+            pool.acquire(netmiko_device)
+
+        pool.release(conn)
+        # Releasing twice does nothing
+        pool.release(conn)
+
+        # A session idle for longer than max_idle is closed instead of reused
+        key = pool._key(netmiko_device)
+        pool._idle[key] = [(conn, pool._idle[key][0][1] - 61)]
+        self.assertIs(pool.acquire(netmiko_device), new_connection)
+        old_connection.disconnect.assert_called_once()
+        self.assertEqual(pool._open[key], 1)
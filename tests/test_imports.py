@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+import network_automation
+
+src_dir = os.path.dirname(os.path.dirname(network_automation.__file__))
+
+IMPORT_SCRIPT = """
+import json, sys
+import network_automation.cisco, network_automation.environment, network_automation.parsing, network_automation.utils
+print(json.dumps({"modules": sorted(sys.modules)}))
+"""
+
+
+def run_import_script(cwd):
+    env = {**os.environ, "PYTHONPATH": src_dir}
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd=cwd, env=env)
+    return json.loads(output)
+
+
+def test_import_has_no_side_effects(tmp_path):
+    result = run_import_script(tmp_path)
+
+    # The heavy dependencies are imported when a class is instantiated, not on import
+    for module in ("netmiko", "paramiko", "dotenv", "requests", "pynetbox"):
+        assert module not in result["modules"], f"{module} is imported on import of network_automation"
+    # The log file is only opened on first use
+    assert not (tmp_path / "network_automation.log").exists()
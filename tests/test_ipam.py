@@ -0,0 +1,34 @@
+import pytest
+from network_automation.ipam import PrefixIndex, parse_address
+
+
+def test_parse_address():
+    assert parse_address("10.0.0.1/24") == (4, 0x0A000001, 24)
+    assert parse_address("10.0.0.1") == (4, 0x0A000001, 32)
+    assert parse_address("2001:db8::/32") == (6, 0x20010DB8 << 96, 32)
+
+    with pytest.raises(ValueError):
+        parse_address("10.0.0.0/33")
+
+
+def test_longest_prefix_match():
+    index = PrefixIndex(["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "0.0.0.0/0", "2001:db8::/32"])
+
+    assert len(index) == 5
+    assert index.lookup("10.1.2.3/32") == "10.1.2.0/24"
+    assert index.lookup("10.1.3.3") == "10.1.0.0/16"
+    assert index.lookup("10.200.0.1") == "10.0.0.0/8"
+    assert index.lookup("192.168.0.1") == "0.0.0.0/0"
+    assert index.lookup("2001:db8:1::1/64") == "2001:db8::/32"
+    assert index.lookup("2001:db9::1") is None
+
+
+def test_vrf_separation():
+    index = PrefixIndex()
+    index.add("10.0.0.0/16", vrf=1, value="blue")
+    index.add("10.0.0.0/24")
+
+    assert index.lookup("10.0.1.1", vrf=1) == "blue"
+    assert index.contains("10.0.1.1") is False
+    assert index.contains("10.0.0.1") is True
+    assert index.contains("10.0.0.1", vrf=2) is False
@@ -0,0 +1,40 @@
+import json
+import pytest
+from network_automation.jsonstream import JSONArrayStream
+
+
+def test_json_array_stream():
+    document = {"totalCount": "3", "imdata": [{"fvTenant": {"attributes": {"name": f"tenant-{x}"}}} for x in range(3)]}
+    raw = json.dumps(document).encode()
+
+    # Feed the document in very small chunks, splitting values and numbers
+    stream = JSONArrayStream((raw[x:x + 5] for x in range(0, len(raw), 5)), "imdata")
+
+    assert list(stream) == document["imdata"]
+    assert stream.extra == {"totalCount": "3"}
+
+
+def test_json_array_stream_split_values():
+    document = {"imdata": [{"descr": 'quoted \\"]}\\ text' * 50, "ports": [1, 2.5e3, True, None]}, 42, "end"]}
+    raw = json.dumps(document).encode()
+
+    # Strings with escapes and brackets, numbers and literals split at every position
+    for size in (1, 2, 3, 7):
+        assert list(JSONArrayStream((raw[x:x + size] for x in range(0, len(raw), size)), "imdata")) == \
+            document["imdata"]
+
+
+def test_json_array_stream_truncated():
+    with pytest.raises(ValueError):
+        list(JSONArrayStream([b'{"imdata": [{"a": 1},'], "imdata"))
+
+
+def test_json_array_stream_empty_and_invalid():
+    stream = JSONArrayStream([b'{"imdata": [], "totalCount": "0"}'], "imdata")
+
+    assert list(stream) == []
+    assert stream.extra == {"totalCount": "0"}
+    assert list(JSONArrayStream([b'{}'], "imdata")) == []
+
+    with pytest.raises(ValueError):
+        list(JSONArrayStream([b'[{"a": 1}]'], "imdata"))
@@ -0,0 +1,127 @@
+import re
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from network_automation import metrics, parsing
+from network_automation.cache import new_session
+from tests.test_parsing import IP_INT_BRIEF
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = b'{"imdata": []}'
+        self.send_response(200 if not self.path.startswith("/missing") else 404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+
+class MockTracer:
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, start_time=None, attributes=None):
+        tracer = self
+
+        class Span:
+            def end(self, end_time=None):
+                tracer.spans.append((name, start_time, end_time, attributes))
+
+        return Span()
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def tracer():
+    tracer = MockTracer()
+    metrics.reset()
+    metrics.enable(tracer=tracer)
+    yield tracer
+    metrics.disable()
+    metrics.reset()
+
+
+def sample(text, line):
+    match = re.search('^' + re.escape(line) + r' (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+def test_disabled_by_default(server):
+    metrics.reset()
+    session = new_session(client="apic")
+    session.get(server.url + "/api/node/class/fvTenant.json")
+
+    with metrics.registry.time_connect("apic"):
+        pass
+
+    assert metrics.registry.request_duration.get(("apic", "/api/node/class/fvTenant.json", "GET", "200")) == (0, 0)
+    assert metrics.registry.connect_duration.get(("apic",)) == (0, 0)
+
+
+def test_endpoint_name():
+    assert metrics.endpoint_name("https://apic/api/node/mo/topology/pod-1/node-101/sys.json?rsp-subtree=full") == \
+        "/api/node/mo/topology/pod-{id}/node-{id}/sys.json"
+    assert metrics.endpoint_name("/dataservice/template/policy/definition/zonebasedfw/"
+                                 "a1b2c3d4-0000-1111-2222-333344445555") == \
+        "/dataservice/template/policy/definition/zonebasedfw/{id}"
+    assert metrics.endpoint_name("show interface") == "show interface"
+
+
+def test_session_requests(server, tracer):
+    session = new_session(client="apic")
+    session.get(server.url + "/api/node/mo/topology/pod-1/node-101.json")
+    session.get(server.url + "/api/node/mo/topology/pod-1/node-102.json")
+    session.post(server.url + "/api/aaaLogin.json", json={"user": "admin"})
+    session.get(server.url + "/missing")
+
+    text = metrics.export_prometheus()
+    labels = 'client="apic",endpoint="/api/node/mo/topology/pod-{id}/node-{id}.json",method="GET",status="200"'
+
+    # The node requests share one endpoint, the histogram buckets are cumulative
+    assert sample(text, f"network_automation_request_duration_seconds_count{{{labels}}}") == 2
+    assert sample(text, f'network_automation_request_duration_seconds_bucket{{{labels},le="+Inf"}}') == 2
+    assert sample(text, f"network_automation_request_duration_seconds_sum{{{labels}}}") > 0
+    assert sample(text, 'network_automation_response_bytes_total{client="apic",'
+                        'endpoint="/api/node/mo/topology/pod-{id}/node-{id}.json"}') == 28
+    assert sample(text, 'network_automation_request_bytes_total{client="apic",endpoint="/api/aaaLogin.json"}') == 17
+    assert metrics.registry.request_duration.get(("apic", "/missing", "GET", "404"))[0] == 1
+    assert "# TYPE network_automation_request_duration_seconds histogram" in text
+
+    assert len(tracer.spans) == 4
+    name, start, end, attributes = tracer.spans[0]
+    assert name == "apic GET /api/node/mo/topology/pod-{id}/node-{id}.json"
+    assert end >= start
+    assert attributes["status"] == "200"
+
+
+def test_parse_and_connect_time(tracer):
+    parsing.parse_output("cisco_ios", "show ip interface brief", IP_INT_BRIEF)
+    with pytest.raises(ConnectionError):
+        with metrics.registry.time_connect("cisco_ssh"):
+            raise ConnectionError("refused")
+    metrics.registry.count_retry("vmanage", "session_expired")
+
+    assert metrics.registry.parse_duration.get(("cisco_ios", "show ip interface brief"))[0] == 1
+    assert metrics.registry.connect_duration.get(("cisco_ssh",))[0] == 1
+    assert metrics.registry.retries.get(("vmanage", "session_expired")) == 1
+    assert tracer.spans[1][3] == {"client": "cisco_ssh", "error": "ConnectionError"}
@@ -1,9 +1,14 @@
 import json
 import os
+import threading
 import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from mydict import MyDict
 from unittest.mock import MagicMock
-from network_automation.netbox import NetBoxInstance
+from urllib.parse import urlsplit, parse_qs
+from pynetbox import ContentError, RequestError
+from network_automation.cache import ResponseCache
+from network_automation.netbox import NetBoxInstance, NetBoxSync
 
 current_dir = os.path.dirname(__file__)
 
@@ -12,8 +17,62 @@ test_file_path = os.path.join(current_dir, 'mock_data_netbox.json')
 with open(test_file_path, "r") as f:
     netbox_data = json.load(f)
     mock_devices = [MyDict(x) for x in netbox_data["devices"]]
-    mock_prefixes = [MyDict(x) for x in netbox_data["prefixes"]]
-    mock_ip_addresses = [MyDict(x) for x in netbox_data["ip_addresses"]]
+
+
+def mock_http_session(tables, max_page_size=1000):
+    """Returns a mock session which serves the tables (endpoint path -> objects) with limit/offset pagination"""
+    def get(url, headers=None, params=None, **kwargs):
+        objects = tables[url.split("/api/")[1].strip("/")]
+        limit = min(int(params.get("limit", 50)), max_page_size)
+        offset = int(params.get("offset", 0))
+        response = MagicMock(ok=True)
+        response.json.return_value = {"count": len(objects), "results": objects[offset:offset + limit],
+                                      "next": f"{url}?offset={offset + limit}" if offset + limit < len(objects)
+                                      else None}
+        return response
+
+    session = MagicMock()
+    session.get.side_effect = get
+    return session
+
+
+class MockNetBoxHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        self.server.requests.append((url.path, self.headers.get("Authorization")))
+
+        if url.path == "/api/dcim/sites/":
+            status, data = 500, {"detail": "Server error"}
+        elif url.path == "/api/dcim/regions/":
+            status, data = 200, "<html>Maintenance</html>"
+        else:
+            objects = [{"id": x, "address": f"10.0.0.{x}/24"} for x in range(1, 6)]
+            offset, limit = int(query["offset"][0]), int(query["limit"][0])
+            status, data = 200, {"count": len(objects), "results": objects[offset:offset + limit],
+                                 "next": "more" if offset + limit < len(objects) else None}
+
+        body = (data if isinstance(data, str) else json.dumps(data)).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def netbox_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockNetBoxHandler)
+    server.daemon_threads = True
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
 
 
 class TestNetBox:
@@ -22,16 +81,9 @@ class TestNetBox:
         # Create a mock dcim object and mock the devices.all() method
         mock_dcim = MagicMock()
         mock_dcim.devices.all.return_value = mock_devices
+        mock_dcim.devices.filter.side_effect = lambda **kwargs: iter(mock_devices)
         return mock_dcim
 
-    @pytest.fixture
-    def mock_ipam(self):
-        # Create a mock ipam object and mock the prefixes.all() method
-        mock_ipam = MagicMock()
-        mock_ipam.prefixes.all.return_value = mock_prefixes
-        mock_ipam.ip_addresses.all.return_value = mock_ip_addresses
-        return mock_ipam
-
     def test_duplicated_device_serials(self, mock_dcim):
         """Test for checking duplicated device serials in NetBox."""
         # Create an instance of NetBoxInstance
@@ -44,20 +96,195 @@ class TestNetBox:
         duplicates = instance.duplicated_device_serials()
 
         # Assertions
-        assert duplicates == ["ABC123"], "Should detect the duplicated serial 'ABC123'"
-        mock_dcim.devices.all.assert_called_once()  # Ensure the mock was called
+        assert list(duplicates) == ["ABC123"], "Should detect the duplicated serial 'ABC123'"
+        assert duplicates["ABC123"] == [{"id": 16, "name": "dmi01-binghamton-sw01"}, {"id": None, "name": "Device3"}]
+        # Ensure the devices were streamed with only the required fields
+        mock_dcim.devices.filter.assert_called_once_with(fields="id,name,serial")
 
-    def test_ip_addresses_without_network(self, mock_ipam):
+    def test_ip_addresses_without_network(self):
         # Create an instance of NetBoxInstance
-        instance = NetBoxInstance(url="http://fake-url", token="fake-token")
+        instance = NetBoxInstance(url="http://fake-url", token="fake-token", page_size=2)
 
-        # Inject the mock ipam object into the instance
-        instance.ipam = mock_ipam
+        # Serve the prefixes and IP addresses from a mock session
+        instance.http_session = mock_http_session({"ipam/prefixes": netbox_data["prefixes"],
+                                                   "ipam/ip-addresses": netbox_data["ip_addresses"]})
 
         # Call the method under test
         orphan_ip_addresses = instance.get_ip_addresses_without_prefix()
 
         # Assertions
         assert orphan_ip_addresses == ["10.14.2.80/28"]
-        mock_ipam.prefixes.all.assert_called_once()  # Ensure the mock was called
-        mock_ipam.ip_addresses.all.assert_called_once()  # Ensure the mock was called
+        # Only the fields needed for the check are requested
+        assert all(x.kwargs["params"]["fields"] in ("id,prefix,vrf", "id,address,vrf")
+                   for x in instance.http_session.get.call_args_list)
+
+    def test_iter_all(self):
+        instance = NetBoxInstance(url="http://fake-url", token="fake-token", max_workers=3)
+        ip_addresses = [{"id": x, "address": f"10.0.{x // 256}.{x % 256}/16"} for x in range(2500)]
+        # NetBox returns at most 1000 objects per page, whatever the requested limit
+        instance.http_session = mock_http_session({"ipam/ip-addresses": ip_addresses}, max_page_size=1000)
+
+        result = list(instance.iter_all("ipam.ip_addresses", brief=True, page_size=5000, status="active"))
+
+        # The objects are returned in order, and the pages after the first one are requested by offset
+        assert result == ip_addresses
+        params = [x.kwargs["params"] for x in instance.http_session.get.call_args_list]
+        assert [(x["offset"], x["limit"]) for x in params] == [(0, 5000), (1000, 1000), (2000, 1000)]
+        assert all(x["brief"] == "true" and x["status"] == "active" for x in params)
+        assert instance.http_session.get.call_args.kwargs["headers"]["authorization"] == "Token fake-token"
+
+    def test_bulk_assign_primary_ip(self):
+        instance = NetBoxInstance(url="http://fake-url", token="fake-token")
+        instance.dcim = MagicMock()
+        instance.ipam = MagicMock()
+
+        instance.dcim.devices.filter.return_value = [
+            MyDict({"id": 1, "name": "sw01"}),
+            MyDict({"id": 2, "name": "sw02"}),
+            MyDict({"id": 3, "name": "sw03"}),
+        ]
+        instance.ipam.ip_addresses.filter.return_value = [
+            MyDict({"id": 10, "address": "10.0.0.1/24", "assigned_object": {"device": {"id": 1}}}),
+            MyDict({"id": 11, "address": "2001:db8::2/64", "assigned_object": {"device": {"id": 2}}}),
+            MyDict({"id": 12, "address": "10.0.0.2/24", "assigned_object": {"device": {"id": 2}}}),
+        ]
+
+        # Dry run computes the changes but doesn't write anything
+        summary = instance.bulk_assign_primary_ip(dry_run=True)
+        assert summary["changes"] == [{"id": 1, "name": "sw01", "address": "10.0.0.1/24", "primary_ip4": 10}]
+        assert summary["multiple_ips"] == ["sw02"]
+        assert summary["no_ips"] == ["sw03"]
+        instance.dcim.devices.update.assert_not_called()
+        instance.ipam.ip_addresses.filter.assert_called_once_with(assigned_object_type="dcim.interface")
+
+        summary = instance.bulk_assign_primary_ip(chunk_size=1)
+        instance.dcim.devices.update.assert_called_once_with([{"id": 1, "primary_ip4": 10}])
+        assert summary["failed"] == []
+
+    def test_get_prefixes(self):
+        instance = NetBoxInstance(url="http://fake-url", token="fake-token")
+        response = MagicMock(ok=True)
+        response.json.return_value = {"count": 2, "next": None, "results": netbox_data["prefixes"][:2]}
+        instance.http_session = MagicMock()
+        instance.http_session.get.return_value = response
+
+        prefixes = instance.get_prefixes(compact=True, vrf_id="null")
+
+        assert [x.prefix for x in prefixes] == ["10.14.3.0/24", "10.13.0.0/16"]
+        assert prefixes[0].status["value"] == "active"
+        assert instance.http_session.get.call_args.kwargs["params"] == {"vrf_id": "null", "limit": 1000, "offset": 0}
+
+    def test_sync(self):
+        instance = NetBoxInstance(url="http://fake-url", token="fake-token")
+        existing = [
+            {"id": 1, "name": "sw01", "serial": "S1", "status": {"value": "active", "label": "Active"},
+             "site": {"id": 3, "name": "dc1"}},
+            {"id": 2, "name": "sw02", "serial": "S2", "status": {"value": "active", "label": "Active"},
+             "site": {"id": 3, "name": "dc1"}},
+            {"id": 3, "name": "sw03", "serial": "S3", "status": {"value": "active", "label": "Active"},
+             "site": {"id": 3, "name": "dc1"}},
+        ]
+        response = MagicMock(ok=True)
+        response.json.return_value = {"count": 3, "next": None, "results": existing}
+        instance.http_session = MagicMock()
+        instance.http_session.get.return_value = response
+        instance.dcim = MagicMock()
+        instance.dcim.devices.url = "http://fake-url/api/dcim/devices"
+
+        sync = NetBoxSync(instance, "dcim.devices", key="serial", filters={"site_id": 3}, delete=True,
+                          chunk_size=1)
+        discovered = [
+            {"serial": "S1", "name": "sw01", "status": "active", "site": 3},
+            {"serial": "S2", "name": "sw02-new", "status": "active", "site": 3},
+            {"serial": "S4", "name": "sw04", "status": "planned", "site": 3},
+        ]
+
+        summary = sync.sync(discovered, dry_run=True)
+        assert summary["create"] == [{"serial": "S4", "name": "sw04", "status": "planned", "site": 3}]
+        # Only the changed fields are sent, related objects and choices are compared by ID and value
+        assert summary["update"] == [{"id": 2, "name": "sw02-new"}]
+        assert summary["delete"] == [3]
+        assert summary["unchanged"] == 1
+        assert instance.http_session.get.call_args.kwargs["params"]["site_id"] == 3
+        instance.dcim.devices.create.assert_not_called()
+
+        summary = sync.sync(discovered)
+        instance.dcim.devices.delete.assert_called_once_with([3])
+        instance.dcim.devices.update.assert_called_once_with([{"id": 2, "name": "sw02-new"}])
+        instance.dcim.devices.create.assert_called_once_with([discovered[2]])
+        assert summary["deleted"] == [3]
+        assert summary["failed"] == []
+
+        # Without changes, nothing is written
+        instance.dcim.reset_mock()
+        summary = sync.sync(discovered[:1] + [{"serial": "S2", "name": "sw02", "status": "active", "site": 3},
+                                              {"serial": "S3", "name": "sw03", "status": "active", "site": 3}])
+        assert summary["unchanged"] == 3
+        instance.dcim.devices.create.assert_not_called()
+        instance.dcim.devices.update.assert_not_called()
+        instance.dcim.devices.delete.assert_not_called()
+
+    def test_sync_nested_fields(self):
+        instance = MagicMock()
+        instance.dcim.devices.url = "http://fake-url/api/dcim/devices"
+        tags = [{"id": 7, "name": "core", "slug": "core"}, {"id": 8, "name": "dc1", "slug": "dc1"}]
+        existing = {
+            ("S1",): {"id": 1, "serial": "S1", "site": {"id": 3, "name": "dc1"}, "tags": tags,
+                      "custom_fields": {"owner": "netops", "rack_unit": None}},
+            ("S2",): {"id": 2, "serial": "S2", "site": {"id": 3, "name": "dc1"}, "tags": tags},
+        }
+        sync = NetBoxSync(instance, "dcim.devices", key="serial")
+
+        plan = sync.diff([
+            # Related objects given as objects, tags by name or ID and in another order
+            {"serial": "S1", "site": {"id": 3}, "tags": [{"name": "dc1"}, {"name": "core"}],
+             "custom_fields": {"owner": "netops"}},
+            {"serial": "S2", "site": 3, "tags": [8]},
+        ], existing)
+
+        assert plan["unchanged"] == 1
+        assert plan["update"] == [{"id": 2, "tags": [8]}]
+
+        # A failed chunk is recorded whatever the error, the other steps still run
+        instance.dcim.devices.update.side_effect = ValueError("Unexpected response")
+        summary = sync.apply({"create": [{"serial": "S3"}], "update": plan["update"], "delete": []})
+        assert summary["failed"] == [{"action": "update", "object": {"id": 2, "tags": [8]},
+                                      "error": "Unexpected response"}]
+        assert summary["created"] == [{"serial": "S3"}]
+
+    def test_sync_related_key(self):
+        instance = MagicMock()
+        instance.dcim.interfaces.url = "http://fake-url/api/dcim/interfaces"
+        sw1 = {"id": 1, "name": "sw1", "display": "sw1"}
+        existing = [{"id": 10, "name": "Gi1", "device": sw1}, {"id": 11, "name": "Gi2", "device": sw1}]
+        instance.iter_all.return_value = existing
+        sync = NetBoxSync(instance, "dcim.interfaces", key=("device", "name"))
+
+        # The devices of the key are given by name or by ID
+        plan = sync.diff([
+            {"device": {"name": "sw1"}, "name": "Gi1", "description": "uplink"},
+            {"device": {"name": "sw2"}, "name": "Gi1"},
+            {"device": 1, "name": "Gi2"},
+        ])
+
+        assert plan["update"] == [{"id": 10, "description": "uplink"}]
+        assert plan["create"] == [{"device": {"name": "sw2"}, "name": "Gi1"}]
+        assert plan["unchanged"] == 1
+
+    def test_iter_all_bypasses_cache(self, netbox_server):
+        cache = ResponseCache(ttls={r"/api/": 3600})
+        instance = NetBoxInstance(url=f"http://127.0.0.1:{netbox_server.server_address[1]}", token="fake-token",
+                                  cache=cache, page_size=2)
+
+        addresses = [x["address"] for x in instance.iter_all("ipam.ip_addresses")]
+
+        assert addresses == [f"10.0.0.{x}/24" for x in range(1, 6)]
+        assert netbox_server.requests[0] == ("/api/ipam/ip-addresses/", "Token fake-token")
+        # The bulk pages are neither served from nor stored in the response cache
+        assert cache.stats() == {"hits": 0, "misses": 0, "revalidations": 0, "entries": 0}
+
+        # Failed requests raise the pynetbox errors
+        with pytest.raises(RequestError):
+            list(instance.iter_all("dcim.sites"))
+        with pytest.raises(ContentError):
+            list(instance.iter_all("dcim.regions"))
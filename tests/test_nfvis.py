@@ -1,9 +1,11 @@
 import json
 import os
 import pytest
+import requests
+import time
 from mydict import MyDict
-from network_automation.nfvis import NFVISServer
-from unittest.mock import patch
+from network_automation.nfvis import NFVISServer, collect_nfvis_inventory, prefetch_platform_details
+from unittest.mock import patch, MagicMock
 
 current_dir = os.path.dirname(__file__)
 
@@ -31,7 +33,7 @@ class TestNFVIS:
         # Inject the mock nfvis object into the instance
         instance.platform = get_mock_data['platform_info:platform-detail']
 
-        mock_method.assert_called_once()  # Ensure the mock was called
+        mock_method.assert_not_called()  # The platform details are fetched lazily
 
         # Call the method under test
         serial = instance.get_serial()
@@ -77,7 +79,7 @@ class TestNFVIS:
 
         # Ensure get_interfaces was called once
         mock_get_interfaces.assert_called_once()
-        mock_get_platform_details.assert_called_once()
+        mock_get_platform_details.assert_not_called()
 
         # Assertions
         assert isinstance(interfaces, list)  # Ensure the result is a list
@@ -104,7 +106,7 @@ class TestNFVIS:
 
         # Ensure get_interfaces was called once
         mock_get_switch_interfaces.assert_called_once()
-        mock_get_platform_details.assert_called_once()
+        mock_get_platform_details.assert_not_called()
 
         # Assertions
         assert isinstance(switchports, list)  # Ensure the result is a list
@@ -131,10 +133,120 @@ class TestNFVIS:
 
         # Ensure get_interfaces was called once
         mock_get_switchport_status.assert_called_once()
-        mock_get_platform_details.assert_called_once()
+        mock_get_platform_details.assert_not_called()
 
         # Assertions
         assert isinstance(switchports, list)  # Ensure the result is a list
         assert len(switchports) == 2  # Ensure correct number of interfaces
         assert switchports[0]["switchport-mode"] == "enable"
         assert switchports[1]["adminstrative-mode"] == "access"
+
+
+class TestNFVISFleet:
+    @pytest.fixture
+    def mock_session(self):
+        def get(uri, headers=None, timeout=None):
+            hostname = uri.split('/')[2]
+            if hostname == "unreachable":
+                raise requests.exceptions.ConnectionError("Connection refused")
+            if hostname == "slow":
+                time.sleep(1)
+            if hostname == "timeout":
+                raise requests.exceptions.ReadTimeout("Read timed out")
+            if hostname == "unauthorized":
+                return MagicMock(status_code=401, text=json.dumps({"errors": {"error": [{"error-message": "denied"}]}}))
+            if hostname == "maintenance":
+                return MagicMock(status_code=503, text="<html>Service Unavailable</html>")
+
+            if uri.endswith('platform-detail'):
+                data = {"platform_info:platform-detail": netbox_data["platform_info:platform-detail"]}
+            elif '/pnics' in uri:
+                data = {"pnic:pnics": netbox_data["pnic:pnics"]}
+            elif '/status' in uri:
+                data = {"switch:status": netbox_data["switch:status"]}
+            else:
+                data = {"switch:switchPort": netbox_data["switch:switchPort"]}
+
+            return MagicMock(status_code=200, text=json.dumps(data))
+
+        with patch("network_automation.nfvis.requests.Session") as session:
+            session.return_value.get.side_effect = get
+            yield session.return_value
+
+    def test_collect_nfvis_inventory(self, mock_session):
+        inventory = collect_nfvis_inventory(["encs1", "unreachable", "encs2"], username="admin", password="password")
+
+        # The inventory is in the order of the hostnames and a failed host doesn't stop the others
+        assert list(inventory) == ["encs1", "unreachable", "encs2"]
+        assert inventory["encs1"]["error"] is None
+        assert inventory["encs1"]["serial"] == "FGL3913OTVX"
+        assert inventory["encs2"]["interfaces"][1]["name"] == "eth0-2"
+        assert len(inventory["encs2"]["switchports"]["port-channel"]) == 2
+        assert inventory["unreachable"]["error"] == "Could not connect to unreachable"
+        assert inventory["unreachable"]["interfaces"] is None
+
+    def test_collect_nfvis_inventory_error_body(self, mock_session):
+        inventory = collect_nfvis_inventory(["encs1", "unauthorized", "encs2"], username="admin", password="password")
+
+        # A server answering with an error body doesn't stop the others
+        assert inventory["unauthorized"]["error"]
+        assert inventory["unauthorized"]["serial"] is None
+        assert inventory["encs1"]["error"] is None
+        assert inventory["encs2"]["serial"] == "FGL3913OTVX"
+
+    def test_collect_nfvis_inventory_timeout(self, mock_session):
+        started = time.monotonic()
+        inventory = collect_nfvis_inventory(["slow", "encs1"], username="admin", password="password", timeout=0.2)
+
+        assert time.monotonic() - started < 1
+        assert inventory["slow"]["error"] == "Timed out after 0.2 seconds"
+        assert inventory["encs1"]["error"] is None
+        assert mock_session.get.call_args.kwargs["timeout"] == 0.2
+
+    def test_lazy_platform_details(self, mock_session):
+        servers = [NFVISServer(x, username="admin", password="password", platform_ttl=60) for x in ["encs1", "encs2"]]
+
+        # Creating the servers doesn't connect to them
+        mock_session.get.assert_not_called()
+
+        assert servers[0].get_serial() == "FGL3913OTVX"
+        assert servers[0].get_pid() == servers[0].platform["hardware_info"]["PID"]
+        assert mock_session.get.call_count == 1
+
+        # The cached details are fetched again after the TTL
+        servers[0]._platform_time -= 61
+        servers[0].get_version()
+        assert mock_session.get.call_count == 2
+
+    def test_platform_details_errors(self, mock_session):
+        servers = [NFVISServer(x, username="admin", password="password") for x in ["unreachable", "timeout",
+                                                                                   "maintenance", "unauthorized"]]
+
+        # The getters return empty values instead of raising, like before the details were fetched lazily
+        assert [x.get_serial() for x in servers] == ["", "", "", ""]
+        assert [x.get_version() for x in servers] == ["", "", "", ""]
+
+        # Failed requests and responses which could not be parsed are not cached
+        assert mock_session.get.call_count == 8
+        with pytest.raises(ConnectionError):
+            servers[0].get_platform_details()
+        with pytest.raises(ConnectionError):
+            servers[3].get_platform_details()
+
+    def test_prefetch_platform_details(self, mock_session):
+        servers = [NFVISServer(x, username="admin", password="password") for x in ["encs1", "unreachable", "encs2"]]
+
+        errors = prefetch_platform_details(servers)
+
+        assert errors == {"unreachable": "Could not connect to unreachable"}
+        assert mock_session.get.call_count == 3
+        assert [x.get_serial() for x in (servers[0], servers[2])] == ["FGL3913OTVX", "FGL3913OTVX"]
+        assert mock_session.get.call_count == 3
+
+    def test_prefetch_platform_details_error_body(self, mock_session):
+        servers = [NFVISServer(x, username="admin", password="password") for x in ["encs1", "unauthorized"]]
+
+        errors = prefetch_platform_details(servers)
+
+        assert errors == {"unauthorized": "Could not get the platform details of unauthorized, status code 401"}
+        assert servers[0].get_serial() == "FGL3913OTVX"
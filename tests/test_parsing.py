@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+from network_automation import parsing
+
+IP_INT_BRIEF = (
+    "Interface              IP-Address      OK? Method Status                Protocol\n"
+    "GigabitEthernet1       192.168.30.50   YES DHCP   up                    up\n"
+    "Loopback0              10.0.0.1        YES manual up                    up\n"
+)
+
+
+def test_parse_output():
+    parsing.clear_template_cache()
+
+    result = parsing.parse_output('cisco_ios', 'show ip interface brief', IP_INT_BRIEF)
+
+    assert len(result) == 2
+    assert result[0]['interface'] == 'GigabitEthernet1'
+    assert result[0]['ip_address'] == '192.168.30.50'
+    assert result[1]['status'] == 'up'
+
+
+def test_template_cache():
+    parsing.clear_template_cache()
+
+    template = parsing.get_template('cisco_ios', 'show ip interface brief')
+    # The template is compiled only once and reused for the same platform and command
+    assert parsing.get_template('cisco_ios', 'show ip interface brief') is template
+    # Commands without template are cached as well
+    assert parsing.get_template('cisco_ios', 'show unknown command') is None
+    assert parsing.parse_output('cisco_ios', 'show unknown command', 'raw output') == 'raw output'
+
+
+def test_parse_in_executor():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(parsing.parse_output, 'cisco_ios', 'show ip interface brief', IP_INT_BRIEF)
+                   for _ in range(20)]
+        results = [x.result() for x in futures]
+
+    assert all(x == results[0] for x in results)
@@ -0,0 +1,102 @@
+import asyncio
+import socket
+import pytest
+from network_automation.reachability import open_icmp_socket, async_ping_sweep, tcp_probe
+from network_automation.utils import ip_sweep
+
+
+def icmp_permitted():
+    sock, _ = open_icmp_socket()
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+@pytest.fixture
+def listening_port():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def get_closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.mark.skipif(not icmp_permitted(), reason="ICMP sockets are not permitted")
+def test_icmp_sweep_localhost():
+    result = ip_sweep(["127.0.0.1", "127.0.0.2", "not-a-host.invalid"], count=3, timeout=1, method="icmp")
+
+    assert result["127.0.0.1"]["reachable"]
+    assert result["127.0.0.1"]["method"] == "icmp"
+    assert result["127.0.0.1"]["loss"] == 0
+    assert result["127.0.0.1"]["rtt"] < 100
+    assert result["127.0.0.2"]["reachable"]
+    assert result["not-a-host.invalid"] == {"reachable": False, "rtt": None, "loss": 1.0, "method": None}
+
+
+def test_tcp_sweep(listening_port):
+    result = ip_sweep(["127.0.0.1"], count=2, timeout=1, tcp_ports=[listening_port], method="tcp")
+
+    assert result["127.0.0.1"]["reachable"]
+    assert result["127.0.0.1"]["method"] == "tcp"
+    assert result["127.0.0.1"]["loss"] == 0
+
+
+def test_tcp_probe_refused_and_timeout(monkeypatch):
+    # A refused connection proves the host is alive
+    assert asyncio.run(tcp_probe("127.0.0.1", [get_closed_port()], timeout=1)) is not None
+
+    async def open_connection(host, port):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr("network_automation.reachability.asyncio.open_connection", open_connection)
+    assert asyncio.run(tcp_probe("192.0.2.1", [22, 443], timeout=0.1)) is None
+
+
+def test_tcp_probe_ports_concurrently(monkeypatch):
+    connected = []
+
+    async def open_connection(host, port):
+        connected.append(port)
+        if port == 22:
+            # A filtered port doesn't delay the answer of the next one
+            await asyncio.sleep(10)
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr("network_automation.reachability.asyncio.open_connection", open_connection)
+
+    async def probe():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        rtt = await tcp_probe("192.0.2.1", [22, 443], timeout=5)
+        return rtt, loop.time() - started
+
+    rtt, elapsed = asyncio.run(probe())
+    assert rtt is not None
+    assert elapsed < 1
+    assert connected == [22, 443]
+
+
+def test_invalid_method():
+    with pytest.raises(ValueError):
+        ip_sweep(["127.0.0.1"], method="udp")
+
+
+def test_icmp_not_permitted(monkeypatch):
+    monkeypatch.setattr("network_automation.reachability.open_icmp_socket", lambda family=None: (None, None))
+
+    with pytest.raises(PermissionError):
+        ip_sweep(["127.0.0.1"], method="icmp")
+
+    # The auto method falls back to TCP probes
+    result = asyncio.run(async_ping_sweep(["127.0.0.1"], count=1, timeout=1, tcp_ports=[get_closed_port()]))
+    assert result["127.0.0.1"]["method"] == "tcp"
+    assert result["127.0.0.1"]["reachable"]
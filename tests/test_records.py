@@ -0,0 +1,92 @@
+import json
+import os
+import pickle
+import pytest
+from collections.abc import Mapping
+from mydict import MyDict
+from network_automation.records import IOSIPInterface, VManageDevice, record_type, wrap
+
+current_dir = os.path.dirname(__file__)
+
+with open(os.path.join(current_dir, 'mock_data_vmanage.json'), "r") as f:
+    vmanage_data = json.load(f)
+
+
+def test_attribute_and_item_access():
+    device = VManageDevice.from_dict(vmanage_data["devices"][0])
+
+    assert device.host_name == "vedge1"
+    assert device["host-name"] == "vedge1"
+    assert device["host_name"] == "vedge1"
+    assert device.get("unknown") is None
+    assert device == vmanage_data["devices"][0]
+    # Missing fields return None, like MyDict
+    assert IOSIPInterface.from_dict({"interface": "Gi1"}).ip_address is None
+
+    with pytest.raises(KeyError):
+        device["unknown"]
+    with pytest.raises(AttributeError):
+        device.host_name = "vedge2"
+
+
+def test_keys_outside_of_schema():
+    row = {"interface": "Gi1", "ip_address": "10.0.0.1", "status": "up", "proto": "up", "vrf": "mgmt"}
+    interface = IOSIPInterface.from_dict(row)
+
+    assert interface.vrf == "mgmt"
+    assert interface["vrf"] == "mgmt"
+    assert interface.to_dict() == row
+    assert pickle.loads(pickle.dumps(interface)) == interface
+
+
+def test_records_have_no_dict():
+    Interface = record_type("Interface", ["interface", "link-status"])
+    interface = Interface.from_dict({"interface": "Gi1", "link-status": "up"})
+
+    assert not hasattr(interface, "__dict__")
+    assert interface.link_status == "up"
+
+
+def test_mapping_model():
+    row = {"interface": "Gi1", "ip_address": "10.0.0.1", "status": "up", "proto": "up", "vrf": "mgmt"}
+    interface = IOSIPInterface.from_dict(row)
+
+    # Records behave like the row dictionaries, not like tuples
+    assert isinstance(interface, Mapping) and not isinstance(interface, tuple)
+    assert list(interface) == list(row)
+    assert len(interface) == 5
+    assert dict(interface) == row
+    assert interface == MyDict(row)
+    assert interface != IOSIPInterface.from_dict({**row, "status": "down"})
+
+    # Like dictionaries, records are not hashable, e.g. when they hold lists
+    with pytest.raises(TypeError):
+        hash(VManageDevice.from_dict({**vmanage_data["devices"][0], "device-groups": ["core"]}))
+
+
+def test_partial_rows():
+    row = {"interface": "Gi1", "ip_address": "1.1.1.1"}
+    interface = IOSIPInterface.from_dict(row)
+
+    # A record only has the keys of its row, the missing fields are None as attributes
+    assert len(interface) == 2
+    assert list(interface) == ["interface", "ip_address"]
+    assert "status" not in interface and "ip_address" in interface
+    assert interface == row
+    assert interface.to_dict() == row
+    assert interface.status is None
+    assert interface.get("status") is None
+    assert pickle.loads(pickle.dumps(interface)) == row
+
+    with pytest.raises(KeyError):
+        interface["status"]
+
+    # A field which is present with a None value is kept
+    assert "status" in IOSIPInterface.from_dict({**row, "status": None})
+
+
+def test_wrap():
+    rows = vmanage_data["devices"]
+
+    assert all(type(x) is MyDict for x in wrap(rows, VManageDevice, compact=False))
+    assert [x.system_ip for x in wrap(rows, VManageDevice, compact=True)] == [x["system-ip"] for x in rows]
@@ -0,0 +1,55 @@
+from network_automation.timeseries import TimeSeriesStore
+
+
+def test_append_and_range():
+    store = TimeSeriesStore(metrics=["latency", "jitter"])
+
+    assert store.get_watermark("approute", "10.0.0.1") is None
+    assert store.append("approute", "10.0.0.1", []) == 0
+
+    stored = store.append("approute", "10.0.0.1", [
+        {"name": "tunnel1", "entry_time": 1000, "latency": 10, "jitter": 1},
+        {"name": "tunnel1", "entry_time": 2000, "latency": 12},
+        {"name": "tunnel2", "entry_time": 2000, "latency": 20, "jitter": 2},
+    ])
+    store.append("approute", "10.0.0.2", [{"name": "tunnel3", "entry_time": 1000, "latency": 5}])
+
+    assert stored == 3
+    assert store.get_watermark("approute", "10.0.0.1") == 2000
+    assert len(store.range("approute")) == 4
+    assert store.range("approute", device="10.0.0.1", start=2000) == [
+        {"device": "10.0.0.1", "name": "tunnel1", "entry_time": 2000, "latency": 12.0, "jitter": None},
+        {"device": "10.0.0.1", "name": "tunnel2", "entry_time": 2000, "latency": 20.0, "jitter": 2.0},
+    ]
+    assert [x["device"] for x in store.range("approute", end=2000)] == ["10.0.0.1", "10.0.0.2"]
+
+
+def test_partial_bucket_is_replaced():
+    store = TimeSeriesStore(metrics=["latency"])
+    store.append("approute", "10.0.0.1", [{"name": "tunnel1", "entry_time": 2000, "latency": 10}])
+
+    # Older buckets don't move the high-water mark back
+    store.append("approute", "10.0.0.1", [{"name": "tunnel1", "entry_time": 1000, "latency": 8},
+                                          {"name": "tunnel1", "entry_time": 2000, "latency": 11}])
+
+    assert store.get_watermark("approute", "10.0.0.1") == 2000
+    assert [x["latency"] for x in store.range("approute")] == [8.0, 11.0]
+
+
+def test_keys():
+    store = TimeSeriesStore(metrics=["latency"], keys=["state", "proto"])
+
+    # Buckets which only differ in a key are both stored
+    assert store.append("approute", "10.0.0.1", [
+        {"name": "tunnel1", "state": "up", "proto": "ipsec", "entry_time": 1000, "latency": 10},
+        {"name": "tunnel1", "state": "down", "proto": "ipsec", "entry_time": 1000, "latency": 20},
+        {"name": "tunnel1", "state": "up", "proto": "gre", "entry_time": 1000, "latency": 30},
+        {"name": "tunnel2", "entry_time": 1000, "latency": 40},
+    ]) == 4
+
+    assert store.range("approute") == [
+        {"device": "10.0.0.1", "name": "tunnel1", "state": "down", "proto": "ipsec", "entry_time": 1000, "latency": 20.0},
+        {"device": "10.0.0.1", "name": "tunnel1", "state": "up", "proto": "gre", "entry_time": 1000, "latency": 30.0},
+        {"device": "10.0.0.1", "name": "tunnel1", "state": "up", "proto": "ipsec", "entry_time": 1000, "latency": 10.0},
+        {"device": "10.0.0.1", "name": "tunnel2", "state": "", "proto": "", "entry_time": 1000, "latency": 40.0},
+    ]
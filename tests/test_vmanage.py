@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import pytest
+from unittest.mock import patch, MagicMock
+from network_automation.vmanage import VManage, AsyncVManage, TunnelMetricsCollector
+
+current_dir = os.path.dirname(__file__)
+
+test_file_path = os.path.join(current_dir, 'mock_data_vmanage.json')
+
+with open(test_file_path, "r") as f:
+    vmanage_data = json.load(f)
+
+
+def mock_response(data=None, status_code=200, content_type="application/json", headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = {"Content-Type": content_type, **(headers or {})}
+    response.json.return_value = data
+    response.text = "token" if data is None else json.dumps(data)
+    return response
+
+
+class TestVManage:
+    @pytest.fixture
+    def mock_session(self):
+        session = MagicMock()
+        session.post.return_value = mock_response(headers={"Set-Cookie": "JSESSIONID=abc; Path=/; HttpOnly"})
+        session.get.return_value = mock_response()
+
+        with patch("network_automation.vmanage.requests.Session", return_value=session):
+            yield session
+
+    def test_pooled_session(self, mock_session):
+        mock_session.request.return_value = mock_response({"data": vmanage_data["devices"]})
+
+        vmanage = VManage(host="vmanage", port=443, usr="admin", pwd="password", pool_maxsize=32)
+        devices = vmanage.get_all_devices()
+        vmanage.get_all_devices()
+
+        assert devices[0]["host-name"] == "vedge1"
+        # Authentication and requests go through the same session
+        mock_session.post.assert_called_once()
+        assert mock_session.request.call_count == 2
+        adapter = mock_session.mount.call_args.args[1]
+        assert adapter._pool_maxsize == 32
+
+    def test_reauthentication(self, mock_session):
+        login_page = mock_response(content_type="text/html;charset=UTF-8")
+        mock_session.request.side_effect = [login_page, mock_response({"data": vmanage_data["devices"]})]
+
+        vmanage = VManage(host="vmanage", port=443, usr="admin", pwd="password")
+        mock_session.post.return_value = mock_response(headers={"Set-Cookie": "JSESSIONID=def; Path=/"})
+
+        devices = vmanage.get_all_devices()
+
+        # The expired session triggers one new login and the request is retried
+        assert len(devices) == 2
+        assert mock_session.post.call_count == 2
+        assert vmanage.headers["Cookie"] == "JSESSIONID=def"
+        assert mock_session.request.call_args.kwargs["headers"]["Cookie"] == "JSESSIONID=def"
+
+    def test_async_get_zbf_policies(self, mock_session):
+        mock_session.request.side_effect = lambda method, url, **kwargs: mock_response({"definitionId": url[-3:]})
+
+        async def get_policies():
+            async with AsyncVManage(host="vmanage", port=443, usr="admin", pwd="password", concurrency=8) as vmanage:
+                return await vmanage.get_zbf_policies_by_id([f"{x:03}" for x in range(100)])
+
+        policies = asyncio.run(get_policies())
+
+        assert len(policies) == 100
+        assert policies[42].definitionId == "042"
+
+    def test_fleet_tunnel_metrics(self, mock_session):
+        rows = [
+            {"vdevice_name": "10.5.23.123", "name": "10.5.23.123:biz-internet-10.5.23.200:biz-internet", "latency": 10},
+            {"vdevice_name": "10.5.23.123", "name": "10.5.23.123:biz-internet-10.5.23.201:biz-internet", "latency": 12},
+            {"vdevice_name": "10.5.23.124", "name": "10.5.23.124:mpls-10.5.23.200:mpls", "latency": 5},
+        ]
+        mock_session.request.return_value = mock_response({"data": rows})
+
+        vmanage = VManage(host="vmanage", port=443, usr="admin", pwd="password")
+        metrics = vmanage.get_fleet_tunnel_metrics(["10.5.23.123", "10.5.23.124", "10.5.23.125"],
+                                                   remote_endpoints=["10.5.23.200", "mpls"])
+
+        # All devices are sent in one aggregation query, grouped by device
+        mock_session.request.assert_called_once()
+        query = json.loads(mock_session.request.call_args.kwargs["data"])
+        assert query["query"]["rules"][1]["value"] == ["10.5.23.123", "10.5.23.124", "10.5.23.125"]
+        assert query["aggregation"]["field"][0]["property"] == "vdevice_name"
+
+        assert [x.latency for x in metrics["10.5.23.123"]] == [10]
+        assert [x.latency for x in metrics["10.5.23.124"]] == [5]
+        assert metrics["10.5.23.125"] == []
+
+        # Single device queries keep their behavior
+        assert [x.latency for x in vmanage.get_tunnel_metrics("10.5.23.123", ["10.5.23.201"])] == [12]
+
+    def test_tunnel_metrics_endpoint_matching(self, mock_session):
+        rows = [
+            {"vdevice_name": "10.5.23.123", "name": "10.5.23.123:mpls-10.5.23.201:mpls", "latency": 10},
+            {"vdevice_name": "10.5.23.123", "name": "10.5.23.123:biz-internet-10.5.23.200:biz-internet", "latency": 12},
+        ]
+        mock_session.request.return_value = mock_response({"data": rows})
+        vmanage = VManage(host="vmanage", port=443, usr="admin", pwd="password")
+
+        metrics = vmanage.get_tunnel_metrics("10.5.23.123", ["biz-internet", "10.5.23.20", "10.5.23.201", "mpls"])
+
+        # IP addresses match exactly (10.5.23.20 doesn't match 10.5.23.200), other endpoints match as substrings. The
+        # rows keep the order of the response and are returned once, even when they match several endpoints
+        assert [x.latency for x in metrics] == [10, 12]
+        assert vmanage.get_tunnel_metrics("10.5.23.123", ["10.5.23.20"]) == []
+
+    def test_incremental_tunnel_metrics_collection(self, mock_session):
+        hour = 3600 * 1000
+        now = 100 * hour
+        mock_session.request.return_value = mock_response({"data": [
+            {"vdevice_name": "10.5.23.123", "name": "tunnel1", "entry_time": now - 2 * hour, "latency": 10},
+            {"vdevice_name": "10.5.23.123", "name": "tunnel1", "entry_time": now - hour, "latency": 12},
+            {"vdevice_name": "10.5.23.124", "name": "tunnel2", "entry_time": now - hour, "latency": 5},
+        ]})
+
+        vmanage = VManage(host="vmanage", port=443, usr="admin", pwd="password")
+        collector = TunnelMetricsCollector(vmanage, initial_hours=24)
+
+        assert collector.collect(["10.5.23.123", "10.5.23.124"], now=now) == 3
+        query = json.loads(mock_session.request.call_args.kwargs["data"])
+        assert query["query"]["rules"][0] == {"value": [str(now - 24 * hour), str(now)], "field": "entry_time",
+                                              "type": "date", "operator": "between"}
+
+        # The next collection starts at the high-water mark, so the last bucket is updated
+        mock_session.request.return_value = mock_response({"data": [
+            {"vdevice_name": "10.5.23.123", "name": "tunnel1", "entry_time": now - hour, "latency": 14},
+            {"vdevice_name": "10.5.23.124", "name": "tunnel2", "entry_time": now - hour, "latency": 6},
+        ]})
+        assert collector.collect(["10.5.23.123", "10.5.23.124"], now=now + hour) == 2
+        query = json.loads(mock_session.request.call_args.kwargs["data"])
+        assert query["query"]["rules"][0]["value"] == [str(now - hour), str(now + hour)]
+
+        assert [x["latency"] for x in collector.query("10.5.23.123")] == [10, 14]
+        assert len(collector.query(start=now - hour)) == 2
+
+        # A collector with another interval has its own series and high-water marks in the same store
+        daily = TunnelMetricsCollector(vmanage, store=collector.store, initial_hours=48, interval=24)
+        assert daily.series != collector.series
+        daily.collect(["10.5.23.123"], now=now)
+        query = json.loads(mock_session.request.call_args.kwargs["data"])
+        assert query["query"]["rules"][0]["value"] == [str(now - 48 * hour), str(now)]
+        assert [x["latency"] for x in collector.query("10.5.23.123")] == [10, 14]
+
+    def test_scroll_statistics(self, mock_session):
+        pages = [
+            {"data": [{"latency": 1}, {"latency": 2}], "pageInfo": {"scrollId": "scroll-1", "hasMoreData": True}},
+            {"data": [{"latency": 3}], "pageInfo": {"scrollId": "scroll-2", "hasMoreData": False}},
+        ]
+        mock_session.request.side_effect = [mock_response(x) for x in pages]
+
+        vmanage = VManage(host="vmanage", port=443, usr="admin", pwd="password")
+        rows = vmanage.iter_statistics("approute", query={"query": {}}, page_size=2, raw=True)
+
+        # The rows are yielded before the next page is requested
+        assert next(rows) == {"latency": 1}
+        assert mock_session.request.call_count == 1
+
+        assert [x["latency"] for x in rows] == [2, 3]
+        assert mock_session.request.call_args.args == ("POST", "https://vmanage:443/dataservice/statistics/approute/page")
+        assert mock_session.request.call_args.kwargs["params"] == {"count": 2, "scrollId": "scroll-1"}